@@ -39,6 +39,7 @@ setup(name='sponge_emp',
       url='na',
       test_suite='nose.collector',
       packages=find_packages(),
+      entry_points={'console_scripts': ['sponge_emp=sponge_emp.cli:cli']},
       package_data={'sponge_emp': ['sponge_emp/data/*', 'sponge_emp/templates/*', 'sponge_emp/static/*']},
       install_requires=[
           'click >= 6',
@@ -1,40 +1,154 @@
-from flask import Flask, g
-from .autodoc import auto
-from .sponge_emp import Sponge_Flask_Obj
-from .Site_Main_Flask import Site_Main_Flask_Obj
+import os
+import json
+import signal
+import threading
+
+from .app import create_app
 from .database import DBData
+from .datasets import DatasetManager
+from .sponge_emp import precompute_enrichment, warmup_db
 
 from .utils import debug, SetDebugLevel
 
 
-app = Flask(__name__)
-app.register_blueprint(Sponge_Flask_Obj)
-app.register_blueprint(Site_Main_Flask_Obj)
-# init the autodoc module
-auto.init_app(app)
+def get_db():
+    return datasets.get()
 
-SetDebugLevel(2)
 
-# init the global database structure
-debug(6, 'loading database...')
-# dbdata = DBData(biomfile='data/final.withtax.biom', mapfile='data/map.txt', filepath=app.root_path)
-dbdata = DBData(biomfile='data/spongeemp.sub5k.biom', mapfile='data/map.txt', filepath=app.root_path)
-dbdata.import_data()
-debug(6, 'starting server')
+def get_dataset_loader(biomfile, mapfile, snapshot=None, out_of_core=False):
+    '''Get the function loading a dataset (used on its first use and for reloading it)
+
+    Parameters
+    ----------
+    biomfile : str
+        the biom table (relative to the app directory)
+    mapfile : str
+        the mapping file (relative to the app directory)
+    snapshot : str or None (optional)
+        the precompiled snapshot directory (created using "sponge_emp build-snapshot"), used instead of the biom table if it exists
+        and was created from the current biom table and mapping file (see DBData.check_snapshot())
+    out_of_core : bool (optional)
+        True to read the (hdf5) biom table from the disk as needed (see DBData)
+
+    Returns
+    -------
+    callable
+        returns the loaded DBData
+    '''
+    def load_db():
+        db = DBData(biomfile=biomfile, mapfile=mapfile, filepath=app.root_path, out_of_core=out_of_core)
+        snapshot_dir = os.path.join(app.root_path, snapshot) if snapshot is not None else None
+        use_snapshot = snapshot_dir is not None and not out_of_core and os.path.exists(os.path.join(snapshot_dir, 'snapshot.json'))
+        if use_snapshot:
+            err = db.check_snapshot(snapshot_dir)
+            if err:
+                debug(7, 'not using the snapshot (rebuild it using "sponge_emp build-snapshot"): %s' % err)
+                use_snapshot = False
+        if use_snapshot:
+            db.load_snapshot(snapshot_dir)
+        else:
+            db.import_data()
+            # use one copy of the data for all pre-forked workers (i.e. gunicorn --preload)
+            if os.environ.get('SPONGEEMP_SHARE_DATA'):
+                db.share()
+        return db
+    return load_db
+
+
+def warmup(db):
+    '''Prepare a newly loaded database before it is served
+
+    Parameters
+    ----------
+    db : DBData
+    '''
+    # precompute the enriched sequences of all field values (so workers forked after loading share the results)
+    if os.environ.get('SPONGEEMP_PRECOMPUTE_ENRICHMENT'):
+        precompute_enrichment(db)
+    warmup_db(db)
+
+
+def add_datasets(datasets):
+    '''Add the served datasets
+
+    The rarified table ('sub5k') and the full table ('full', read from the disk) are served (if the full table exists).
+    The default dataset is the rarified table, or the full table if the environment variable SPONGEEMP_FULL_TABLE is set.
+    Additional datasets are read from the json file in the environment variable SPONGEEMP_DATASETS, containing
+    {name: {'biom': str, 'map': str, 'snapshot': str (optional), 'out_of_core': bool (optional),
+    'description': str (optional), 'pinned': bool (optional)}}
 
+    Parameters
+    ----------
+    datasets : DatasetManager
+    '''
+    full_table = bool(os.environ.get('SPONGEEMP_FULL_TABLE'))
+    datasets.add('sub5k', get_dataset_loader('data/spongeemp.sub5k.biom', 'data/map.txt', snapshot='data/spongeemp.sub5k.snapshot'),
+                 warmup=warmup, pinned=not full_table, default=not full_table, description='SpongeEMP samples rarified to 5000 reads')
+    if full_table or os.path.exists(os.path.join(app.root_path, 'data/final.withtax.biom')):
+        # the full (not rarified) table is read from the disk as needed
+        datasets.add('full', get_dataset_loader('data/final.withtax.biom', 'data/map.txt', out_of_core=True),
+                     warmup=warmup, pinned=full_table, default=full_table, description='all SpongeEMP reads')
+    if os.environ.get('SPONGEEMP_DATASETS'):
+        with open(os.environ['SPONGEEMP_DATASETS']) as fl:
+            config = json.load(fl)
+        for cname, cconfig in config.items():
+            loader = get_dataset_loader(cconfig['biom'], cconfig['map'], snapshot=cconfig.get('snapshot'), out_of_core=cconfig.get('out_of_core', False))
+            datasets.add(cname, loader, warmup=warmup, pinned=cconfig.get('pinned', False), description=cconfig.get('description', ''))
 
-# whenever a new request arrives, connect to the database and store in g.db
-@app.before_request
-def before_request():
-    global dbdata
 
-    g.db = dbdata
+def append_data(biomfile, mapfile, dataset=None):
+    '''Add the samples of a biom table and mapping file to a served dataset
 
+    The new database version is created while the current version keeps serving requests, and then replaces it.
+    Requests already running keep using the version stored in their g.db.
+    Note each (pre-forked) server process updates its own database.
 
-# and when the request is over, disconnect
-@app.teardown_request
-def teardown_request(exception):
-    pass
+    Parameters
+    ----------
+    biomfile : str
+        the biom table of the new samples
+    mapfile : str
+        the mapping file of the new samples
+    dataset : str or None (optional)
+        the dataset to add the samples to. None (default) for the default dataset
+
+    Returns
+    -------
+    DBData
+        the new database version
+    '''
+    datasets.get(dataset)
+    registry = datasets.get_registry(dataset)
+    registry.append(biomfile, mapfile, wait=True)
+    datasets.update_memory(dataset)
+    return registry.get()
+
+
+def _reload_on_signal(signum, frame):
+    # the registry lock may be held by the interrupted code, so reload from another thread
+    for cname in datasets.names():
+        registry = datasets.get_registry(cname)
+        if registry.get() is not None:
+            threading.Thread(target=registry.reload, name='database-reload-signal', daemon=True).start()
+
+
+# the served datasets (loaded on first use. SPONGEEMP_MAX_DATASET_MEMORY bytes limits the memory of the loaded datasets)
+max_bytes = os.environ.get('SPONGEEMP_MAX_DATASET_MEMORY')
+datasets = DatasetManager(max_bytes=int(float(max_bytes)) if max_bytes else None)
+
+app = create_app(config={'ADMIN_TOKEN': os.environ.get('SPONGEEMP_ADMIN_TOKEN')}, datasets=datasets)
+
+SetDebugLevel(2)
+
+# init the global database structure
+debug(6, 'loading database...')
+add_datasets(datasets)
+# load the default dataset before serving (the other datasets are loaded on first use)
+datasets.get()
+# reload the loaded datasets on SIGHUP (in a single process server. pre-forked workers reset the signal handlers)
+if hasattr(signal, 'SIGHUP') and threading.current_thread() is threading.main_thread():
+    signal.signal(signal.SIGHUP, _reload_on_signal)
+debug(6, 'starting server')
 
 
 if __name__ == '__main__':
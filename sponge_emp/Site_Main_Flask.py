@@ -1,19 +1,43 @@
-from io import TextIOWrapper, BytesIO
-from collections import defaultdict
+import atexit
 import operator
 import urllib
+import json
+import os.path
+import tempfile
+import threading
+import shutil
+
+from flask import Blueprint, request, render_template, redirect, g, url_for, current_app
+
+from .utils import debug, iter_fasta_seqs, get_fasta_counts
+from .stats import binomial_pvals, ranksum_pvals
+from .sponge_emp import get_sequence_info_cached, get_similar_samples
+from .database import DBData
+from .charts import get_pie_chart_data, get_pie_chart
+from .jobs import JobQueue, JobStore
+from .metrics import timed
 
-from flask import Blueprint, request, render_template, redirect, g
-import scipy.stats
-import numpy as np
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+Site_Main_Flask_Obj = Blueprint('Site_Main_Flask_Obj', __name__, template_folder='templates')
 
-from .utils import debug, get_fasta_seqs
-from .sponge_emp import get_sequence_info
+# the default limits for uploaded fasta files (set the FASTA_MAX_RECORDS / FASTA_MAX_BYTES app config to change)
+FASTA_MAX_RECORDS = 100000
+FASTA_MAX_BYTES = 200 * 1024 * 1024
+# uploaded files with at least this number of sequences are processed as background jobs (app config JOB_MIN_SEQUENCES)
+JOB_MIN_SEQUENCES = 1000
+# the number of job worker processes (app config JOB_WORKERS)
+JOB_WORKERS = 2
 
-Site_Main_Flask_Obj = Blueprint('Site_Main_Flask_Obj', __name__, template_folder='templates')
+# the sample metadata fields shown in the similar samples page (if present in the database)
+SIMILAR_SAMPLES_FIELDS = ['host_scientific_name', 'env_feature', 'country']
+
+# the background job queue, the database version (data_id) used by its workers and their temporary
+# database snapshot (or None), for each dataset
+# (created on the first job submitted by this process)
+_job_queues = {}
+_job_queue_lock = threading.Lock()
+# the app and database used by the job worker processes (see _init_job_worker())
+_job_app = None
+_job_db = None
 
 
 @Site_Main_Flask_Obj.route('/', methods=['POST', 'GET'])
@@ -46,24 +70,42 @@ def search_results():
 
     if request.method == 'GET':
         sequence = request.args['sequence']
+        max_mismatches = request.args.get('max_mismatches', '0')
+        client_charts = request.args.get('charts') == 'client'
     else:
         sequence = request.form['sequence']
+        max_mismatches = request.form.get('max_mismatches', '0')
+        client_charts = request.form.get('charts') == 'client'
+    try:
+        max_mismatches = int(max_mismatches or 0)
+    except ValueError:
+        return('Error: max_mismatches must be an integer', 400)
 
     # if there is no sequence but a file attached, process the fasta file
     if sequence == '':
         if 'fasta file' in request.files:
             debug(1, 'Fasta file uploaded, processing it')
             file = request.files['fasta file']
-            textfile = TextIOWrapper(file)
-            seqs = get_fasta_seqs(textfile)
-            if seqs is None:
-                return('Error: Uploaded file not recognized as fasta <br> Please use <a href=https://en.wikipedia.org/wiki/FASTA_format>fasta</a> formatted files without ";" comment lines', 400)
-            err, webpage = get_sequence_annotations(db, seqs)
+            max_records = current_app.config.get('FASTA_MAX_RECORDS', FASTA_MAX_RECORDS)
+            max_bytes = current_app.config.get('FASTA_MAX_BYTES', FASTA_MAX_BYTES)
+            try:
+                # only the database sequence length is used from each sequence
+                seqs = [cseq[:db.seq_length] for cseq in iter_fasta_seqs(file.stream, max_records=max_records, max_bytes=max_bytes)]
+            except (ValueError, OSError) as err:
+                debug(3, 'fasta file read failed: %s' % err)
+                return('Error: Uploaded file not processed (%s) <br> Please use <a href=https://en.wikipedia.org/wiki/FASTA_format>fasta</a> '
+                       'or fastq formatted files (optionally gzip compressed)' % err, 400)
+            # large files (or if requested) are processed in the background, and the results page is polled
+            job_mode = request.form.get('job') == 'on' or len(seqs) >= current_app.config.get('JOB_MIN_SEQUENCES', JOB_MIN_SEQUENCES)
+            if job_mode:
+                job_id = get_job_queue().submit(run_annotations_job, seqs, max_mismatches, client_charts)
+                return redirect(url_for('.job_results', job_id=job_id))
+            err, webpage = get_sequence_annotations(db, seqs, max_mismatches=max_mismatches, client_charts=client_charts)
             if err:
                 return err, 400
             return webpage
 
-    err, webPage = get_sequence_annotations(db, sequence)
+    err, webPage = get_sequence_annotations(db, sequence, max_mismatches=max_mismatches, client_charts=client_charts)
     if err:
         return err, 400
     return webPage
@@ -72,19 +114,235 @@ def search_results():
 @Site_Main_Flask_Obj.route('/sequence_annotations/<string:sequence>')
 def sequence_annotations(sequence):
         db = g.db
-        err,webPage = get_sequence_annotations(db, sequence)
+        client_charts = request.args.get('charts') == 'client'
+        err,webPage = get_sequence_annotations(db, sequence, client_charts=client_charts)
         if err:
             return err
         return webPage
 
 
-def get_sequence_annotations(db, sequence):
+@Site_Main_Flask_Obj.route('/similar_samples_results', methods=['POST'])
+def similar_samples_results():
+    """
+    Title: Similar samples results page
+    URL: site/similar_samples_results
+    Method: POST
+    Description: Get the database samples most similar to an uploaded community (a fasta file, optionally with
+    ;size=N read counts in the headers, or a biom table summed over its samples)
+    """
+    db = g.db
+    metric = request.form.get('metric', 'braycurtis')
+    try:
+        top = int(request.form.get('top', '') or 20)
+    except ValueError:
+        return('Error: top must be an integer', 400)
+    if 'community file' not in request.files or request.files['community file'].filename == '':
+        return('Error: no community file uploaded', 400)
+    file = request.files['community file']
+    max_records = current_app.config.get('FASTA_MAX_RECORDS', FASTA_MAX_RECORDS)
+    max_bytes = current_app.config.get('FASTA_MAX_BYTES', FASTA_MAX_BYTES)
+    try:
+        if file.filename.lower().endswith('.biom'):
+            counts = get_biom_counts(file.stream, max_bytes=max_bytes)
+        else:
+            counts = get_fasta_counts(file.stream, max_records=max_records, max_bytes=max_bytes)
+    except (ValueError, OSError) as err:
+        debug(3, 'community file read failed: %s' % err)
+        return('Error: Uploaded file not processed (%s) <br> Please use a <a href=https://en.wikipedia.org/wiki/FASTA_format>fasta</a> '
+               'file (with optional ;size=N read counts) or a biom table' % err, 400)
+    # only the database sequence length is used from each sequence
+    sequences = [cseq[:db.seq_length] for cseq in counts.keys()]
+    err, res = get_similar_samples(db, sequences, counts=list(counts.values()), metric=metric, top=top)
+    if err:
+        return 'Error: %s' % err, 400
+    fields = [cfield for cfield in SIMILAR_SAMPLES_FIELDS if cfield in db.sample_metadata.columns]
+    with timed('render_template'):
+        webPage = render_template('similar_samples.html', res=res, metric=metric, fields=fields)
+    return webPage
+
+
+def get_biom_counts(stream, max_bytes=None):
+    '''Get the total reads of each feature (sequence) in an uploaded biom table
+
+    Parameters
+    ----------
+    stream : file like
+        the biom table (json or hdf5)
+    max_bytes : int or None (optional)
+        the maximal file size (None for no limit)
+
+    Returns
+    -------
+    dict of {str: float}
+        the total reads of each sequence (upper case) over all the table samples
+    '''
+    import biom
+
+    with tempfile.NamedTemporaryFile(suffix='.biom') as tmp:
+        size = 0
+        while True:
+            chunk = stream.read(1024 * 1024)
+            if not chunk:
+                break
+            size += len(chunk)
+            if max_bytes is not None and size > max_bytes:
+                raise ValueError('file is larger than %d bytes' % max_bytes)
+            tmp.write(chunk)
+        tmp.flush()
+        try:
+            table = biom.load_table(tmp.name)
+        except Exception as err:
+            raise ValueError('not a biom table (%s)' % err)
+    counts = {}
+    for cid, ccount in zip(table.ids(axis='observation'), table.sum(axis='observation')):
+        cid = cid.upper()
+        counts[cid] = counts.get(cid, 0) + float(ccount)
+    return counts
+
+
+@Site_Main_Flask_Obj.route('/job_results')
+def job_results():
+    """
+    Title: Background job results page
+    URL: site/job_results?job_id=<job_id>
+    Method: GET
+    Description: Returns the annotations page when the job is done, otherwise a status page that reloads itself
+    """
+    job_id = request.args.get('job_id', '')
+    job = JobStore(get_job_store_file()).get(job_id)
+    if job is None:
+        return 'Error: job %s not found' % job_id, 404
+    if job['status'] == 'done':
+        return job['result']
+    if job['status'] == 'failed':
+        return 'Error: job %s failed: %s' % (job_id, job['error']), 400
+    return render_template('jobstatus.html', job_id=job_id, status=job['status'])
+
+
+def get_job_queue():
+    '''Get the background job queue, creating it on first use
+
+    The job workers get the app config and load the database (g.db) of the request creating the queue from its
+    snapshot (memory mapped, so the workers share the pages with the server) or hdf5 table (see DBData.get_source()).
+    A database only in memory is saved once as a temporary snapshot (in /dev/shm if available) for the workers.
+    Each dataset (g.dataset, when serving multiple datasets) has its own queue.
+    If the database version changed (i.e. reloaded), a new queue is created for new jobs
+    (jobs already submitted finish using the previous version). Jobs are stored in the app config JOB_STORE sqlite file
+    (default data/jobs.sqlite), so they can be fetched by any server worker.
+
+    Returns
+    -------
+    JobQueue
+    '''
+    dataset = g.get('dataset')
+    with _job_queue_lock:
+        queue, data_id, tmpdir = _job_queues.get(dataset, (None, None, None))
+        if queue is not None and data_id != g.db.data_id:
+            debug(3, 'database version changed, restarting job workers')
+            threading.Thread(target=_shutdown_job_queue, args=(queue, tmpdir), name='job-queue-shutdown', daemon=True).start()
+            queue = None
+        if queue is None:
+            app = current_app._get_current_object()
+            source = g.db.get_source()
+            tmpdir = None
+            if source is None:
+                tmpdir = tempfile.mkdtemp(prefix='sponge_emp_jobs_', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+                atexit.register(shutil.rmtree, tmpdir, True)
+                g.db.save_snapshot(tmpdir)
+                source = {'snapshot': tmpdir}
+            queue = JobQueue(get_job_store_file(), max_workers=app.config.get('JOB_WORKERS', JOB_WORKERS),
+                             initializer=_init_job_worker, initargs=(dict(app.config), source))
+            _job_queues[dataset] = (queue, g.db.data_id, tmpdir)
+    return queue
+
+
+def _shutdown_job_queue(queue, tmpdir=None):
+    # wait for the submitted jobs, and then remove the temporary database snapshot of the workers
+    queue.shutdown(wait=True)
+    if tmpdir is not None:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def get_job_store_file():
+    '''Get the sqlite file storing the background jobs (app config JOB_STORE, default data/jobs.sqlite)
+
+    Returns
+    -------
+    str
+    '''
+    return current_app.config.get('JOB_STORE', os.path.join(current_app.root_path, 'data/jobs.sqlite'))
+
+
+def _init_job_worker(config, source):
+    global _job_app, _job_db
+
+    # imported here since the app module imports this module
+    from .app import create_app
+
+    if 'snapshot' in source:
+        db = DBData()
+        db.load_snapshot(source['snapshot'], mmap=True)
+    else:
+        db = DBData(**source)
+        db.import_data()
+    _job_app = create_app(lambda: db, config=config)
+    _job_db = db
+
+
+def run_annotations_job(sequences, max_mismatches, client_charts):
+    '''Create the annotations page for a set of sequences in a job worker process
+
+    Parameters
+    ----------
+    sequences : list of str
+        the DNA sequences to get the annotations for
+    max_mismatches : int
+        if > 0, use the database sequences with up to max_mismatches mismatches to the sequences
+    client_charts : bool
+        True to let the browser draw the pie charts
+
+    Returns
+    -------
+    err : str
+        the error encountered or '' if ok
+    webPage : str
+        the html of the annotations page
+    '''
+    # render_template / url_for need a request context
+    with _job_app.test_request_context():
+        return get_sequence_annotations(_job_db, sequences, max_mismatches=max_mismatches, client_charts=client_charts)
+
+
+def get_sequence_annotations(db, sequence, max_mismatches=0, client_charts=False):
     '''Get annotations for a DNA sequence
+
+    Parameters
+    ----------
+    db : DBData
+        the database to use
+    sequence : str or list of str
+        the DNA sequence(s) to get the annotations for
+    max_mismatches : int (optional)
+        if > 0, use the database sequences with up to max_mismatches mismatches to the sequence(s)
+    client_charts : bool (optional)
+        False (default) to embed the pie charts as png images.
+        True to embed only the chart data (json), drawn by the browser (static/piechart.js)
+
+    Returns
+    -------
+    err : str
+        the error encountered or '' if ok
+    webPage : str
+        the html of the annotations page
     '''
-    err, info = get_sequence_info(db, sequence, fields=None, threshold=0)
+    with timed('sequence_info'):
+        err, info = get_sequence_info_cached(db, sequence, fields=None, threshold=0, max_mismatches=max_mismatches)
     if err:
         return err, ''
-    desc = get_annotation_string(info)
+    with timed('annotation_string'):
+        # rank the sequence frequencies once for all the annotation strings
+        ranks = get_rank_reference(info)
+        desc = get_annotation_string(info, ranks=ranks)
     if isinstance(sequence, str):
         seqname = sequence
         taxonomy = db.get_taxonomy(sequence)
@@ -94,12 +352,20 @@ def get_sequence_annotations(db, sequence):
     else:
         seqname = 'Set of %d sequences' % len(sequence)
         taxonomy = 'Set of %d sequences' % len(sequence)
-    webPage = render_template('seqinfo.html', sequence=seqname, taxonomy=taxonomy)
+    with timed('render_template'):
+        webPage = render_template('seqinfo.html', sequence=seqname, taxonomy=taxonomy)
 
     if isinstance(sequence, str):
         webPage += '<a href="http://dbbact.org/sequence_annotations/%s" target="_blank">More info from dbBact</a>' % sequence
         webPage += '<br>'
 
+    if 'matched_sequences' in info:
+        webPage += 'Matched database sequences (up to %d mismatches):<br>\n' % max_mismatches
+        for cmatches in info['matched_sequences'].values():
+            for cmatch in cmatches:
+                webPage += '%s (%d mismatches)<br>\n' % (cmatch['sequence'], cmatch['mismatches'])
+        webPage += '<br>'
+
     total_observed = info['total_observed']
     total_samples = info['total_samples']
 
@@ -115,7 +381,8 @@ def get_sequence_annotations(db, sequence):
     int_fields = ['host_scientific_name', 'env_feature', 'country']
     for idx, cfield in enumerate(int_fields):
         # draw the pie chart
-        fdesc = get_annotation_string(info, field_name=cfield)
+        with timed('annotation_string'):
+            fdesc = get_annotation_string(info, field_name=cfield, ranks=ranks)
         # open by default the first entry
         if idx == 0:
             webPage += '<details open="open">\n'
@@ -125,10 +392,16 @@ def get_sequence_annotations(db, sequence):
         webPage += '%s (%d significant)' % (cfield, len(fdesc))
         webPage += '</summary>\n'
         webPage += '<pre>\n'
-        piechart_image = plot_pie_chart(info, cfield, min_size=0)
-        webPage += render_template('imageplace.html', wordcloudimage=urllib.parse.quote(piechart_image))
-        piechart_image_rel = plot_pie_chart(info, cfield, min_size=0, show_orig=True)
-        webPage += render_template('imageplace.html', wordcloudimage=urllib.parse.quote(piechart_image_rel))
+        with timed('pie_chart'):
+            if client_charts:
+                for show_orig in (False, True):
+                    labels, x, title = get_pie_chart_data(info, cfield, min_size=0, show_orig=show_orig)
+                    webPage += render_template('piechart.html', chart=json.dumps({'labels': labels, 'x': x, 'title': title}), title=title)
+            else:
+                piechart_image = plot_pie_chart(info, cfield, min_size=0)
+                webPage += render_template('imageplace.html', wordcloudimage=urllib.parse.quote(piechart_image))
+                piechart_image_rel = plot_pie_chart(info, cfield, min_size=0, show_orig=True)
+                webPage += render_template('imageplace.html', wordcloudimage=urllib.parse.quote(piechart_image_rel))
         webPage += '<br>'
         webPage += '<b>Significant enrichment:</b><br>'
         for cdesc in fdesc:
@@ -149,6 +422,8 @@ def get_sequence_annotations(db, sequence):
     webPage += '</pre>\n'
     webPage += '</details>\n'
     webPage += '<a href="sequence_annotations_table/%s">View as table</a>' % sequence
+    if client_charts:
+        webPage += '<script src="%s"></script>' % url_for('static', filename='piechart.js')
     webPage += "</body>"
     webPage += "</html>"
     return '', webPage
@@ -159,7 +434,7 @@ def get_sequence_annotations_table(sequence):
     '''Get annotations for a DNA sequence as a tsv table
     '''
     db = g.db
-    err, info = get_sequence_info(db, sequence, fields=None, threshold=0)
+    err, info = get_sequence_info_cached(db, sequence, fields=None, threshold=0)
     if err:
         return err, ''
     desc = get_annotation_string(info, for_export=True)
@@ -173,7 +448,25 @@ def get_sequence_annotations_table(sequence):
     return webPage
 
 
-def get_annotation_string(info, pval=0.1, field_name=None, for_export=False):
+def get_rank_reference(info):
+    '''Get the ranks of the sequence frequencies in all samples, for the rank sum tests of get_annotation_string()
+
+    Parameters
+    ----------
+    info : dict (see get_sequence_annotations)
+
+    Returns
+    -------
+    RankReference or None
+        the ranks of the frequencies of the sequence in all the samples, or None if no values are present in info
+    '''
+    for cfinfo in info['info'].values():
+        for cdist in cfinfo.values():
+            return cdist.profile.ranks
+    return None
+
+
+def get_annotation_string(info, pval=0.1, field_name=None, for_export=False, ranks=None):
     '''Get nice string summaries of annotations
 
     Parameters
@@ -198,6 +491,9 @@ def get_annotation_string(info, pval=0.1, field_name=None, for_export=False):
     for_export : bool (optional)
         False (Default) to return user readble description (for webpage)
         True to return tab delimited description string (for tsv export)
+    ranks : RankReference or None (optional)
+        the ranks of the sequence frequencies (from get_rank_reference()).
+        None (default) to calculate them. Pass it to reuse the ranks between calls for the same info
 
     Returns
     -------
@@ -215,26 +511,38 @@ def get_annotation_string(info, pval=0.1, field_name=None, for_export=False):
         field_name = list(info['info'].keys())
     else:
         field_name = [field_name]
+
+    # collect all the field/values and test them together
+    fields = []
+    values = []
+    observed = []
+    total = []
+    rank_sums = []
+    group_sizes = []
     for cfield in field_name:
         for cval, cdist in info['info'][cfield].items():
-            observed_val_samples = cdist['observed_samples']
-            total_val_samples = cdist['total_samples']
-            cfrac = observed_val_samples / total_val_samples
-            cpval = scipy.stats.binom.cdf(total_val_samples - observed_val_samples, total_val_samples, null_pv)
-            # rstat,rpval = scipy.stats.mannwhitneyu(cdist['val_samples'],cdist['not_val_samples'])
-            allv = scipy.stats.rankdata(np.hstack([cdist['val_samples'],cdist['not_val_samples']]))
-            v1 = np.mean(allv[:len(cdist['val_samples'])])
-            v2 = np.mean(allv[len(cdist['val_samples']):])
-            if v1 - v2 > 0:
-                rstat,rpval = scipy.stats.kruskal(cdist['val_samples'],cdist['not_val_samples'])
+            if ranks is None:
+                ranks = get_rank_reference(info)
+            fields.append(cfield)
+            values.append(cval)
+            observed.append(cdist['observed_samples'])
+            total.append(cdist['total_samples'])
+            rank_sums.append(cdist.rank_sum)
+            group_sizes.append(cdist.num_val_samples)
+    if len(values) == 0:
+        return []
+
+    cpvals = binomial_pvals(observed, total, null_pv)
+    # rstat,rpval = scipy.stats.mannwhitneyu(cdist.val_samples,cdist.not_val_samples)
+    rpvals = ranksum_pvals(rank_sums, group_sizes, ranks.num_samples, ranks.tie_correction)
+    for cfield, cval, observed_val_samples, total_val_samples, cpval, rpval in zip(fields, values, observed, total, cpvals, rpvals):
+        cfrac = observed_val_samples / total_val_samples
+        if (cpval <= pval) or (rpval <= pval):
+            if for_export:
+                cdesc = '<tr><td>%s</td><td>%s</td><td>%d</td><td>%d</td><td>%f</td><td>%f</td></tr>' % (cfield, cval, observed_val_samples, total_val_samples, cpval, rpval)
             else:
-                rpval = 1
-            if (cpval <= pval) or (rpval <= pval):
-                if for_export:
-                    cdesc = '<tr><td>%s</td><td>%s</td><td>%d</td><td>%d</td><td>%f</td><td>%f</td></tr>' % (cfield, cval, observed_val_samples, total_val_samples, cpval, rpval)
-                else:
-                    cdesc = '%s:%s (%d/%d) (binomial_p=%f, ranksum_p=%f)' % (cfield, cval, observed_val_samples, total_val_samples, cpval, rpval)
-                keep.append([cdesc, cfrac, cpval])
+                cdesc = '%s:%s (%d/%d) (binomial_p=%f, ranksum_p=%f)' % (cfield, cval, observed_val_samples, total_val_samples, cpval, rpval)
+            keep.append([cdesc, cfrac, cpval])
 
     debug(1, 'found %d significant annotations' % len(keep))
 
@@ -277,55 +585,10 @@ def plot_pie_chart(info, field, relative=False, show_orig=False, min_size=0):
 
     Returns
     -------
-    encoding of png image
+    encoding of png image (drawn only once for each distinct chart, see charts.get_pie_chart())
     '''
-    nums = defaultdict(float)
-    cinfo = info['info'][field]
-    nums['~Other'] = 0
-    for cval, cvinfo in cinfo.items():
-        # if cvinfo['observed_samples'] == 0:
-        #     continue
-        if show_orig:
-            cnum = cvinfo['total_samples']
-        elif relative:
-            cnum = 100 * cvinfo['observed_samples'] / cvinfo['total_samples']
-        else:
-            cnum = cvinfo['observed_samples']
-        if cnum < min_size:
-            cval = '~Other'
-        nums[cval] += cnum
-    if show_orig:
-        nums['~Other'] += info['total_samples'] - np.sum(list(nums.values()))
-    labels, x = zip(*sorted(nums.items(), key=lambda i: i[0], reverse=True))
-    allsum = np.sum(x)
-    x = list(x)
-    labels = list(labels)
-    for idx, cnum in enumerate(x):
-        x[idx] = cnum / allsum
-        if x[idx] < 0.01:
-            labels[idx] = ''
-
-    fig = plt.figure()
-    a = plt.gca()
-    if allsum > 0:
-        a.pie(x, labels=labels)
-    else:
-        a.text(0,0.5,'Not found in enough samples.\nCannot generate statistics')
-    plt.axis("off")
-    if show_orig:
-        plt.title('Total sample number distribution', fontsize=20)
-    elif relative:
-        plt.title('Fraction of samples present', fontsize=20)
-    else:
-        plt.title('Number of samples present', fontsize=20)
-    fig.tight_layout()
-    figfile = BytesIO()
-    fig.savefig(figfile, format='png', bbox_inches='tight')
-    figfile.seek(0)  # rewind to beginning of file
-    import base64
-    figdata_png = base64.b64encode(figfile.getvalue())
-    figfile.close()
-    return figdata_png
+    labels, x, title = get_pie_chart_data(info, field, relative=relative, show_orig=show_orig, min_size=min_size)
+    return get_pie_chart(labels, x, title)
 
 
 def get_significant_categories():
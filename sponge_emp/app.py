@@ -0,0 +1,95 @@
+from flask import Flask, g, request
+
+from .autodoc import auto
+from .sponge_emp import Sponge_Flask_Obj
+from .Site_Main_Flask import Site_Main_Flask_Obj
+
+
+def create_app(get_db=None, config=None, registry=None, datasets=None):
+    '''Create the SpongeEMP flask app (REST API and web site)
+
+    Parameters
+    ----------
+    get_db : callable or None (optional)
+        returns the database (DBData) to use for each request (stored in g.db).
+        None to use the current version of registry (or the datasets)
+    config : dict or None (optional)
+        app config values to set
+    registry : DBRegistry or None (optional)
+        the database registry, used by the admin requests to reload the database
+    datasets : DatasetManager or None (optional)
+        if not None, serve multiple datasets (instead of get_db and registry). The dataset of each request is
+        selected by the /datasets/<dataset>/ url prefix, or the 'dataset' json / url / form parameter
+        (the default dataset if not selected). The selected dataset name is stored in g.dataset, and the urls
+        created by url_for() (i.e. redirects and static files) keep the dataset prefix
+
+    Returns
+    -------
+    flask.Flask
+    '''
+    app = Flask(__name__)
+    if config is not None:
+        app.config.update(config)
+    if get_db is None and datasets is None:
+        get_db = registry.get
+    if registry is not None:
+        app.extensions['db_registry'] = registry
+    app.register_blueprint(Sponge_Flask_Obj)
+    app.register_blueprint(Site_Main_Flask_Obj)
+    if datasets is not None:
+        app.extensions['datasets'] = datasets
+        # all the pages and requests are also served for each dataset under /datasets/<dataset>/
+        app.register_blueprint(Sponge_Flask_Obj, url_prefix='/datasets/<dataset>', name='dataset_Sponge_Flask_Obj')
+        app.register_blueprint(Site_Main_Flask_Obj, url_prefix='/datasets/<dataset>', name='dataset_Site_Main_Flask_Obj')
+        app.add_url_rule('/datasets/<dataset>/static/<path:filename>', endpoint='static', view_func=app.send_static_file)
+
+        @app.url_value_preprocessor
+        def pull_dataset(endpoint, values):
+            g.dataset = values.pop('dataset', None) if values else None
+
+        @app.url_defaults
+        def add_dataset(endpoint, values):
+            # keep the selected dataset in the urls of the pages (i.e. the job redirect and static files)
+            dataset = g.get('dataset')
+            if dataset is None or dataset == datasets.default or 'dataset' in values:
+                return
+            if app.url_map.is_endpoint_expecting(endpoint, 'dataset'):
+                values['dataset'] = dataset
+    # init the autodoc module
+    auto.init_app(app)
+
+    # whenever a new request arrives, connect to the database and store in g.db
+    @app.before_request
+    def before_request():
+        if datasets is None:
+            g.db = get_db()
+            return
+        name = g.get('dataset') or get_request_dataset()
+        g.dataset = name or datasets.default
+        if g.dataset not in datasets.names():
+            return 'unknown dataset %s' % g.dataset, 404
+        try:
+            g.db = datasets.get(g.dataset)
+        except Exception as err:
+            return 'dataset %s is not available: %s' % (g.dataset, err), 503
+
+    # and when the request is over, disconnect
+    @app.teardown_request
+    def teardown_request(exception):
+        pass
+
+    return app
+
+
+def get_request_dataset():
+    '''Get the dataset selected by the 'dataset' parameter of the request (json, url or form)
+
+    Returns
+    -------
+    str or None
+        the dataset name, or None if not selected
+    '''
+    alldat = request.get_json(silent=True)
+    if isinstance(alldat, dict) and alldat.get('dataset'):
+        return str(alldat['dataset'])
+    return request.values.get('dataset') or None
@@ -0,0 +1,198 @@
+import io
+import json
+import os.path
+import platform
+import statistics
+import time
+
+import numpy as np
+import scipy.sparse
+import biom
+import h5py
+
+from .database import DBData
+from .sponge_emp import get_sequence_info, sequence_info_cache
+from .Site_Main_Flask import get_annotation_string, plot_pie_chart
+from .charts import chart_cache
+from .app import create_app
+from .utils import debug
+
+
+# the fields used by the web pages
+_WEB_FIELDS = ['host_scientific_name', 'env_feature', 'country']
+
+
+def make_synthetic_data(biomfile, mapfile, num_samples=5000, num_features=200000, num_fields=40, features_per_sample=500,
+                        seq_length=150, seed=0):
+    '''Create a random biom table and sample mapping file shaped like the SpongeEMP data
+
+    Feature prevalence follows a long tailed distribution (few features present in many samples).
+    The mapping file contains the fields used by the web pages and additional fields with 2-500 values.
+
+    Parameters
+    ----------
+    biomfile : str
+        the biom table (hdf5) file to create
+    mapfile : str
+        the tab separated sample mapping file to create
+    num_samples : int (optional)
+        number of samples
+    num_features : int (optional)
+        number of features (sequences)
+    num_fields : int (optional)
+        number of metadata fields (in addition to #SampleID)
+    features_per_sample : int (optional)
+        the mean number of features present in each sample
+    seq_length : int (optional)
+        the sequence length
+    seed : int (optional)
+        the random seed
+
+    Returns
+    -------
+    list of str
+        the feature sequences, ordered by decreasing prevalence
+    '''
+    rng = np.random.RandomState(seed)
+    nucs = np.array(list('ACGT'))
+    seqs = set()
+    while len(seqs) < num_features:
+        seqs.update(''.join(cseq) for cseq in nucs[rng.randint(4, size=(num_features - len(seqs), seq_length))])
+    seqs = sorted(seqs)
+    rng.shuffle(seqs)
+
+    # draw the features of each sample (the low index features are the most prevalent)
+    prob = 1 / (np.arange(num_features) + 10)
+    prob /= prob.sum()
+    num_present = rng.poisson(features_per_sample, size=num_samples)
+    cols = np.repeat(np.arange(num_samples), num_present)
+    rows = rng.choice(num_features, size=len(cols), p=prob)
+    counts = rng.geometric(0.05, size=len(cols)).astype(float)
+    data = scipy.sparse.csr_matrix((counts, (rows, cols)), shape=(num_features, num_samples))
+
+    sids = ['sample.%d' % cidx for cidx in range(num_samples)]
+    taxonomy = [{'taxonomy': ['k__Bacteria', 'p__phylum%d' % (cidx % 50), 'c__class%d' % (cidx % 200)]} for cidx in range(num_features)]
+    table = biom.Table(data, seqs, sids, observation_metadata=taxonomy)
+    with h5py.File(biomfile, 'w') as fl:
+        table.to_hdf5(fl, 'sponge_emp benchmark')
+
+    fields = _WEB_FIELDS + ['field%d' % cidx for cidx in range(num_fields - len(_WEB_FIELDS))]
+    with open(mapfile, 'w') as fl:
+        fl.write('\t'.join(['#SampleID'] + fields[:num_fields]) + '\n')
+        num_values = [2 + (cidx * 37) % 499 for cidx in range(num_fields)]
+        values = np.array([rng.randint(cnum, size=num_samples) for cnum in num_values]).T
+        for csid, cvalues in zip(sids, values):
+            fl.write('\t'.join([csid] + ['value%d' % cval for cval in cvalues]) + '\n')
+    return seqs
+
+
+def time_call(func, repeat=5, setup=None):
+    '''Time a function call
+
+    Parameters
+    ----------
+    func : callable
+        the function to time (called with no arguments)
+    repeat : int (optional)
+        the number of calls
+    setup : callable or None (optional)
+        called (untimed) before each call (i.e. to clear caches)
+
+    Returns
+    -------
+    dict
+        'min', 'median', 'mean', 'max' : float
+            the call times (seconds)
+        'repeat' : int
+            the number of calls
+    '''
+    times = []
+    for idx in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {'min': min(times), 'median': statistics.median(times), 'mean': statistics.mean(times), 'max': max(times), 'repeat': repeat}
+
+
+def _clear_caches():
+    sequence_info_cache.clear()
+    chart_cache.clear()
+
+
+def run_benchmark(biomfile, mapfile, repeat=5, batch_size=100, seed=0):
+    '''Time the database loading, the query and rendering functions and the flask endpoints
+
+    The result caches are cleared before each call, so the uncached processing time is measured.
+
+    Parameters
+    ----------
+    biomfile : str
+        the biom table
+    mapfile : str
+        the sample mapping file
+    repeat : int (optional)
+        the number of calls to time for each benchmark (the data import is timed once)
+    batch_size : int (optional)
+        the number of sequences in the batch queries
+    seed : int (optional)
+        the random seed for selecting the query sequences
+
+    Returns
+    -------
+    dict
+        'environment' : dict
+            the python and main package versions
+        'data' : dict
+            the number of samples, features and fields
+        'timings' : dict of {name(str): times(dict)}
+            the times of each benchmark (see time_call())
+    '''
+    timings = {}
+    db = DBData(biomfile=biomfile, mapfile=mapfile)
+    timings['import_data'] = time_call(db.import_data, repeat=1)
+    # keep the app quiet and in the foreground
+    app = create_app(lambda: db, config={'SEQUENCE_INFO_LOG': None, 'JOB_MIN_SEQUENCES': np.inf})
+    client = app.test_client()
+
+    # query the sequences present in at least a few samples
+    rng = np.random.RandomState(seed)
+    prevalence = np.diff(db.data.indptr)
+    present = np.flatnonzero(prevalence >= min(5, prevalence.max()))
+    seq = db.fids[present[rng.randint(len(present))]]
+    batch = [db.fids[cpos] for cpos in rng.choice(present, size=min(batch_size, len(present)), replace=False)]
+    field = db.get_fields(exclude=['#SampleID'])[0]
+
+    timings['get_info'] = time_call(lambda: db.get_info(seq, field), repeat=repeat)
+    timings['get_sequence_info'] = time_call(lambda: get_sequence_info(db, seq), repeat=repeat)
+    timings['get_sequence_info_batch'] = time_call(lambda: get_sequence_info(db, batch), repeat=repeat)
+    err, info = get_sequence_info(db, seq)
+    timings['get_annotation_string'] = time_call(lambda: get_annotation_string(info), repeat=repeat)
+    timings['plot_pie_chart'] = time_call(lambda: plot_pie_chart(info, field), repeat=repeat, setup=_clear_caches)
+
+    timings['endpoint_sequence_info'] = time_call(lambda: _check_response(client.get('/sequence/info', data=json.dumps({'sequence': seq}), content_type='application/json')),
+                                                  repeat=repeat, setup=_clear_caches)
+    timings['endpoint_sequences_info_batch'] = time_call(lambda: _check_response(client.post('/sequences/info_batch', data=json.dumps({'sequences': batch}), content_type='application/json')),
+                                                         repeat=repeat, setup=_clear_caches)
+    if set(_WEB_FIELDS).issubset(db.get_fields()):
+        timings['endpoint_search_results'] = time_call(lambda: _check_response(client.get('/search_results?sequence=%s' % seq)),
+                                                       repeat=repeat, setup=_clear_caches)
+        fasta = ''.join('>seq%d\n%s\n' % (cidx, cseq) for cidx, cseq in enumerate(batch))
+        timings['endpoint_search_results_batch'] = time_call(lambda: _check_response(client.post('/search_results', data={'sequence': '', 'fasta file': (io.BytesIO(fasta.encode()), 'batch.fa')})),
+                                                             repeat=repeat, setup=_clear_caches)
+    else:
+        debug(3, 'skipping web page benchmarks (missing fields %s)' % _WEB_FIELDS)
+
+    res = {}
+    res['environment'] = {'python': platform.python_version(), 'numpy': np.__version__, 'biom': biom.__version__,
+                          'platform': platform.platform()}
+    res['data'] = {'biom': os.path.abspath(biomfile), 'samples': db.data.shape[1], 'features': db.data.shape[0],
+                   'fields': len(db.get_fields(exclude=['#SampleID'])), 'nonzero': int(db.data.nnz), 'batch_size': len(batch)}
+    res['timings'] = timings
+    return res
+
+
+def _check_response(response):
+    if response.status_code != 200:
+        raise RuntimeError('request failed (%d): %s' % (response.status_code, response.data[:500]))
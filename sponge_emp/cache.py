@@ -0,0 +1,93 @@
+from collections import OrderedDict
+import threading
+
+
+class LRUCache:
+    def __init__(self, max_items=1000, max_bytes=None):
+        '''A thread safe least recently used cache bounded by number of items and memory
+
+        Parameters
+        ----------
+        max_items : int (optional)
+            the maximal number of items in the cache
+        max_bytes : int or None (optional)
+            the maximal total size (in bytes, as supplied to put()) of the items in the cache.
+            None (default) to not limit the size
+        '''
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        '''Get an item from the cache (and mark it as recently used)
+
+        Parameters
+        ----------
+        key :
+            the key of the item
+        default : (optional)
+            the value to return if the key is not in the cache
+
+        Returns
+        -------
+        the cached value, or default if not in the cache
+        '''
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._items.move_to_end(key)
+            return self._items[key][0]
+
+    def put(self, key, value, nbytes=0):
+        '''Add an item to the cache, evicting the least recently used items if needed
+
+        Parameters
+        ----------
+        key :
+            the key of the item
+        value :
+            the value to store
+        nbytes : int (optional)
+            the (estimated) size of the item in bytes
+        '''
+        if self.max_bytes is not None and nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self.num_bytes -= self._items.pop(key)[1]
+            self._items[key] = (value, nbytes)
+            self.num_bytes += nbytes
+            while len(self._items) > self.max_items or (self.max_bytes is not None and self.num_bytes > self.max_bytes):
+                _, (_, cbytes) = self._items.popitem(last=False)
+                self.num_bytes -= cbytes
+                self.evictions += 1
+
+    def clear(self):
+        '''Remove all the items from the cache (the counters are not reset)'''
+        with self._lock:
+            self._items.clear()
+            self.num_bytes = 0
+
+    def get_stats(self):
+        '''Get the cache counters
+
+        Returns
+        -------
+        dict
+            the number of 'hits', 'misses' and 'evictions', and the current number of 'items' and 'bytes'
+        '''
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'items': len(self._items), 'bytes': self.num_bytes}
@@ -0,0 +1,130 @@
+from io import BytesIO
+from collections import defaultdict
+import base64
+import hashlib
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from .cache import LRUCache
+from .utils import debug
+
+
+# the rendered chart images (base64 png), by hash of the chart content
+chart_cache = LRUCache(max_items=1000, max_bytes=64 * 1024 * 1024)
+
+
+def get_pie_chart_data(info, field, relative=False, show_orig=False, min_size=0):
+    '''Get the slices of the pie chart for number of observations in each of the field values
+
+    Parameters
+    ----------
+    info : dict (see get_sequence_annotations)
+    field : str
+        The name of the field to plot the pie chart for
+    relative : bool (optional)
+        False (default) to plot absolute counts in pie chart.
+        True to plot relative abundances in pie chart
+    show_orig : bool (optional)
+        True to show number of original samples instead of number where it is present
+    min_size : int (optional)
+        minimum number of observations of the otu in order to plot a separate slice. otherwise goes into 'Other'
+
+    Returns
+    -------
+    labels : list of str
+        the label of each slice ('' for slices too small to label)
+    x : list of float
+        the fraction of each slice (empty if no observations)
+    title : str
+        the chart title
+    '''
+    nums = defaultdict(float)
+    cinfo = info['info'][field]
+    nums['~Other'] = 0
+    for cval, cvinfo in cinfo.items():
+        if show_orig:
+            cnum = cvinfo['total_samples']
+        elif relative:
+            cnum = 100 * cvinfo['observed_samples'] / cvinfo['total_samples']
+        else:
+            cnum = cvinfo['observed_samples']
+        if cnum < min_size:
+            cval = '~Other'
+        nums[cval] += cnum
+    if show_orig:
+        nums['~Other'] += info['total_samples'] - np.sum(list(nums.values()))
+    labels, x = zip(*sorted(nums.items(), key=lambda i: i[0], reverse=True))
+    allsum = np.sum(x)
+    labels = list(labels)
+    if allsum > 0:
+        x = [float(cnum / allsum) for cnum in x]
+        labels = [clabel if cx >= 0.01 else '' for clabel, cx in zip(labels, x)]
+    else:
+        x = []
+
+    if show_orig:
+        title = 'Total sample number distribution'
+    elif relative:
+        title = 'Fraction of samples present'
+    else:
+        title = 'Number of samples present'
+    return labels, x, title
+
+
+def render_pie_chart(labels, x, title):
+    '''Draw a pie chart as a png image
+
+    Uses a matplotlib Figure with an Agg canvas (not pyplot), so no global figure state is kept after drawing.
+
+    Parameters
+    ----------
+    labels : list of str
+        the label of each slice
+    x : list of float
+        the fraction of each slice. If empty, draw a not found message instead of the pie
+    title : str
+        the chart title
+
+    Returns
+    -------
+    bytes
+        base64 encoding of the png image
+    '''
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    a = fig.gca()
+    if len(x) > 0:
+        a.pie(x, labels=labels)
+    else:
+        a.text(0, 0.5, 'Not found in enough samples.\nCannot generate statistics')
+    a.axis("off")
+    a.set_title(title, fontsize=20)
+    fig.tight_layout()
+    with BytesIO() as figfile:
+        fig.savefig(figfile, format='png', bbox_inches='tight')
+        figdata_png = base64.b64encode(figfile.getvalue())
+    fig.clear()
+    return figdata_png
+
+
+def get_pie_chart(labels, x, title):
+    '''Get the png image of a pie chart, using the chart_cache to draw each distinct chart only once
+
+    Parameters
+    ----------
+    see render_pie_chart()
+
+    Returns
+    -------
+    bytes
+        base64 encoding of the png image
+    '''
+    key = hashlib.sha1(repr((labels, x, title)).encode()).hexdigest()
+    figdata_png = chart_cache.get(key)
+    if figdata_png is None:
+        debug(1, 'drawing pie chart %s' % key)
+        figdata_png = render_pie_chart(labels, x, title)
+        chart_cache.put(key, figdata_png, nbytes=len(figdata_png))
+    return figdata_png
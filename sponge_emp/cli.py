@@ -0,0 +1,79 @@
+import json
+import os.path
+import tempfile
+
+import click
+
+from .database import DBData
+from .utils import SetDebugLevel
+
+
+@click.group()
+@click.option('--debug-level', type=int, default=2, show_default=True, help='the minimal level of debug messages to show')
+def cli(debug_level):
+    '''SpongeEMP server maintenance commands'''
+    SetDebugLevel(debug_level)
+
+
+@cli.command('build-snapshot')
+@click.option('--biom', 'biomfile', required=True, type=click.Path(exists=True), help='the biom table to load')
+@click.option('--map', 'mapfile', required=True, type=click.Path(exists=True), help='the sample mapping file')
+@click.option('--output', required=True, type=click.Path(), help='the snapshot directory to create')
+@click.option('--prevalence-threshold', 'prevalence_thresholds', type=float, multiple=True,
+              help='also precompute the number of samples each sequence is present in at > this frequency (can be used multiple times)')
+@click.option('--out-of-core', is_flag=True, help='read the (hdf5) biom table from the disk instead of loading it into memory')
+def build_snapshot(biomfile, mapfile, output, prevalence_thresholds, out_of_core):
+    '''Precompile the database into a snapshot directory for fast server startup'''
+    db = DBData(biomfile=biomfile, mapfile=mapfile, prevalence_thresholds=[0] + list(prevalence_thresholds), out_of_core=out_of_core)
+    db.import_data()
+    db.save_snapshot(output)
+    click.echo('saved snapshot of %d sequences, %d samples to %s' % (db.data.shape[0], db.data.shape[1], output))
+
+
+@cli.command('append-snapshot')
+@click.option('--snapshot', required=True, type=click.Path(exists=True), help='the snapshot directory to add the samples to')
+@click.option('--biom', 'biomfile', required=True, type=click.Path(exists=True), help='the biom table of the new samples')
+@click.option('--map', 'mapfile', required=True, type=click.Path(exists=True), help='the mapping file of the new samples')
+@click.option('--output', required=True, type=click.Path(), help='the snapshot directory to create')
+def append_snapshot(snapshot, biomfile, mapfile, output):
+    '''Add the samples of a new biom table to a snapshot (without rebuilding it from the full table)'''
+    db = DBData()
+    db.load_snapshot(snapshot)
+    newdb = db.append(biomfile, mapfile)
+    newdb.save_snapshot(output)
+    click.echo('saved snapshot of %d sequences, %d samples (%d new samples) to %s' % (newdb.data.shape[0], newdb.data.shape[1], newdb.data.shape[1] - db.data.shape[1], output))
+
+
+@cli.command('benchmark')
+@click.option('--biom', 'biomfile', type=click.Path(exists=True), help='the biom table to benchmark (default is to create a random table)')
+@click.option('--map', 'mapfile', type=click.Path(exists=True), help='the sample mapping file to benchmark (required with --biom)')
+@click.option('--samples', default=5000, show_default=True, help='number of samples in the random table')
+@click.option('--features', default=200000, show_default=True, help='number of features in the random table')
+@click.option('--fields', default=40, show_default=True, help='number of metadata fields in the random mapping file')
+@click.option('--repeat', default=5, show_default=True, help='number of times to run each benchmark')
+@click.option('--batch-size', default=100, show_default=True, help='number of sequences in the batch queries')
+@click.option('--output', type=click.Path(), help='the json results file (default is to print the results)')
+def benchmark(biomfile, mapfile, samples, features, fields, repeat, batch_size, output):
+    '''Time the data loading, queries, rendering and REST/web endpoints'''
+    # imported here since it loads the web site modules
+    from .benchmark import make_synthetic_data, run_benchmark
+
+    if biomfile is None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            biomfile = os.path.join(tmpdir, 'benchmark.biom')
+            mapfile = os.path.join(tmpdir, 'benchmark.map.txt')
+            make_synthetic_data(biomfile, mapfile, num_samples=samples, num_features=features, num_fields=fields)
+            res = run_benchmark(biomfile, mapfile, repeat=repeat, batch_size=batch_size)
+    else:
+        if mapfile is None:
+            raise click.UsageError('--map is required with --biom')
+        res = run_benchmark(biomfile, mapfile, repeat=repeat, batch_size=batch_size)
+    if output is None:
+        click.echo(json.dumps(res, indent=2))
+    else:
+        with open(output, 'w') as fl:
+            json.dump(res, fl, indent=2)
+
+
+if __name__ == '__main__':
+    cli()
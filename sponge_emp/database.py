@@ -1,5 +1,11 @@
-from collections import defaultdict
 import os.path
+import copy
+import json
+import mmap
+import sys
+import shutil
+import tempfile
+import uuid
 
 import pandas as pd
 import numpy as np
@@ -7,11 +13,116 @@ import scipy.sparse
 import biom
 
 from .utils import debug
+from .seqindex import SequenceIndex
+from .stats import RankReference, binomial_pvals, ranksum_pvals, get_row_ranks
+from .rowstore import HDF5RowStore
+
+
+# the version of the database snapshot format (see DBData.save_snapshot())
+SNAPSHOT_VERSION = 1
+
+
+class SequenceProfile:
+    def __init__(self, freq):
+        '''The total frequency of a set of sequences in each sample, shared by all the ValueInfo of a query
+
+        Parameters
+        ----------
+        freq : np.ndarray of float
+            the total frequency of the sequences in each sample
+        '''
+        self.freq = freq
+        self._ranks = None
+        self._sample_ranks = None
+        self._rank_sums = {}
+
+    @property
+    def ranks(self):
+        '''The RankReference of the frequencies (calculated on first use)'''
+        if self._ranks is None:
+            self._ranks = RankReference(self.freq)
+        return self._ranks
+
+    def get_rank_sums(self, field, codes):
+        '''Get the sum of the frequency ranks of the samples of each value in a field
+
+        Parameters
+        ----------
+        field : str
+            the name of the field (the sums are calculated once per field)
+        codes : np.ndarray of int
+            the value code of each sample in the field
+
+        Returns
+        -------
+        np.ndarray of float
+            the rank sum for each value code
+        '''
+        if field not in self._rank_sums:
+            if self._sample_ranks is None:
+                self._sample_ranks = self.ranks.ranks(self.freq)
+            self._rank_sums[field] = np.bincount(codes, weights=self._sample_ranks)
+        return self._rank_sums[field]
+
+
+class ValueInfo(dict):
+    def __init__(self, profile, field, codes, code, val_pos):
+        '''The distribution of a sequence profile in the samples of one field value
+
+        A dict containing the 'total_samples' and 'observed_samples' keys (see DBData.get_info()).
+        The frequencies in the samples with and without the value (val_samples and not_val_samples) are
+        created from the profile on first use, and are not part of the dict items (i.e. not serialized to json).
+
+        Parameters
+        ----------
+        profile : SequenceProfile
+            the frequencies of the sequences in all the samples
+        field : str
+            the name of the field
+        codes : np.ndarray of int
+            the value code of each sample in the field
+        code : int
+            the code of the value
+        val_pos : np.ndarray of int
+            the positions of the samples with the value
+        '''
+        super().__init__()
+        self.profile = profile
+        self.field = field
+        self._codes = codes
+        self._code = code
+        self._val_pos = val_pos
+        self._val_samples = None
+        self._not_val_samples = None
+
+    @property
+    def val_samples(self):
+        '''The frequencies of the sequences in the samples with the value (np.ndarray of float)'''
+        if self._val_samples is None:
+            self._val_samples = self.profile.freq[self._val_pos]
+        return self._val_samples
+
+    @property
+    def not_val_samples(self):
+        '''The frequencies of the sequences in the samples without the value (np.ndarray of float)'''
+        if self._not_val_samples is None:
+            self._not_val_samples = self.profile.freq[self._codes != self._code]
+        return self._not_val_samples
+
+    @property
+    def num_val_samples(self):
+        '''The number of samples with the value'''
+        return len(self._val_pos)
+
+    @property
+    def rank_sum(self):
+        '''The sum of the frequency ranks (among all samples) of the samples with the value'''
+        return self.profile.get_rank_sums(self.field, self._codes)[self._code]
 
 
 class DBData:
 #    def __init__(self, biomfile='data/final.withtax.biom', mapfile='data/map.txt', filepath=''):
-    def __init__(self, biomfile='data/spongeemp.sub5k.biom', mapfile='data/map.txt', filepath=''):
+    def __init__(self, biomfile='data/spongeemp.sub5k.biom', mapfile='data/map.txt', filepath='', prevalence_thresholds=(0,), out_of_core=False):
         '''The database class used for data access
 
         Parameters
@@ -22,35 +133,58 @@ class DBData:
             Name of the mapping file
         filepath : str (optional)
             The path to the application
+        prevalence_thresholds : list of float (optional)
+            the frequency thresholds for which the number of samples each sequence is present in (> threshold)
+            is precomputed (see get_total_observed())
+        out_of_core : bool (optional)
+            False (default) to load the whole biom table into memory.
+            True to keep the table (hdf5 biom format) on the disk and read only the rows of the queried sequences
+            (normalized using the sample totals computed when loading)
         '''
-        print(biomfile)
+        debug(1, 'database biom table %s' % biomfile)
         biomfile = os.path.join(filepath, biomfile)
         mapfile = os.path.join(filepath, mapfile)
         self._biom_file_name = biomfile
         self._map_file_name = mapfile
+        self.prevalence_thresholds = list(prevalence_thresholds)
+        self.out_of_core = out_of_core
+        # the snapshot directory the database was loaded from (see load_snapshot())
+        self.snapshot_dir = None
+        # the modification time and size of the biom table and mapping file the data was imported from
+        self._source_files = None
 
     def import_data(self):
         '''
         Load the data into memory
         '''
         debug(5, 'Loading biom table %s' % self._biom_file_name)
-        table = biom.load_table(self._biom_file_name)
-        table.norm(axis='sample', inplace=True)
-        self.data = scipy.sparse.csr_matrix(table.matrix_data)
+        self._source_files = self._get_source_files()
+        if self.out_of_core:
+            self.data = HDF5RowStore(self._biom_file_name)
+            self.sids = self.data.sids
+            self.fids = self.data.fids
+            f_metadata = self.data.get_feature_metadata()
+        else:
+            table = biom.load_table(self._biom_file_name)
+            table.norm(axis='sample', inplace=True)
+            self.data = scipy.sparse.csr_matrix(table.matrix_data)
 
-        self.sids = table.ids(axis='sample')
-        self.fids = table.ids(axis='observation')
+            self.sids = table.ids(axis='sample')
+            self.fids = table.ids(axis='observation')
+            f_metadata = table.metadata(axis='observation')
 
-        s_metadata = pd.read_table(self._map_file_name, sep='\t')
-        s_metadata.fillna('na', inplace=True)
-        s_metadata.set_index(s_metadata.columns[0], drop=False, inplace=True)
-        s_metadata.index = s_metadata.index.astype(np.str)
+        s_metadata = _read_sample_metadata(self._map_file_name)
         common_samples_pos = [cpos for cpos in range(len(self.sids)) if self.sids[cpos] in s_metadata.index]
         common_samples = [self.sids[cpos] for cpos in common_samples_pos]
-        self.data = self.data[:, common_samples_pos]
+        if self.out_of_core:
+            self.data.select_samples(common_samples_pos)
+        else:
+            self.data = self.data[:, common_samples_pos]
         self.sample_metadata = s_metadata.loc[common_samples, ]
-
-        f_metadata = table.metadata(axis='observation')
+        self._factorize_metadata()
+        self._mapped = False
+        # identifies the loaded data (for caching results)
+        self.data_id = uuid.uuid4().hex
 
         if f_metadata is None:
             debug(1, 'No metadata associated with features in biom table')
@@ -62,6 +196,429 @@ class DBData:
         self.feature_metadata = md_df
 
         self.seq_length = len(self.feature_metadata.index[0])
+        self._seq_index = SequenceIndex(self.fids, self.seq_length)
+        self.min_search_length = self._seq_index.min_search_length
+        self._prevalence = {}
+        self._compute_prevalence()
+
+    def append(self, biomfile, mapfile):
+        '''Create a new version of the database with the samples of an additional biom table
+
+        The new samples (columns) are added after the current samples, and new features (rows) after
+        the current features, so the current rows and sample positions do not change.
+        The metadata value codes, sequence index, prevalence counts and per sample feature counts are extended
+        instead of being recalculated. The current database is not changed, so requests using it are not affected,
+        and the new version can replace it with a single assignment.
+
+        Parameters
+        ----------
+        biomfile : str
+            the biom table of the new samples (features are identified by their sequence)
+        mapfile : str
+            the mapping file of the new samples. New fields are set to 'na' for the current samples
+
+        Returns
+        -------
+        DBData
+            the new database version (with a new data_id)
+
+        Raises
+        ------
+        ValueError
+            if the database is read from the disk (out of core), or the new samples are not valid
+        '''
+        if isinstance(self.data, HDF5RowStore):
+            raise ValueError('cannot append samples to an out of core database')
+        debug(5, 'appending biom table %s' % biomfile)
+        table = biom.load_table(biomfile)
+        s_metadata = _read_sample_metadata(mapfile)
+        new_sids = [str(csid) for csid in table.ids(axis='sample') if csid in s_metadata.index]
+        if len(new_sids) == 0:
+            raise ValueError('no samples of %s found in mapping file %s' % (biomfile, mapfile))
+        existing = self.sample_metadata.index.intersection(new_sids)
+        if len(existing) > 0:
+            raise ValueError('%d samples already in the database (i.e. %s)' % (len(existing), existing[0]))
+        # select and normalize the samples (without biom filter(), which copies the feature metadata)
+        sample_pos = [cpos for cpos, csid in enumerate(table.ids(axis='sample')) if csid in s_metadata.index]
+        new_data = scipy.sparse.csc_matrix(table.matrix_data)[:, sample_pos]
+        totals = np.asarray(new_data.sum(axis=0)).ravel()
+        new_data.data = new_data.data / np.repeat(np.where(totals > 0, totals, 1), np.diff(new_data.indptr))
+        new_data = new_data.tocoo()
+        # features not present in the new samples or of a different length (cannot be looked up) are not added
+        table_fids = table.ids(axis='observation')
+        bad_length = np.array([len(cfid) != self.seq_length for cfid in table_fids], dtype=bool)
+        if np.any(bad_length):
+            debug(3, 'ignoring %d features not %d nucleotides long' % (np.sum(bad_length), self.seq_length))
+        keep = ~bad_length[new_data.row] & (new_data.data != 0)
+
+        # the row of each table feature in the new version (new features are added at the end)
+        rows = self.lookup_many(table_fids)
+        new_features = np.zeros(len(table_fids), dtype=bool)
+        new_features[new_data.row[keep]] = True
+        added = np.flatnonzero(new_features & (rows < 0))
+        rows[added] = len(self.fids) + np.arange(len(added))
+        num_features = len(self.fids) + len(added)
+        new_data = scipy.sparse.csr_matrix((new_data.data[keep], (rows[new_data.row[keep]], new_data.col[keep])), shape=(num_features, len(new_sids)))
+
+        db = copy.copy(self)
+        db.data = _append_columns(self.data, new_data)
+        db.fids = np.concatenate([np.asarray(self.fids, dtype=object), np.asarray(table_fids[added], dtype=object)])
+        db._seq_index = self._seq_index.extend(table_fids[added])
+        f_metadata = table.metadata(axis='observation')
+        if f_metadata is None:
+            md_df = pd.DataFrame(index=range(len(added)))
+        else:
+            md_df = pd.DataFrame([dict(f_metadata[cpos]) for cpos in added])
+        md_df['ids'] = db.fids[len(self.fids):]
+        md_df.set_index('ids', drop=False, inplace=True)
+        db.feature_metadata = pd.concat([self.feature_metadata, md_df]).fillna('na')
+
+        # extend the value codes of each field (new values get new codes)
+        s_metadata = s_metadata.loc[new_sids, ]
+        fields = list(self.sample_metadata.columns) + [cfield for cfield in s_metadata.columns if cfield not in self.sample_metadata.columns]
+        num_samples = len(self.sample_metadata)
+        db._field_codes = {}
+        db._field_values = {}
+        for cfield in fields:
+            if cfield in self._field_codes:
+                codes = np.asarray(self._field_codes[cfield])
+                values = self._field_values[cfield]
+            else:
+                codes = np.zeros(num_samples, dtype=np.int64)
+                values = np.array(['na'], dtype=object)
+            if cfield in s_metadata.columns:
+                new_values = s_metadata[cfield].values
+            else:
+                new_values = np.array(['na'] * len(new_sids), dtype=object)
+            # values are matched by name (a field can be read as numbers from one mapping file and as text from another)
+            new_names = np.array([str(cvalue) for cvalue in new_values], dtype=object)
+            new_codes = pd.Index([str(cvalue) for cvalue in values]).get_indexer(new_names)
+            missing = np.flatnonzero(new_codes < 0)
+            if len(missing) > 0:
+                # add the new values in order of appearance
+                _, first = np.unique(new_names[missing], return_index=True)
+                values = np.concatenate([np.asarray(values, dtype=object), np.asarray(new_values, dtype=object)[missing[np.sort(first)]]])
+                new_codes = pd.Index([str(cvalue) for cvalue in values]).get_indexer(new_names)
+            db._field_codes[cfield] = np.concatenate([codes, new_codes]).astype(codes.dtype)
+            db._field_values[cfield] = values
+        db.sids = np.concatenate([np.asarray(self.sample_metadata.index, dtype=object), np.asarray(new_sids, dtype=object)])
+        db.sample_metadata = _get_categorical_metadata(pd.Index(db.sids), fields, db._field_codes, db._field_values)
+        db._index_metadata()
+
+        # add the new samples to the precomputed counts
+        new_rows = np.repeat(np.arange(num_features), np.diff(new_data.indptr))
+        db._prevalence = {}
+        for cthreshold, cprevalence in self._prevalence.items():
+            prevalence = np.bincount(new_rows[new_data.data > cthreshold], minlength=num_features)
+            prevalence[:len(cprevalence)] += cprevalence
+            db._prevalence[cthreshold] = prevalence.astype(np.int32)
+        if getattr(self, '_sample_num_features', None) is not None:
+            db._sample_num_features = np.concatenate([self._sample_num_features, np.bincount(new_data.indices[new_data.data > 0], minlength=len(new_sids))])
+        # the frequency ranks depend on all the samples
+        db._row_ranks = None
+        db._rank_data = None
+        db._mapped = False
+        db.snapshot_dir = None
+        db.data_id = uuid.uuid4().hex
+        debug(5, 'appended %d samples and %d new features' % (len(new_sids), len(added)))
+        return db
+
+    def _compute_prevalence(self):
+        '''Count for each sequence the number of samples where it is present (for each of the prevalence thresholds)
+
+        Only thresholds not already in _prevalence are computed.
+        '''
+        for cthreshold in self.prevalence_thresholds:
+            if cthreshold in self._prevalence:
+                continue
+            if isinstance(self.data, HDF5RowStore):
+                self._prevalence[cthreshold] = self.data.count_present(cthreshold)
+                continue
+            # the number of entries > threshold in each row, from the cumulative count at the row starts
+            present = np.concatenate([[0], np.cumsum(self.data.data > cthreshold)])
+            self._prevalence[cthreshold] = np.diff(present[self.data.indptr]).astype(np.int32)
+
+    def _factorize_metadata(self):
+        '''Encode each sample metadata field as integer value codes
+
+        Creates for each field the value code of each sample (aligned with the data columns)
+        and the list of values, and then indexes them (see _index_metadata()).
+        The sample metadata columns are converted to categoricals to save memory.
+        '''
+        self._field_codes = {}
+        self._field_values = {}
+        for cfield in self.sample_metadata.columns:
+            codes, values = pd.factorize(self.sample_metadata[cfield])
+            self._field_codes[cfield] = codes
+            self._field_values[cfield] = values
+        self.sample_metadata = _get_categorical_metadata(self.sample_metadata.index, self.sample_metadata.columns,
+                                                         self._field_codes, self._field_values)
+        self._index_metadata()
+
+    def _index_metadata(self):
+        '''Create the per value sample indices from the metadata value codes
+
+        Creates for each field the sample positions having each value, and the number of samples of each value.
+        Also creates a (value x sample) indicator matrix of all the values of all fields,
+        used for counting the samples per value of all fields in one matrix product.
+        '''
+        self._field_value_pos = {}
+        self._field_value_counts = {}
+        self._field_offset = {}
+        # the field and value name of each row in the indicator matrix
+        self._value_fields = []
+        self._value_names = []
+        num_samples = len(self.sample_metadata)
+        value_rows = []
+        offset = 0
+        for cfield in self.sample_metadata.columns:
+            codes = self._field_codes[cfield]
+            num_values = len(self._field_values[cfield])
+            # positions of the samples of each value (sorted by sample position)
+            order = np.argsort(codes, kind='mergesort')
+            counts = np.bincount(codes, minlength=num_values)
+            self._field_value_pos[cfield] = np.split(order, np.cumsum(counts)[:-1])
+            self._field_value_counts[cfield] = dict(zip(self._field_values[cfield], counts.tolist()))
+            # the values of the field start at offset in the indicator matrix
+            self._field_offset[cfield] = offset
+            value_rows.append(codes + offset)
+            offset += num_values
+            self._value_fields.extend([cfield] * num_values)
+            self._value_names.extend(str(cvalue) for cvalue in self._field_values[cfield])
+        value_rows = np.hstack(value_rows)
+        sample_cols = np.tile(np.arange(num_samples), len(self.sample_metadata.columns))
+        self._value_indicator = scipy.sparse.csr_matrix((np.ones(len(value_rows)), (value_rows, sample_cols)), shape=(offset, num_samples))
+        self._value_sizes = np.bincount(value_rows, minlength=offset)
+
+    def save_snapshot(self, dirname):
+        '''Save the loaded database as a precompiled snapshot for fast loading (see load_snapshot())
+
+        The snapshot is a directory containing the normalized CSR arrays and the metadata value codes as .npy files,
+        and the ids, metadata values and feature metadata in a json file.
+
+        Parameters
+        ----------
+        dirname : str
+            name of the snapshot directory to create
+        '''
+        debug(5, 'saving database snapshot to %s' % dirname)
+        os.makedirs(dirname, exist_ok=True)
+        if isinstance(self.data, HDF5RowStore):
+            self.data.save_csr(dirname)
+        else:
+            np.save(os.path.join(dirname, 'data.npy'), self.data.data)
+            np.save(os.path.join(dirname, 'indices.npy'), self.data.indices)
+            np.save(os.path.join(dirname, 'indptr.npy'), self.data.indptr)
+        fields = list(self.sample_metadata.columns)
+        for idx, cfield in enumerate(fields):
+            np.save(os.path.join(dirname, 'codes_%d.npy' % idx), self._field_codes[cfield])
+        prevalence_thresholds = list(self._prevalence)
+        for idx, cthreshold in enumerate(prevalence_thresholds):
+            np.save(os.path.join(dirname, 'prevalence_%d.npy' % idx), self._prevalence[cthreshold])
+        feature_metadata = self.feature_metadata.drop('ids', axis=1)
+        info = {'version': SNAPSHOT_VERSION,
+                'data_id': self.data_id,
+                'shape': list(self.data.shape),
+                'seq_length': self.seq_length,
+                'sids': [str(csid) for csid in self.sample_metadata.index],
+                'fids': list(self.feature_metadata.index),
+                'fields': fields,
+                'values': [self._field_values[cfield].tolist() for cfield in fields],
+                'prevalence_thresholds': prevalence_thresholds,
+                'feature_metadata': {ccol: feature_metadata[ccol].tolist() for ccol in feature_metadata.columns},
+                'source_files': self._source_files}
+        # write the json last so a partially written snapshot is not loaded
+        tmpname = os.path.join(dirname, 'snapshot.json.tmp')
+        with open(tmpname, 'w') as fl:
+            json.dump(info, fl)
+        os.replace(tmpname, os.path.join(dirname, 'snapshot.json'))
+
+    def load_snapshot(self, dirname, mmap=True):
+        '''Load the database from a snapshot created by save_snapshot() (instead of import_data())
+
+        Parameters
+        ----------
+        dirname : str
+            name of the snapshot directory
+        mmap : bool (optional)
+            True (default) to memory map the data arrays (read only) instead of reading them into memory.
+            This enables multiple processes to share the arrays through the page cache
+        '''
+        debug(5, 'loading database snapshot %s' % dirname)
+        with open(os.path.join(dirname, 'snapshot.json')) as fl:
+            info = json.load(fl)
+        if info.get('version') != SNAPSHOT_VERSION:
+            raise ValueError('snapshot %s version %s not supported (expected version %d)' % (dirname, info.get('version'), SNAPSHOT_VERSION))
+        mmap_mode = 'r' if mmap else None
+
+        data = np.load(os.path.join(dirname, 'data.npy'), mmap_mode=mmap_mode)
+        indices = np.load(os.path.join(dirname, 'indices.npy'), mmap_mode=mmap_mode)
+        indptr = np.load(os.path.join(dirname, 'indptr.npy'), mmap_mode=mmap_mode)
+        self.data = scipy.sparse.csr_matrix((data, indices, indptr), shape=info['shape'], copy=False)
+
+        self.sids = np.array(info['sids'], dtype=object)
+        self.fids = np.array(info['fids'], dtype=object)
+
+        self._field_codes = {}
+        self._field_values = {}
+        for idx, cfield in enumerate(info['fields']):
+            codes = np.load(os.path.join(dirname, 'codes_%d.npy' % idx), mmap_mode=mmap_mode)
+            values = np.array(info['values'][idx], dtype=object)
+            self._field_codes[cfield] = codes
+            self._field_values[cfield] = values
+        self.sample_metadata = _get_categorical_metadata(pd.Index(self.sids), info['fields'], self._field_codes, self._field_values)
+        self._index_metadata()
+
+        md_df = pd.DataFrame(info['feature_metadata'], index=pd.Index(self.fids, name='ids'))
+        md_df['ids'] = self.fids
+        self.feature_metadata = md_df
+
+        self.seq_length = info['seq_length']
+        self.data_id = info['data_id']
+        self._seq_index = SequenceIndex(self.fids, self.seq_length)
+        self.min_search_length = self._seq_index.min_search_length
+        self._prevalence = {}
+        for idx, cthreshold in enumerate(info.get('prevalence_thresholds', [])):
+            self._prevalence[cthreshold] = np.load(os.path.join(dirname, 'prevalence_%d.npy' % idx), mmap_mode=mmap_mode)
+        self._compute_prevalence()
+        self._mapped = mmap
+        self.snapshot_dir = dirname
+        self._source_files = info.get('source_files')
+
+    def check_snapshot(self, dirname):
+        '''Check a snapshot was created from the current biom table and mapping file of the database
+
+        The modification time and size of the files are compared to the ones recorded when the snapshot data was imported
+        (a snapshot of appended samples records the files of the database the samples were appended to).
+
+        Parameters
+        ----------
+        dirname : str
+            name of the snapshot directory
+
+        Returns
+        -------
+        err : str
+            empty if the snapshot can be loaded instead of import_data(), otherwise the reason it cannot
+        '''
+        try:
+            with open(os.path.join(dirname, 'snapshot.json')) as fl:
+                info = json.load(fl)
+        except (OSError, ValueError) as e:
+            return 'cannot read snapshot %s: %s' % (dirname, e)
+        if info.get('version') != SNAPSHOT_VERSION:
+            return 'snapshot %s version %s not supported (expected version %d)' % (dirname, info.get('version'), SNAPSHOT_VERSION)
+        source_files = info.get('source_files')
+        if source_files is None:
+            return 'snapshot %s does not record its source files' % dirname
+        try:
+            current_files = self._get_source_files()
+        except OSError as e:
+            return 'cannot read the snapshot source files: %s' % e
+        for ckey, cname in [('biom', self._biom_file_name), ('map', self._map_file_name)]:
+            if source_files.get(ckey) != current_files[ckey]:
+                return 'file %s changed since snapshot %s was created' % (cname, dirname)
+        return ''
+
+    def _get_source_files(self):
+        '''Get the modification time and size of the biom table and mapping file (to detect changes)
+
+        Returns
+        -------
+        dict of {'biom': dict, 'map': dict}
+            the 'mtime_ns' and 'size' of each file
+        '''
+        source_files = {}
+        for ckey, cname in [('biom', self._biom_file_name), ('map', self._map_file_name)]:
+            stat = os.stat(cname)
+            source_files[ckey] = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+        return source_files
+
+    def share(self, tmpdir=None):
+        '''Move the data arrays into shared memory
+
+        The data and metadata value code arrays are replaced by read only memory mapped views of
+        a snapshot in shared memory (/dev/shm when available). Processes forked after calling
+        share() (i.e. pre-forked server workers) use the same physical copy of the arrays.
+        The snapshot files are unlinked immediately, and the memory is freed when the last process using it exits.
+
+        Parameters
+        ----------
+        tmpdir : str or None (optional)
+            the directory where to create the shared snapshot.
+            None (default) to use /dev/shm if it exists, otherwise the default temporary directory
+        '''
+        if getattr(self, '_mapped', False):
+            debug(2, 'database arrays already memory mapped')
+            return
+        if isinstance(self.data, HDF5RowStore):
+            debug(2, 'database rows are read from the disk')
+            return
+        if tmpdir is None and os.path.isdir('/dev/shm'):
+            tmpdir = '/dev/shm'
+        dirname = tempfile.mkdtemp(prefix='sponge_emp_', dir=tmpdir)
+        try:
+            self.save_snapshot(dirname)
+            self.load_snapshot(dirname, mmap=True)
+        finally:
+            shutil.rmtree(dirname)
+        self.snapshot_dir = None
+        debug(5, 'database arrays moved to shared memory')
+
+    def get_source(self):
+        '''Get the files the database can be loaded again from by another process, without copying the data
+
+        Returns
+        -------
+        dict or None
+            {'snapshot': str} for a database loaded from a snapshot directory (mapped again using load_snapshot()),
+            the DBData() arguments ('biomfile', 'mapfile', 'prevalence_thresholds', 'out_of_core') for an out of core database,
+            or None if the database is only in memory (i.e. imported, shared or appended)
+        '''
+        if self.snapshot_dir is not None:
+            return {'snapshot': self.snapshot_dir}
+        if self.out_of_core:
+            return {'biomfile': self._biom_file_name, 'mapfile': self._map_file_name,
+                    'prevalence_thresholds': self.prevalence_thresholds, 'out_of_core': True}
+        return None
+
+    def get_memory_usage(self):
+        '''Get the approximate memory used by the database
+
+        Includes the data and metadata arrays, the ids and metadata tables, and the precomputed (or cached) results.
+
+        Returns
+        -------
+        dict
+            'memory' : int
+                the number of bytes in the process memory
+            'mapped' : int
+                the number of bytes of memory mapped arrays (i.e. a snapshot), which are shared between processes
+                and can be paged out by the operating system
+        '''
+        if isinstance(self.data, HDF5RowStore):
+            arrays = [self.data._indptr, self.data._totals, self.data._col_map]
+        else:
+            arrays = [self.data.data, self.data.indices, self.data.indptr]
+        arrays.extend(self._field_codes.values())
+        arrays.extend([self._value_indicator.data, self._value_indicator.indices, self._value_indicator.indptr, self._value_sizes])
+        arrays.extend(self._prevalence.values())
+        if getattr(self, '_row_ranks', None) is not None:
+            arrays.extend(self._row_ranks)
+            if self._rank_data is not self.data:
+                arrays.extend([self._rank_data.data, self._rank_data.indices, self._rank_data.indptr])
+        if getattr(self, '_sample_num_features', None) is not None:
+            arrays.append(self._sample_num_features)
+        if self._seq_index._packed is not None:
+            arrays.append(self._seq_index._packed)
+        res = {'memory': 0, 'mapped': 0}
+        for carray in arrays:
+            res['mapped' if _is_mapped(carray) else 'memory'] += carray.nbytes
+        # the sequence strings (shared by the ids, the index and the feature metadata) and the tables
+        res['memory'] += sum(sys.getsizeof(cfid) for cfid in self.fids) + sys.getsizeof(self._seq_index._rows)
+        res['memory'] += int(self.feature_metadata.drop('ids', axis=1).memory_usage(deep=True).sum())
+        res['memory'] += int(self.sample_metadata.memory_usage(deep=True).sum())
+        return res
 
     def get_fields(self, exclude=[]):
         '''Get the list of fields in the database sample metadata
@@ -104,19 +661,53 @@ class DBData:
         tax : str
             the taxonomy string (if exists) or 'na'
         '''
-        if len(sequence) < self.seq_length:
-            return('na')
-            debug(2, 'sequence too short for taxonomy')
-        sequence = sequence[:self.seq_length].upper()
         if 'taxonomy' not in self.feature_metadata:
             debug(2, 'taxonomy not in biom table')
             return('na')
-        if sequence not in self.feature_metadata.index:
-            debug(2, 'sequence not in biom table')
+        pos = self._seq_index.lookup(sequence)
+        if pos < 0:
+            debug(2, 'sequence not in biom table (or too short)')
             return('na')
-        tax = self.feature_metadata['taxonomy'][sequence]
+        tax = self.feature_metadata['taxonomy'].iloc[pos]
         return tax
 
+    def lookup_many(self, sequences):
+        '''Get the rows of a list of sequences in the database
+
+        The sequences are trimmed to the database sequence length and upper cased before the lookup.
+
+        Parameters
+        ----------
+        sequences : list of str (ACGT sequences)
+            the sequences to look for
+
+        Returns
+        -------
+        rows : np.ndarray of int
+            the row of each sequence in the data array, or -1 if not found (or shorter than the database sequences)
+        '''
+        return self._seq_index.lookup_many(sequences)
+
+    def search_sequence(self, sequence, max_mismatches=0, min_identity=None):
+        '''Find the database sequences similar to a given sequence
+
+        Parameters
+        ----------
+        sequence : str (ACGT sequence)
+            the sequence to look for. Can be shorter than the database sequences (compared to their prefix)
+        max_mismatches : int (optional)
+            the maximal number of mismatching nucleotides for a database sequence to match
+        min_identity : float or None (optional)
+            if not None, the minimal fraction of identical nucleotides for a database sequence to match (instead of max_mismatches)
+
+        Returns
+        -------
+        matches : list of (str, int)
+            the matching database sequences and their number of mismatches, sorted by number of mismatches
+        '''
+        rows, mismatches = self._seq_index.search(sequence, max_mismatches=max_mismatches, min_identity=min_identity)
+        return [(self.fids[crow], int(cmismatches)) for crow, cmismatches in zip(rows, mismatches)]
+
     def get_seq_pos(self, sequence):
         '''Get the row of a sequence in the database
 
@@ -131,26 +722,35 @@ class DBData:
             the row of the sequence in the data array or None if not found
         '''
         debug(1, 'get seq pos for sequence %s' % sequence)
-        if sequence in self.feature_metadata.index:
-            return self.feature_metadata.index.get_loc(sequence)
+        pos = self._seq_index.lookup(sequence)
+        if pos >= 0:
+            return int(pos)
         debug(1, 'sequence %s not found' % sequence)
         return None
 
     def get_total_observed(self, sequence, threshold=0):
         '''Get the number of samples in the database where the sequence is present at > threshold
 
+        Uses the precomputed counts if threshold is one of the prevalence thresholds, otherwise the data.
+
         Parameters
         ----------
-        sequence : str
-            the DNA sequence to look for
+        sequence : str or list of str
+            the DNA sequence to look for.
+            If list, return the sum of the number of samples over all the sequences
         threhold : float (optional)
             the minimal frequency for the sequence to be present in the sample in order to call it observed (using > threshold)
         '''
-        pos = self.get_seq_pos(sequence)
-        if pos is None:
-            return 0
+        if isinstance(sequence, str):
+            sequence = [sequence]
+        rows = self.lookup_many(sequence)
+        rows = rows[rows >= 0]
 
-        num_observed = np.sum(self.data[pos, :] > threshold)
+        prevalence = self._prevalence.get(threshold)
+        if prevalence is not None:
+            num_observed = prevalence[rows].sum()
+        else:
+            num_observed = (self.data[rows, :] > threshold).sum()
         debug(1, 'sequence observed in %d samples' % num_observed)
         return int(num_observed)
 
@@ -169,9 +769,91 @@ class DBData:
         num_samples : int
             the number of samples with value in field
         '''
-        num_samples = np.sum(self.sample_metadata[field] == value)
+        num_samples = self._field_value_counts[field].get(value, 0)
         return num_samples
 
+    def _get_seq_profile(self, sequence, threshold=0):
+        '''Get the presence and total frequency of a set of sequences in each sample
+
+        Parameters
+        ----------
+        sequence : list of str
+            the DNA sequences to look for
+        threhold : float (optional)
+            the minimal frequency for the sequence to be present in the sample in order to call it observed (using > threshold)
+
+        Returns
+        -------
+        allsum : np.ndarray of float
+            the number of the sequences present in each sample
+        allfreq : np.ndarray of float
+            the total frequency of the sequences in each sample
+        '''
+        rows = self.lookup_many(sequence)
+        seqdata = self.data[rows[rows >= 0], :]
+
+        # presence/absence of at least one of the sequences in each sample
+        allsum = np.asarray((seqdata > threshold).sum(axis=0)).ravel()
+
+        # total frequency of the sequences in each sample
+        allfreq = np.asarray(seqdata.sum(axis=0)).ravel()
+        return allsum, allfreq
+
+    def get_info_batch(self, sequences, fields, threshold=0, mincounts=4):
+        '''Get the observed samples per value for each field, separately for each sequence
+
+        All the sequence rows are extracted at once, and the observed samples per value of all fields for all
+        sequences are calculated using a single (sequence x sample) by (sample x value) sparse matrix product.
+
+        Parameters
+        ----------
+        sequences : list of str
+            the DNA sequences to look for
+        fields : list of str
+            the names of the fields to get the values for
+        threhold : float (optional)
+            the minimal frequency for the sequence to be present in the sample in order to call it observed (using > threshold)
+        mincounts : int (optional)
+            the minimal number of observed samples for a field/value in order to be returned
+
+        Returns
+        -------
+        total_observed : np.ndarray of int
+            the number of samples where each sequence is present (0 if sequence not found)
+        info : list of dict of {field(str): information(dict)}
+            for each sequence, the information for each field.
+            information is a dict of {value(str): distribution(dict)}
+            distribution contains the following key/values:
+                'total_samples': int
+                    the total number of samples having this value
+                'observed_samples': int
+                    the number of samples with this value which have the sequence present in them
+        '''
+        rows = self.lookup_many(sequences)
+        found = np.nonzero(rows >= 0)[0]
+        present = (self.data[rows[found], :] > threshold).astype(float)
+
+        total_observed = np.zeros(len(sequences), dtype=int)
+        total_observed[found] = np.asarray(present.sum(axis=1)).ravel()
+
+        # the number of observed samples per sequence (row) for each value (column) of all fields
+        counts = present.dot(self._value_indicator.T).tocsr()
+        counts.data[counts.data < mincounts] = 0
+        counts.eliminate_zeros()
+        counts.sort_indices()
+
+        fields = set(fields)
+        info = [{cfield: {} for cfield in fields} for cseq in sequences]
+        for cidx, cpos in enumerate(found):
+            cinfo = info[cpos]
+            start, end = counts.indptr[cidx], counts.indptr[cidx + 1]
+            for cvalue, ccount in zip(counts.indices[start:end].tolist(), counts.data[start:end].tolist()):
+                cfield = self._value_fields[cvalue]
+                if cfield not in fields:
+                    continue
+                cinfo[cfield][self._value_names[cvalue]] = {'observed_samples': int(ccount), 'total_samples': int(self._value_sizes[cvalue])}
+        return total_observed, info
+
     def get_info(self, sequence, field, threshold=0, mincounts=4):
         '''Get the total samples, observed samples per value in field
 
@@ -193,57 +875,373 @@ class DBData:
         info : dict of {value: distribution}
             value : str
                 the value of the field
-            distribution : dict containing the following key/values:
+            distribution : ValueInfo, a dict containing the following key/values:
                 'total_samples': int
                     the total number of samples having this value
                 'observed_samples': int
                     the number of samples with this value which have the sequence present in them
-                'val_samples' : list of float
-                    the fraction of reads (of the sequence) in each sample which has the value
-                'not_val_samples' : list of float
-                    the fraction of reads (of the sequence) in each sample which does not have the value
+            The ValueInfo val_samples and not_val_samples attributes are the fraction of reads (of the sequence)
+            in each sample which has / does not have the value, and it provides the group statistics (see ValueInfo)
         '''
-        if isinstance(sequence, str):
-            sequence = [sequence]
+        return self.get_info_fields(sequence, [field], threshold=threshold, mincounts=mincounts)[field]
 
-        # presence/absence of at least one of the sequences in each sample
-        allsum = np.zeros(self.data.shape[1])
+    def _iter_rank_blocks(self):
+        '''Iterate over the data in blocks of consecutive rows, with the ranks of the frequencies in each row
 
-        # total frequency of the sequences in each sample
-        allfreq = np.zeros(self.data.shape[1])
+        The ranks of the in memory data are calculated once and kept.
 
-        for csequence in sequence:
-            pos = self.get_seq_pos(csequence)
-            if pos is None:
-                continue
-            present = self.data[pos, :] > threshold
-            allsum[present.nonzero()[1]] += 1
-            allfreq += self.data[pos, :]
-        allfreq = allfreq.A[0]
+        Yields
+        ------
+        start_row : int
+            the first row of the block
+        block : scipy.sparse.csr_matrix
+            the data rows (without stored zeros)
+        ranks : tuple of (entry_ranks, zero_ranks, tie_correction)
+            the ranks of the rows (see stats.get_row_ranks())
+        '''
+        num_samples = self.data.shape[1]
+        if isinstance(self.data, HDF5RowStore):
+            blocks = self.data.iter_row_blocks()
+        else:
+            if getattr(self, '_row_ranks', None) is None:
+                self._rank_data = self.data
+                if np.any(self.data.data == 0):
+                    self._rank_data = self.data.copy()
+                    self._rank_data.eliminate_zeros()
+                self._row_ranks = get_row_ranks(self._rank_data, num_samples)
+            yield 0, self._rank_data, self._row_ranks
+            return
+        start_row = 0
+        for cblock in blocks:
+            cblock.eliminate_zeros()
+            yield start_row, cblock, get_row_ranks(cblock, num_samples)
+            start_row += cblock.shape[0]
 
-        # get the number of samples present per metadata value
-        present_pos = allsum.nonzero()[0]
-        counts = defaultdict(int)
-        for cpos in present_pos:
-            cvalue = self.sample_metadata[field].iloc[cpos]
-            counts[cvalue] += allsum[cpos]
+    def get_enrichment(self, field, value, threshold=0):
+        '''Test all the sequences for enrichment in the samples with a given field value
+
+        Uses the same tests as the sequence annotations: a binomial test of the number of samples with the value
+        where the sequence is present, compared to its presence in all samples,
+        and a kruskal-wallis test of the ranks of the sequence frequencies in samples with the value vs. the other samples.
+
+        Parameters
+        ----------
+        field : str
+            the metadata field
+        value : str
+            the field value (the samples with the value are the tested group)
+        threshold : float (optional)
+            the minimal frequency (using > threshold) for a sequence to be present in a sample
 
-        # get the total frequency of all sequences per metadata value
-        all_samples_per_val = defaultdict(list)
-        for cpos in range(self.data.shape[1]):
-            cvalue = self.sample_metadata[field].iloc[cpos]
-            all_samples_per_val[cvalue].append(cpos)
+        Returns
+        -------
+        dict or None
+            None if the field/value does not exist, otherwise:
+            'group_size' : int
+                the number of samples with the value
+            'total_samples' : int
+                the total number of samples
+            'rows' : np.ndarray of int
+                the rows (positions in fids) of the sequences present in at least one sample with the value,
+                sorted by the binomial p-value, then the rank sum p-value and then the fraction of group samples where present
+            'observed' : np.ndarray of int
+                the number of samples with the value where each sequence is present
+            'total_observed' : np.ndarray of int
+                the number of samples where each sequence is present
+            'binomial_pval', 'ranksum_pval' : np.ndarray of float
+                the p-values of each sequence
+        '''
+        if field not in self._field_codes:
+            return None
+        value_names = [str(cvalue) for cvalue in self._field_values[field]]
+        if str(value) not in value_names:
+            return None
+        in_group = np.asarray(self._field_codes[field]) == value_names.index(str(value))
+        group_size = int(np.sum(in_group))
+        num_samples = len(in_group)
+
+        observed = []
+        total_observed = []
+        rank_sums = []
+        tie_correction = []
+        for start_row, cblock, (entry_ranks, zero_ranks, ctie_correction) in self._iter_rank_blocks():
+            num_rows = cblock.shape[0]
+            row_ids = np.repeat(np.arange(num_rows), np.diff(cblock.indptr))
+            entry_in = in_group[cblock.indices]
+            present = cblock.data > threshold
+            observed.append(np.bincount(row_ids[entry_in & present], minlength=num_rows))
+            prevalence = self._prevalence.get(threshold)
+            if prevalence is not None:
+                total_observed.append(np.asarray(prevalence[start_row:start_row + num_rows]))
+            else:
+                total_observed.append(np.bincount(row_ids[present], minlength=num_rows))
+            # the group samples where the sequence is not stored get the zero rank
+            group_nonzero = np.bincount(row_ids[entry_in], minlength=num_rows)
+            rank_sums.append(np.bincount(row_ids[entry_in], weights=entry_ranks[entry_in], minlength=num_rows) + (group_size - group_nonzero) * zero_ranks)
+            tie_correction.append(ctie_correction)
+        observed = np.concatenate(observed)
+        total_observed = np.concatenate(total_observed)
+
+        rows = np.flatnonzero(observed > 0)
+        observed = observed[rows]
+        total_observed = total_observed[rows]
+        binomial_pval = binomial_pvals(observed, np.full(len(rows), group_size), 1 - total_observed / num_samples)
+        ranksum_pval = ranksum_pvals(np.concatenate(rank_sums)[rows], np.full(len(rows), group_size), num_samples, np.concatenate(tie_correction)[rows])
+        order = np.lexsort((-observed, ranksum_pval, binomial_pval))
+
+        res = {'group_size': group_size, 'total_samples': num_samples, 'rows': rows[order], 'observed': observed[order],
+               'total_observed': total_observed[order], 'binomial_pval': binomial_pval[order], 'ranksum_pval': ranksum_pval[order]}
+        return res
+
+    def _get_sample_num_features(self):
+        '''Get the number of features (sequences) present in each sample (calculated once)
+
+        Returns
+        -------
+        np.ndarray of int
+        '''
+        if getattr(self, '_sample_num_features', None) is None:
+            num_samples = self.data.shape[1]
+            if isinstance(self.data, HDF5RowStore):
+                blocks = self.data.iter_row_blocks()
+            else:
+                blocks = [self.data]
+            num_features = np.zeros(num_samples, dtype=np.int64)
+            for cblock in blocks:
+                num_features += np.bincount(cblock.indices[cblock.data > 0], minlength=num_samples)
+            self._sample_num_features = num_features
+        return self._sample_num_features
+
+    def get_similar_samples(self, sequences, counts=None, metric='braycurtis', top=20):
+        '''Find the samples with the most similar community to a given community
+
+        Bray-Curtis similarity (1 - Bray-Curtis dissimilarity) uses the relative frequencies of the features,
+        and Jaccard similarity uses presence/absence. Query sequences not in the database count for the
+        query community size but are not shared with any sample.
+
+        Parameters
+        ----------
+        sequences : list of str
+            the sequences of the community features
+        counts : list of float or None (optional)
+            the number of reads of each sequence. None (default) for 1 read per sequence
+        metric : str (optional)
+            'braycurtis' (default) or 'jaccard'
+        top : int (optional)
+            the maximal number of samples to return
+
+        Returns
+        -------
+        dict
+            'samples' : np.ndarray of int
+                the positions (columns) of the samples sharing at least one feature with the query,
+                sorted by decreasing similarity (up to top samples)
+            'similarity' : np.ndarray of float
+                the similarity of each sample to the query
+            'shared_features' : np.ndarray of int
+                the number of query features present in each sample
+            'query_features' : int
+                the number of distinct query sequences
+            'matched_features' : int
+                the number of query sequences found in the database
+
+        Raises
+        ------
+        ValueError
+            if the metric is unknown or the counts are invalid
+        '''
+        if metric not in ('braycurtis', 'jaccard'):
+            raise ValueError('unknown metric %s. use braycurtis or jaccard' % metric)
+        if counts is None:
+            counts = np.ones(len(sequences))
+        try:
+            counts = np.asarray(counts, dtype=float)
+        except (TypeError, ValueError):
+            raise ValueError('counts must be a list of numbers')
+        if counts.ndim != 1:
+            raise ValueError('counts must be a list of numbers')
+        if len(counts) != len(sequences):
+            raise ValueError('number of counts (%d) different from number of sequences (%d)' % (len(counts), len(sequences)))
+        if np.any(counts < 0):
+            raise ValueError('counts must be >= 0')
+        num_samples = self.data.shape[1]
+        # merge identical sequences (after the database trimming)
+        query = {}
+        for csequence, ccount in zip(sequences, counts):
+            if ccount > 0:
+                # short sequences are not in the database, but are part of the query community
+                csequence = self._seq_index.normalize(csequence) or csequence.upper()
+                query[csequence] = query.get(csequence, 0) + ccount
+        query_sequences = list(query)
+        query_counts = np.array([query[csequence] for csequence in query_sequences], dtype=float)
+        rows = self.lookup_many(query_sequences)
+        found = rows >= 0
+        rows = rows[found]
+
+        block = self.data[rows, :]
+        row_lengths = np.diff(block.indptr)
+        present = block.data > 0
+        shared = np.bincount(block.indices[present], minlength=num_samples)
+        if metric == 'braycurtis':
+            # both the query and the samples are normalized to sum 1, so the similarity is the sum of the minimal frequencies
+            query_freq = query_counts[found] / max(query_counts.sum(), 1e-300)
+            similarity = np.bincount(block.indices, weights=np.minimum(block.data, np.repeat(query_freq, row_lengths)), minlength=num_samples)
+        else:
+            union = len(query_sequences) + self._get_sample_num_features() - shared
+            similarity = shared / np.maximum(union, 1)
+        candidates = np.flatnonzero(shared > 0)
+        order = candidates[np.lexsort((-shared[candidates], -similarity[candidates]))][:top]
+        return {'samples': order, 'similarity': similarity[order], 'shared_features': shared[order],
+                'query_features': len(query_sequences), 'matched_features': len(rows)}
+
+    def get_info_fields(self, sequence, fields, threshold=0, mincounts=4):
+        '''Get the total samples, observed samples per value for each field in fields
+
+        The sequence rows are extracted once, and the observed samples per value are calculated
+        for all fields using a single product with the value indicator matrix.
+
+        Parameters
+        ----------
+        sequence : str or list of str
+            the DNA sequences to look for
+        fields : list of str
+            the names of the fields to get the values for
+        threhold : float (optional)
+            the minimal frequency for the sequence to be present in the sample in order to call it observed (using > threshold)
+        mincounts : int (optional)
+            the minimal total number of counts for a field/value in order to be returned
+
+        Returns
+        -------
+        info : dict of {field(str): information(dict)}
+            the information for each field (the output of get_info())
+        '''
+        if isinstance(sequence, str):
+            sequence = [sequence]
 
+        allsum, allfreq = self._get_seq_profile(sequence, threshold=threshold)
+        profile = SequenceProfile(allfreq)
 
+        # get the number of samples present per metadata value of all fields
+        counts = self._value_indicator.dot(allsum)
+
+        present_pos = allsum.nonzero()[0]
         info = {}
-        print('* found %d values' % len(counts))
-        for cvalue, ccount in counts.items():
-            if ccount < mincounts:
-                continue
-            cinfo = {}
-            cinfo['observed_samples'] = int(ccount)
-            cinfo['total_samples'] = int(self.get_value_samples(field, cvalue)) * len(sequence)
-            cinfo['val_samples'] = allfreq[all_samples_per_val[cvalue]]
-            cinfo['not_val_samples'] = allfreq[np.setdiff1d(np.arange(len(allfreq)),all_samples_per_val[cvalue])]
-            info[str(cvalue)] = cinfo
+        for cfield in fields:
+            codes = self._field_codes[cfield]
+            values = self._field_values[cfield]
+            value_pos = self._field_value_pos[cfield]
+            offset = self._field_offset[cfield]
+
+            # keep the values in order of the first sample where the sequence is present
+            present_codes = codes[present_pos]
+            _, first_pos = np.unique(present_codes, return_index=True)
+            present_codes = present_codes[np.sort(first_pos)]
+
+            cfinfo = {}
+            debug(1, 'field %s: found %d values' % (cfield, len(present_codes)))
+            for ccode in present_codes:
+                ccount = counts[offset + ccode]
+                if ccount < mincounts:
+                    continue
+                cinfo = ValueInfo(profile, cfield, codes, ccode, value_pos[ccode])
+                cinfo['observed_samples'] = int(ccount)
+                cinfo['total_samples'] = len(value_pos[ccode]) * len(sequence)
+                cfinfo[str(values[ccode])] = cinfo
+            info[cfield] = cfinfo
         return info
+
+
+def _is_mapped(array):
+    '''Check if a numpy array is (a view of) a memory mapped file
+
+    Parameters
+    ----------
+    array : numpy.ndarray
+
+    Returns
+    -------
+    bool
+    '''
+    while array is not None:
+        if isinstance(array, (np.memmap, mmap.mmap)):
+            return True
+        array = getattr(array, 'base', None)
+    return False
+
+
+def _read_sample_metadata(mapfile):
+    '''Read a sample mapping file
+
+    Parameters
+    ----------
+    mapfile : str
+        the tab separated mapping file (the first column is the sample id)
+
+    Returns
+    -------
+    pandas.DataFrame
+        the sample metadata (missing values are 'na'), indexed by the sample id
+    '''
+    s_metadata = pd.read_table(mapfile, sep='\t')
+    s_metadata.fillna('na', inplace=True)
+    s_metadata.set_index(s_metadata.columns[0], drop=False, inplace=True)
+    s_metadata.index = s_metadata.index.astype(np.str)
+    return s_metadata
+
+
+def _append_columns(data, new_data):
+    '''Append the columns of a CSR matrix to another CSR matrix
+
+    The entries of each row are the row entries of data followed by the row entries of new_data,
+    so the column indices stay sorted if they are sorted in both matrices.
+
+    Parameters
+    ----------
+    data : scipy.sparse.csr_matrix
+        the current columns. Can have less rows than new_data (the missing rows are empty)
+    new_data : scipy.sparse.csr_matrix
+        the columns to append
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+    '''
+    num_rows = new_data.shape[0]
+    old_indptr = np.concatenate([data.indptr, np.full(num_rows - data.shape[0], data.indptr[-1])]).astype(np.int64)
+    old_lengths = np.diff(old_indptr)
+    new_lengths = np.diff(new_data.indptr)
+    indptr = np.concatenate([[0], np.cumsum(old_lengths + new_lengths)])
+    # the position of each entry in the new arrays
+    old_pos = np.arange(data.nnz) + np.repeat(indptr[:-1] - old_indptr[:-1], old_lengths)
+    new_pos = np.arange(new_data.nnz) + np.repeat(indptr[:-1] + old_lengths - new_data.indptr[:-1], new_lengths)
+    values = np.empty(indptr[-1], dtype=np.result_type(data.data, new_data.data))
+    values[old_pos] = data.data
+    values[new_pos] = new_data.data
+    indices = np.empty(indptr[-1], dtype=np.result_type(data.indices, new_data.indices))
+    indices[old_pos] = data.indices
+    indices[new_pos] = new_data.indices + data.shape[1]
+    return scipy.sparse.csr_matrix((values, indices, indptr), shape=(num_rows, data.shape[1] + new_data.shape[1]))
+
+
+def _get_categorical_metadata(index, fields, field_codes, field_values):
+    '''Create the sample metadata dataframe with a categorical column for each field
+
+    Parameters
+    ----------
+    index : pandas.Index
+        the sample ids
+    fields : list of str
+        the metadata fields (columns)
+    field_codes : dict of {field(str): numpy.ndarray of int}
+        the value code of each sample in each field
+    field_values : dict of {field(str): numpy.ndarray}
+        the values of each field (indexed by the codes)
+
+    Returns
+    -------
+    pandas.DataFrame
+    '''
+    columns = {cfield: pd.Categorical.from_codes(np.asarray(field_codes[cfield]), categories=pd.Index(field_values[cfield], dtype=object))
+               for cfield in fields}
+    return pd.DataFrame(columns, columns=fields, index=index)
@@ -0,0 +1,209 @@
+import threading
+import time
+
+from .registry import DBRegistry
+from .utils import debug
+
+
+class Dataset:
+    def __init__(self, name, registry, pinned=False, description=''):
+        '''A database served by the DatasetManager
+
+        Parameters
+        ----------
+        name : str
+            the dataset name (used in the request urls)
+        registry : DBRegistry
+            loads and holds the dataset database versions
+        pinned : bool (optional)
+            True to never evict the dataset from memory
+        description : str (optional)
+        '''
+        self.name = name
+        self.registry = registry
+        self.pinned = pinned
+        self.description = description
+        # the time of the last request using the dataset
+        self.last_used = 0
+        # the memory usage of the loaded version (see DBData.get_memory_usage())
+        self.memory = None
+        # serializes the loading on first use
+        self.lock = threading.Lock()
+
+
+class DatasetManager:
+    def __init__(self, max_bytes=None):
+        '''Serve multiple databases (datasets) from one process
+
+        Datasets are loaded on first use. When the total memory of the loaded datasets is over max_bytes,
+        the least recently used datasets are evicted (and loaded again on their next use).
+
+        Parameters
+        ----------
+        max_bytes : int or None (optional)
+            the maximal total memory (in process memory and memory mapped) of the loaded datasets.
+            None (default) to never evict datasets
+        '''
+        self.max_bytes = max_bytes
+        self.default = None
+        self._datasets = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, loader, warmup=None, pinned=False, default=False, description=''):
+        '''Add a dataset (without loading it)
+
+        Parameters
+        ----------
+        name : str
+            the dataset name
+        loader : callable
+            returns the loaded database (DBData) of the dataset
+        warmup : callable or None (optional)
+            called with each newly loaded database before it is served (see DBRegistry)
+        pinned : bool (optional)
+            True to never evict the dataset from memory
+        default : bool (optional)
+            True to use the dataset for requests not selecting a dataset (the first dataset added is the default)
+        description : str (optional)
+
+        Returns
+        -------
+        DBRegistry
+            the registry of the dataset (i.e. for reloading it)
+        '''
+        registry = DBRegistry(loader, warmup=warmup)
+        self._datasets[name] = Dataset(name, registry, pinned=pinned, description=description)
+        if default or self.default is None:
+            self.default = name
+        return registry
+
+    def names(self):
+        '''Get the names of the datasets
+
+        Returns
+        -------
+        list of str
+        '''
+        return list(self._datasets)
+
+    def get_registry(self, name=None):
+        '''Get the registry of a dataset
+
+        Parameters
+        ----------
+        name : str or None (optional)
+            the dataset name. None for the default dataset
+
+        Returns
+        -------
+        DBRegistry or None
+            None if the dataset does not exist
+        '''
+        dataset = self._datasets.get(self.default if name is None else name)
+        if dataset is None:
+            return None
+        return dataset.registry
+
+    def get(self, name=None):
+        '''Get the current database of a dataset, loading it if needed
+
+        Parameters
+        ----------
+        name : str or None (optional)
+            the dataset name. None for the default dataset
+
+        Returns
+        -------
+        DBData
+
+        Raises
+        ------
+        KeyError
+            if the dataset does not exist
+        ValueError
+            if loading the dataset failed
+        '''
+        dataset = self._datasets[self.default if name is None else name]
+        dataset.last_used = time.time()
+        db = dataset.registry.get()
+        if db is not None:
+            return db
+        with dataset.lock:
+            db = dataset.registry.get()
+            if db is None:
+                debug(6, 'loading dataset %s' % dataset.name)
+                if not dataset.registry.reload(wait=True):
+                    # already being loaded (i.e. reloaded by an admin request)
+                    dataset.registry.wait()
+                db = dataset.registry.get()
+                if db is None:
+                    raise ValueError('dataset %s could not be loaded: %s' % (dataset.name, dataset.registry.status['error']))
+        self.update_memory(dataset.name)
+        return db
+
+    def update_memory(self, name=None):
+        '''Update the memory usage of a loaded dataset, and evict the least recently used datasets if over max_bytes
+
+        Parameters
+        ----------
+        name : str or None (optional)
+            the dataset to update (it is not evicted). None for the default dataset
+        '''
+        name = self.default if name is None else name
+        dataset = self._datasets[name]
+        db = dataset.registry.get()
+        dataset.memory = db.get_memory_usage() if db is not None else None
+        if self.max_bytes is None:
+            return
+        with self._lock:
+            loaded = [cdataset for cdataset in self._datasets.values() if cdataset.registry.get() is not None and cdataset.memory is not None]
+            total = sum(cdataset.memory['memory'] + cdataset.memory['mapped'] for cdataset in loaded)
+            for cdataset in sorted(loaded, key=lambda x: x.last_used):
+                if total <= self.max_bytes:
+                    break
+                if cdataset.pinned or cdataset.name == name:
+                    continue
+                total -= cdataset.memory['memory'] + cdataset.memory['mapped']
+                self.evict(cdataset.name)
+            if total > self.max_bytes:
+                debug(5, 'loaded datasets use %d bytes (over the limit of %d bytes)' % (total, self.max_bytes))
+
+    def evict(self, name):
+        '''Remove a dataset from memory (it is loaded again on its next use)
+
+        Requests already using the dataset keep their database until they are done.
+
+        Parameters
+        ----------
+        name : str
+            the dataset name
+        '''
+        dataset = self._datasets[name]
+        debug(5, 'evicting dataset %s' % name)
+        dataset.registry.unload()
+        dataset.memory = None
+
+    def get_info(self):
+        '''Get the state of all the datasets
+
+        Returns
+        -------
+        list of dict
+            for each dataset:
+            'name' : str
+            'description' : str
+            'default' : bool
+            'loaded' : bool
+            'pinned' : bool
+            'last_used' : float
+                the time of the last request using the dataset (seconds since the epoch, 0 if not used)
+            'memory_bytes', 'mapped_bytes' : int or None
+                the memory usage of the loaded dataset (see DBData.get_memory_usage())
+        '''
+        info = []
+        for cdataset in self._datasets.values():
+            memory = cdataset.memory or {}
+            info.append({'name': cdataset.name, 'description': cdataset.description, 'default': cdataset.name == self.default,
+                         'loaded': cdataset.registry.get() is not None, 'pinned': cdataset.pinned, 'last_used': cdataset.last_used,
+                         'memory_bytes': memory.get('memory'), 'mapped_bytes': memory.get('mapped')})
+        return info
@@ -0,0 +1,168 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import sqlite3
+import time
+import uuid
+
+from .utils import debug
+
+
+class JobStore:
+    def __init__(self, filename):
+        '''Persistent store of background job status and results (sqlite)
+
+        Each call opens its own connection, so the store can be used from multiple threads and processes.
+
+        Parameters
+        ----------
+        filename : str
+            the sqlite database file (created if it does not exist)
+        '''
+        self.filename = filename
+        with self._connect() as con:
+            con.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT, created REAL, finished REAL, result TEXT, error TEXT)')
+
+    def _connect(self):
+        return sqlite3.connect(self.filename, timeout=30)
+
+    def create(self):
+        '''Add a new job (status 'queued')
+
+        Returns
+        -------
+        str
+            the new job id
+        '''
+        job_id = uuid.uuid4().hex
+        with self._connect() as con:
+            con.execute('INSERT INTO jobs (id, status, created) VALUES (?, ?, ?)', (job_id, 'queued', time.time()))
+        return job_id
+
+    def set_status(self, job_id, status, result=None, error=None):
+        '''Update the status of a job
+
+        Parameters
+        ----------
+        job_id : str
+            the job id
+        status : str
+            'queued', 'running', 'done' or 'failed'
+        result : str or None (optional)
+            the job result (for 'done')
+        error : str or None (optional)
+            the error message (for 'failed')
+        '''
+        finished = time.time() if status in ('done', 'failed') else None
+        with self._connect() as con:
+            con.execute('UPDATE jobs SET status=?, finished=?, result=?, error=? WHERE id=?', (status, finished, result, error, job_id))
+
+    def get(self, job_id):
+        '''Get a job
+
+        Parameters
+        ----------
+        job_id : str
+            the job id
+
+        Returns
+        -------
+        dict or None
+            the job ('id', 'status', 'created', 'finished', 'result', 'error'), or None if not found
+        '''
+        with self._connect() as con:
+            con.row_factory = sqlite3.Row
+            row = con.execute('SELECT * FROM jobs WHERE id=?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(row)
+
+    def remove_old(self, max_age):
+        '''Remove jobs created more than max_age seconds ago
+
+        Parameters
+        ----------
+        max_age : float
+            the maximal job age (seconds)
+        '''
+        with self._connect() as con:
+            con.execute('DELETE FROM jobs WHERE created < ?', (time.time() - max_age,))
+
+
+def _run_job(store_filename, job_id, func, args):
+    '''Run a job in the worker process and store its result
+
+    func should return a tuple of (err, result): err is '' if ok, otherwise the error message.
+    '''
+    store = JobStore(store_filename)
+    store.set_status(job_id, 'running')
+    try:
+        err, result = func(*args)
+    except Exception as exc:
+        err, result = 'job failed: %s' % exc, None
+    if err:
+        debug(3, 'job %s failed: %s' % (job_id, err))
+        store.set_status(job_id, 'failed', error=err)
+    else:
+        store.set_status(job_id, 'done', result=result)
+
+
+class JobQueue:
+    def __init__(self, store_filename, max_workers=2, initializer=None, initargs=(), max_age=7 * 24 * 3600):
+        '''Run jobs in a local process pool, keeping their status and results in a JobStore
+
+        The worker processes are started using spawn (when the first job is submitted), since forking the
+        (multithreaded) server process can copy locks held by other threads into the workers.
+        So initializer, initargs and the submitted jobs are pickled.
+
+        Parameters
+        ----------
+        store_filename : str
+            the sqlite file for the JobStore
+        max_workers : int (optional)
+            the number of worker processes
+        initializer : callable or None (optional)
+            called with initargs in each worker process when it starts
+        initargs : tuple (optional)
+            the arguments for initializer
+        max_age : float (optional)
+            remove jobs older than max_age seconds when adding new jobs
+        '''
+        self.store = JobStore(store_filename)
+        self.max_age = max_age
+        self._executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                             initializer=initializer, initargs=initargs)
+
+    def submit(self, func, *args):
+        '''Submit a new job
+
+        Parameters
+        ----------
+        func : callable
+            a module level function (pickled by name) returning (err, result), with err='' if ok
+        args :
+            the (picklable) arguments for func
+
+        Returns
+        -------
+        str
+            the job id (to use with the store get())
+        '''
+        self.store.remove_old(self.max_age)
+        job_id = self.store.create()
+        self._executor.submit(_run_job, self.store.filename, job_id, func, args)
+        debug(2, 'submitted job %s' % job_id)
+        return job_id
+
+    def get(self, job_id):
+        '''Get a job (see JobStore.get())'''
+        return self.store.get(job_id)
+
+    def shutdown(self, wait=True):
+        '''Stop the worker processes
+
+        Parameters
+        ----------
+        wait : bool (optional)
+            True (default) to wait for the running jobs to finish
+        '''
+        self._executor.shutdown(wait=wait)
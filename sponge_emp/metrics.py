@@ -0,0 +1,236 @@
+from bisect import bisect_left
+import threading
+import time
+
+from flask import g, request, has_request_context
+
+
+# the upper bounds (seconds) of the stage time histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# the stage timing is skipped if not enabled (see set_enabled())
+enabled = True
+
+
+def set_enabled(enable):
+    '''Enable or disable the stage timing and request counters
+
+    Parameters
+    ----------
+    enable : bool
+        True to time the stages, False to skip the timing (timed() does nothing)
+    '''
+    global enabled
+
+    enabled = enable
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        '''A histogram of measured times
+
+        Parameters
+        ----------
+        buckets : tuple of float (optional)
+            the (sorted) upper bounds of the buckets. an additional bucket is used for larger values
+        '''
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsStats:
+    def __init__(self):
+        '''The per endpoint stage time histograms and request counters'''
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            # key is (endpoint, stage)
+            self.histograms = {}
+            # key is (endpoint, status code)
+            self.requests = {}
+
+    def observe(self, endpoint, stage, seconds):
+        '''Add a stage time measurement
+
+        Parameters
+        ----------
+        endpoint : str
+            the flask endpoint of the request ('none' if outside a request)
+        stage : str
+            the stage name
+        seconds : float
+            the stage time
+        '''
+        with self._lock:
+            hist = self.histograms.get((endpoint, stage))
+            if hist is None:
+                hist = self.histograms[(endpoint, stage)] = Histogram()
+            hist.observe(seconds)
+
+    def count_request(self, endpoint, status):
+        with self._lock:
+            key = (endpoint, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def get_prometheus_text(self):
+        '''Get the histograms and counters in the prometheus text exposition format
+
+        Returns
+        -------
+        str
+        '''
+        lines = ['# HELP spongeemp_stage_seconds Time spent in each request processing stage',
+                 '# TYPE spongeemp_stage_seconds histogram']
+        with self._lock:
+            for (cendpoint, cstage), chist in sorted(self.histograms.items()):
+                labels = 'endpoint="%s",stage="%s"' % (cendpoint, cstage)
+                total = 0
+                for cbound, ccount in zip([repr(cbound) for cbound in chist.buckets] + ['+Inf'], chist.counts):
+                    total += ccount
+                    lines.append('spongeemp_stage_seconds_bucket{%s,le="%s"} %d' % (labels, cbound, total))
+                lines.append('spongeemp_stage_seconds_sum{%s} %f' % (labels, chist.sum))
+                lines.append('spongeemp_stage_seconds_count{%s} %d' % (labels, chist.count))
+            lines.append('# HELP spongeemp_requests_total Number of requests by endpoint and status code')
+            lines.append('# TYPE spongeemp_requests_total counter')
+            for (cendpoint, cstatus), ccount in sorted(self.requests.items()):
+                lines.append('spongeemp_requests_total{endpoint="%s",status="%s"} %d' % (cendpoint, cstatus, ccount))
+        return '\n'.join(lines) + '\n'
+
+
+# the stage times of all the requests (of this process)
+stats = MetricsStats()
+
+
+def get_cache_metrics_text(caches):
+    '''Get the cache counters in the prometheus text exposition format
+
+    Parameters
+    ----------
+    caches : dict of {name(str): stats(dict)}
+        the LRUCache.get_stats() of each cache
+
+    Returns
+    -------
+    str
+    '''
+    lines = []
+    for cname, ctype, chelp in (('hits', 'counter', 'Number of cache hits'),
+                                ('misses', 'counter', 'Number of cache misses'),
+                                ('evictions', 'counter', 'Number of items evicted from the cache'),
+                                ('items', 'gauge', 'Number of items in the cache'),
+                                ('bytes', 'gauge', 'Estimated memory used by the cache items')):
+        metric = 'spongeemp_cache_%s%s' % (cname, '_total' if ctype == 'counter' else '')
+        lines.append('# HELP %s %s' % (metric, chelp))
+        lines.append('# TYPE %s %s' % (metric, ctype))
+        for ccache, cstats in sorted(caches.items()):
+            lines.append('%s{cache="%s"} %d' % (metric, ccache, cstats[cname]))
+    return '\n'.join(lines) + '\n'
+
+
+class _StageTimer:
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        record_stage(self.stage, time.perf_counter() - self.start)
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_null_timer = _NullTimer()
+
+
+def timed(stage):
+    '''Time a processing stage (as a context manager)
+
+    The time is added to the stage histogram of the current request endpoint ('none' if not in a request)
+    and to the breakdown of the current request. Does nothing if the timing is disabled.
+
+    Parameters
+    ----------
+    stage : str
+        the stage name
+
+    Returns
+    -------
+    context manager
+    '''
+    if not enabled:
+        return _null_timer
+    return _StageTimer(stage)
+
+
+def record_stage(stage, seconds):
+    '''Add a stage time to the current request breakdown and the stage histogram
+
+    Parameters
+    ----------
+    stage : str
+        the stage name
+    seconds : float
+        the stage time
+    '''
+    endpoint = 'none'
+    if has_request_context():
+        endpoint = request.endpoint or 'none'
+        stages = g.get('_timing_stages')
+        if stages is not None:
+            stages.append((stage, seconds))
+    stats.observe(endpoint, stage, seconds)
+
+
+def start_request():
+    '''Start timing the current request (flask before_request)'''
+    if not enabled:
+        return
+    g._timing_stages = []
+    g._timing_start = time.perf_counter()
+
+
+def finish_request(response):
+    '''Count the current request and add its total time (flask after_request)
+
+    If the request has the profile=1 argument or the X-Timing header, add the per stage breakdown
+    (nested stages are included in the enclosing stage time) as the X-Timing response header.
+
+    Parameters
+    ----------
+    response : flask.Response
+
+    Returns
+    -------
+    flask.Response
+    '''
+    start = g.get('_timing_start')
+    if start is None:
+        return response
+    total = time.perf_counter() - start
+    endpoint = request.endpoint or 'none'
+    stats.observe(endpoint, 'total', total)
+    stats.count_request(endpoint, response.status_code)
+    if request.args.get('profile') == '1' or 'X-Timing' in request.headers:
+        breakdown = ['%s=%.3fms' % (cstage, 1000 * cseconds) for cstage, cseconds in g._timing_stages]
+        breakdown.append('total=%.3fms' % (1000 * total))
+        response.headers['X-Timing'] = ', '.join(breakdown)
+    return response
@@ -0,0 +1,138 @@
+import threading
+import time
+
+from .utils import debug
+
+
+class DBRegistry:
+    def __init__(self, loader, warmup=None):
+        '''Hold the served database version, and replace it by newly loaded versions
+
+        A new version is loaded (and warmed up) in a background thread while the current version keeps serving
+        requests, and then replaces the current version by a single assignment. Each request gets the current
+        version once (in before_request), so running requests keep using the version they started with.
+        The previous version is freed when the last request using it is done.
+
+        Parameters
+        ----------
+        loader : callable
+            returns a new loaded database (DBData)
+        warmup : callable or None (optional)
+            called with each new database before it replaces the current version (i.e. to run queries filling the caches)
+        '''
+        self.loader = loader
+        self.warmup = warmup
+        self._db = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._error = None
+        self.status = {'state': 'empty', 'version': 0, 'data_id': None, 'loaded': None, 'load_seconds': None, 'error': None}
+
+    def get(self):
+        '''Get the current database version
+
+        Returns
+        -------
+        DBData or None
+            None if no version was loaded yet
+        '''
+        return self._db
+
+    def is_loading(self):
+        '''Check if a new version is being loaded
+
+        Returns
+        -------
+        bool
+        '''
+        thread = self._thread
+        return thread is not None and thread.is_alive()
+
+    def reload(self, loader=None, wait=False):
+        '''Load a new database version in a background thread, and replace the current version when ready
+
+        If loading or warming up the new version fails, the current version is kept (and the error is in status).
+
+        Parameters
+        ----------
+        loader : callable or None (optional)
+            returns the new database. None (default) to use the registry loader
+        wait : bool (optional)
+            True to wait until the new version replaces the current version
+
+        Returns
+        -------
+        bool
+            True if the load started, False if another version is already being loaded
+
+        Raises
+        ------
+        Exception
+            if wait is True, the error raised by the loader or warmup
+        '''
+        with self._lock:
+            if self.is_loading():
+                debug(3, 'database is already being loaded')
+                return False
+            self._error = None
+            self.status = dict(self.status, state='loading', error=None)
+            self._thread = threading.Thread(target=self._load, args=(loader or self.loader,), name='database-load', daemon=True)
+            self._thread.start()
+            thread = self._thread
+        if wait:
+            thread.join()
+            if self._error is not None:
+                raise self._error
+        return True
+
+    def wait(self):
+        '''Wait until the version being loaded (if any) is done loading
+        '''
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def append(self, biomfile, mapfile, wait=False):
+        '''Create a new version with the samples of another biom table added to the current version (see DBData.append())
+
+        Parameters
+        ----------
+        biomfile : str
+            the biom table of the new samples
+        mapfile : str
+            the mapping file of the new samples
+        wait : bool (optional)
+            True to wait until the new version replaces the current version
+
+        Returns
+        -------
+        bool
+            True if the load started, False if another version is already being loaded
+        '''
+        return self.reload(loader=lambda: self.get().append(biomfile, mapfile), wait=wait)
+
+    def unload(self):
+        '''Stop holding the current version (it is freed when the requests using it are done)
+
+        The next reload() loads a new version.
+        '''
+        with self._lock:
+            self._db = None
+            if not self.is_loading():
+                self.status = dict(self.status, state='empty', data_id=None)
+
+    def _load(self, loader):
+        start = time.time()
+        try:
+            db = loader()
+            if self.warmup is not None:
+                self.warmup(db)
+        except Exception as err:
+            debug(7, 'loading new database version failed: %s' % err)
+            self._error = err
+            self.status = dict(self.status, state='ready' if self._db is not None else 'failed', error=str(err))
+            return
+        self._db = db
+        self.status = {'state': 'ready', 'version': self.status['version'] + 1, 'data_id': db.data_id,
+                       'loaded': time.time(), 'load_seconds': time.time() - start, 'error': None}
+        debug(6, 'database version %d (%s) loaded in %f seconds' % (self.status['version'], db.data_id, self.status['load_seconds']))
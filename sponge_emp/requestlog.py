@@ -0,0 +1,127 @@
+import atexit
+import json
+import os
+import os.path
+import queue
+import threading
+import time
+
+from .utils import debug
+
+
+class RequestLog:
+    def __init__(self, filename, max_queue=10000, flush_interval=1.0, max_bytes=10 * 1024 * 1024, rotate_daily=True):
+        '''A request log written by a background thread
+
+        log() only adds the record to a bounded queue (records are dropped if the queue is full),
+        and the writer thread appends the queued records to the file in batches (one json record per line).
+        The file is rotated (renamed to filename.<date>[.<n>]) when it reaches max_bytes or when the day changes.
+
+        Parameters
+        ----------
+        filename : str
+            the log file name
+        max_queue : int (optional)
+            the maximal number of records waiting to be written
+        flush_interval : float (optional)
+            the maximal time (seconds) a record waits before being written
+        max_bytes : int or None (optional)
+            rotate the log file when it is larger than max_bytes. None to not rotate by size
+        rotate_daily : bool (optional)
+            True (default) to rotate the log file when the day changes
+        '''
+        self.filename = filename
+        self.max_queue = max_queue
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+        atexit.register(self.close)
+
+    def log(self, **record):
+        '''Add a record to the log (without blocking)
+
+        Parameters
+        ----------
+        record :
+            the (json serializable) record fields. The time and process id are added to the record
+        '''
+        record['time'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        record['pid'] = os.getpid()
+        # the writer thread is not inherited by forked processes, so start one in each process
+        if self._pid != record['pid']:
+            self._start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._thread = threading.Thread(target=self._writer, args=(self._queue,), name='RequestLog', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def close(self):
+        '''Write the queued records and stop the writer thread'''
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            self._queue.put(None)
+            self._thread.join()
+            self._pid = None
+
+    def _writer(self, records):
+        done = False
+        while not done:
+            batch = [records.get()]
+            # wait a little for more records, so they are written together
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1] is not None and len(batch) < self.max_queue:
+                try:
+                    batch.append(records.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                done = True
+                batch.pop()
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        try:
+            self._rotate()
+            lines = ''.join(json.dumps(crecord) + '\n' for crecord in batch)
+            # a single append write so records from different processes are not interleaved
+            with open(self.filename, 'a') as fl:
+                fl.write(lines)
+        except (OSError, TypeError, ValueError) as err:
+            debug(5, 'request log write to %s failed: %s' % (self.filename, err))
+
+    def _rotate(self):
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return
+        file_day = time.strftime('%Y-%m-%d', time.localtime(stat.st_mtime))
+        new_day = self.rotate_daily and file_day != time.strftime('%Y-%m-%d')
+        too_big = self.max_bytes is not None and stat.st_size >= self.max_bytes
+        if not (new_day or too_big):
+            return
+        newname = '%s.%s' % (self.filename, file_day)
+        idx = 1
+        while os.path.exists(newname):
+            newname = '%s.%s.%d' % (self.filename, file_day, idx)
+            idx += 1
+        try:
+            os.rename(self.filename, newname)
+        except FileNotFoundError:
+            # rotated by another process
+            pass
@@ -0,0 +1,202 @@
+import os
+import os.path
+
+import numpy as np
+import scipy.sparse
+import h5py
+from biom.table import general_parser, vlen_list_of_str_parser
+
+from .utils import debug
+
+
+# the observation metadata parsers used by biom for the hdf5 format
+_METADATA_PARSERS = {'taxonomy': vlen_list_of_str_parser, 'Taxonomy': vlen_list_of_str_parser,
+                     'KEGG_Pathways': vlen_list_of_str_parser, 'collapsed_ids': vlen_list_of_str_parser}
+
+
+class HDF5RowStore:
+    def __init__(self, filename, chunk_size=1000000):
+        '''Read the rows (features) of an hdf5 biom table from the disk, normalized to the sample totals
+
+        Only the feature row pointers and the sample totals (computed when opening the table) are kept in memory.
+        The rows are read from the observation major (CSR) matrix of the biom table.
+
+        Parameters
+        ----------
+        filename : str
+            the hdf5 biom table
+        chunk_size : int (optional)
+            the number of matrix entries to read at a time when scanning the whole table
+        '''
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self._pid = None
+        self._h5 = None
+        grp = self._file()['observation']
+        self.fids = np.array(grp['ids'].asstr()[:], dtype=object)
+        self.sids = np.array(self._file()['sample/ids'].asstr()[:], dtype=object)
+        self._indptr = grp['matrix/indptr'][:].astype(np.int64)
+        self._totals = np.zeros(len(self.sids))
+        for start_row, end_row in self._iter_chunks():
+            start, end = self._indptr[start_row], self._indptr[end_row]
+            self._totals += np.bincount(grp['matrix/indices'][start:end], weights=grp['matrix/data'][start:end], minlength=len(self.sids))
+        self.select_samples(np.arange(len(self.sids)))
+        debug(2, 'opened table %s (%d features, %d samples)' % (filename, len(self.fids), len(self.sids)))
+
+    def _file(self):
+        # hdf5 file handles cannot be used after fork, so each process opens the file
+        if self._pid != os.getpid():
+            self._h5 = h5py.File(self.filename, 'r')
+            self._pid = os.getpid()
+        return self._h5
+
+    def _iter_chunks(self):
+        '''Split the matrix rows to chunks of up to chunk_size entries (at least one row per chunk)
+
+        Yields
+        ------
+        (int, int)
+            the start and end row of each chunk
+        '''
+        start_row = 0
+        num_rows = len(self.fids)
+        while start_row < num_rows:
+            end_row = np.searchsorted(self._indptr, self._indptr[start_row] + self.chunk_size, side='right') - 1
+            end_row = min(max(end_row, start_row + 1), num_rows)
+            yield start_row, end_row
+            start_row = end_row
+
+    def select_samples(self, positions):
+        '''Set the table samples used as the matrix columns
+
+        Parameters
+        ----------
+        positions : list of int
+            the (increasing) positions of the samples in the biom table to use as the columns
+        '''
+        self._col_map = np.full(len(self.sids), -1, dtype=np.int64)
+        self._col_map[positions] = np.arange(len(positions))
+        self.shape = (len(self.fids), len(positions))
+
+    def get_feature_metadata(self):
+        '''Get the observation metadata of the biom table
+
+        Returns
+        -------
+        list of dict or None
+            the metadata of each feature, or None if the table has no feature metadata
+        '''
+        md = [{} for idx in range(len(self.fids))]
+        for category, dset in self._file()['observation/metadata'].items():
+            category = category.replace('@@SLASH@@', '/')
+            parse_f = _METADATA_PARSERS.get(category, general_parser)
+            for md_dict, data_row in zip(md, dset[:]):
+                md_dict[category] = parse_f(data_row)
+        if not any(md):
+            return None
+        return md
+
+    def _normalize(self, indices, data):
+        '''Select the used sample entries and normalize them
+
+        Returns
+        -------
+        keep : numpy.ndarray of bool
+            the used entries
+        cols : numpy.ndarray of int
+            the matrix column of each kept entry
+        values : numpy.ndarray of float
+            the normalized value of each kept entry
+        '''
+        cols = self._col_map[indices]
+        keep = cols >= 0
+        return keep, cols[keep], data[keep] / self._totals[indices[keep]]
+
+    def __getitem__(self, key):
+        '''Get the normalized rows (as in csr_matrix[rows, :])
+
+        Parameters
+        ----------
+        key : (list of int, slice)
+            the rows to get, and slice(None) for all the columns
+
+        Returns
+        -------
+        scipy.sparse.csr_matrix
+            the normalized rows
+        '''
+        rows, cols = key
+        if cols != slice(None):
+            raise IndexError('only whole rows can be read')
+        rows = np.atleast_1d(np.asarray(rows, dtype=np.int64))
+        grp = self._file()['observation/matrix']
+        indices = []
+        data = []
+        for crow in rows:
+            start, end = self._indptr[crow], self._indptr[crow + 1]
+            indices.append(grp['indices'][start:end])
+            data.append(grp['data'][start:end])
+        lengths = np.array([len(cind) for cind in indices], dtype=np.int64)
+        if len(rows) > 0:
+            indices = np.concatenate(indices)
+            data = np.concatenate(data)
+        else:
+            indices = np.zeros(0, dtype=np.int64)
+            data = np.zeros(0)
+        keep, cols, values = self._normalize(indices, data)
+        row_ids = np.repeat(np.arange(len(rows)), lengths)[keep]
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(row_ids, minlength=len(rows)))])
+        return scipy.sparse.csr_matrix((values, cols, indptr), shape=(len(rows), self.shape[1]))
+
+    def iter_row_blocks(self):
+        '''Iterate over the whole normalized matrix in blocks of consecutive rows
+
+        Yields
+        ------
+        scipy.sparse.csr_matrix
+            the normalized rows of each block (in order)
+        '''
+        grp = self._file()['observation/matrix']
+        for start_row, end_row in self._iter_chunks():
+            start, end = self._indptr[start_row], self._indptr[end_row]
+            keep, cols, values = self._normalize(grp['indices'][start:end], grp['data'][start:end])
+            # the number of kept entries before each row start
+            present = np.concatenate([[0], np.cumsum(keep)])
+            indptr = present[self._indptr[start_row:end_row + 1] - start]
+            yield scipy.sparse.csr_matrix((values, cols, indptr), shape=(end_row - start_row, self.shape[1]))
+
+    def count_present(self, threshold=0):
+        '''Count for each row the number of samples with normalized value > threshold
+
+        Parameters
+        ----------
+        threshold : float (optional)
+
+        Returns
+        -------
+        numpy.ndarray of int
+        '''
+        counts = [np.diff(np.concatenate([[0], np.cumsum(cblock.data > threshold)])[cblock.indptr]) for cblock in self.iter_row_blocks()]
+        return np.concatenate(counts).astype(np.int32)
+
+    def save_csr(self, dirname):
+        '''Save the normalized matrix as the data.npy, indices.npy and indptr.npy CSR arrays (without loading the whole matrix)
+
+        Parameters
+        ----------
+        dirname : str
+            the directory where to save the arrays
+        '''
+        counts = np.concatenate([np.diff(cblock.indptr) for cblock in self.iter_row_blocks()])
+        indptr = np.concatenate([[0], np.cumsum(counts)])
+        np.save(os.path.join(dirname, 'indptr.npy'), indptr)
+        data = np.lib.format.open_memmap(os.path.join(dirname, 'data.npy'), mode='w+', dtype=np.float64, shape=(indptr[-1],))
+        indices = np.lib.format.open_memmap(os.path.join(dirname, 'indices.npy'), mode='w+', dtype=np.int32, shape=(indptr[-1],))
+        pos = 0
+        for cblock in self.iter_row_blocks():
+            data[pos:pos + cblock.nnz] = cblock.data
+            indices[pos:pos + cblock.nnz] = cblock.indices
+            pos += cblock.nnz
+        data.flush()
+        indices.flush()
+        del data, indices
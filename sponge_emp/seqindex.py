@@ -0,0 +1,188 @@
+import numpy as np
+
+
+# the minimal query length for approximate search
+MIN_SEARCH_LENGTH = 100
+
+# the 2 bit code of each nucleotide (other characters are encoded as A)
+_NUC_CODE = np.zeros(256, dtype=np.uint8)
+for _cpos, _cnuc in enumerate('ACGT'):
+    _NUC_CODE[ord(_cnuc)] = _cpos
+    _NUC_CODE[ord(_cnuc.lower())] = _cpos
+
+# the number of mismatching nucleotides (non zero 2 bit groups) in each xor byte of two packed sequences
+_BYTE_MISMATCHES = np.array([sum(((cbyte >> cshift) & 3) != 0 for cshift in (0, 2, 4, 6)) for cbyte in range(256)], dtype=np.uint8)
+
+
+def pack_sequences(sequences, length):
+    '''Encode DNA sequences using 2 bits per nucleotide
+
+    Parameters
+    ----------
+    sequences : list of str
+        the sequences to encode
+    length : int
+        the number of nucleotides to encode from each sequence. Shorter sequences are padded with A
+
+    Returns
+    -------
+    packed : np.ndarray of uint8
+        (sequences x ceil(length / 4)) array, 4 nucleotides per byte (first nucleotide in the high bits)
+    '''
+    padded_length = 4 * ((length + 3) // 4)
+    seqs = ''.join(cseq[:length].ljust(padded_length, 'A') for cseq in sequences)
+    codes = _NUC_CODE[np.frombuffer(seqs.encode('ascii', 'replace'), dtype=np.uint8)].reshape(len(sequences), padded_length)
+    packed = (codes[:, 0::4] << 6) | (codes[:, 1::4] << 4) | (codes[:, 2::4] << 2) | codes[:, 3::4]
+    return packed
+
+
+class SequenceIndex:
+    def __init__(self, sequences, seq_length=None):
+        '''Index for finding the row of DNA sequences in the database
+
+        Query sequences are trimmed to the database sequence length and upper cased before the lookup.
+
+        Parameters
+        ----------
+        sequences : list of str
+            the database sequences (in row order)
+        seq_length : int or None (optional)
+            the length of the database sequences.
+            None (default) to use the length of the first sequence
+        '''
+        if seq_length is None:
+            seq_length = len(sequences[0])
+        self.seq_length = seq_length
+        self.min_search_length = min(seq_length, MIN_SEARCH_LENGTH)
+        self._sequences = sequences
+        self._rows = {cseq: idx for idx, cseq in enumerate(sequences)}
+        # the 2 bit packed sequences for approximate search (created on first use)
+        self._packed = None
+
+    def extend(self, sequences):
+        '''Create an index of the indexed sequences followed by additional sequences
+
+        The current index is not changed. The row dictionary and the packed sequences (if already created)
+        are copied and extended, instead of indexing all the sequences again.
+
+        Parameters
+        ----------
+        sequences : list of str
+            the sequences to add (their rows follow the current sequences)
+
+        Returns
+        -------
+        SequenceIndex
+        '''
+        index = SequenceIndex.__new__(SequenceIndex)
+        index.seq_length = self.seq_length
+        index.min_search_length = self.min_search_length
+        index._sequences = np.concatenate([np.asarray(self._sequences, dtype=object), np.asarray(sequences, dtype=object)])
+        index._rows = dict(self._rows)
+        num_rows = len(self._sequences)
+        index._rows.update((cseq, num_rows + idx) for idx, cseq in enumerate(sequences))
+        index._packed = None
+        if self._packed is not None:
+            index._packed = np.vstack([self._packed, pack_sequences(sequences, self.seq_length)])
+        return index
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, sequence):
+        return self.lookup(sequence) >= 0
+
+    def normalize(self, sequence):
+        '''Trim and upper case a query sequence to match the database sequences
+
+        Parameters
+        ----------
+        sequence : str
+            the DNA sequence to normalize
+
+        Returns
+        -------
+        str or None
+            the normalized sequence, or None if the sequence is shorter than the database sequences
+        '''
+        if len(sequence) < self.seq_length:
+            return None
+        return sequence[:self.seq_length].upper()
+
+    def lookup(self, sequence):
+        '''Get the row of a sequence
+
+        Parameters
+        ----------
+        sequence : str
+            the DNA sequence to look for
+
+        Returns
+        -------
+        int
+            the row of the sequence, or -1 if not found (or too short)
+        '''
+        return self.lookup_many([sequence])[0]
+
+    def lookup_many(self, sequences):
+        '''Get the rows of a list of sequences
+
+        Parameters
+        ----------
+        sequences : list of str
+            the DNA sequences to look for
+
+        Returns
+        -------
+        rows : np.ndarray of int
+            the row of each sequence, or -1 if not found (or too short)
+        '''
+        seq_length = self.seq_length
+        rows = self._rows
+        return np.fromiter((rows.get(cseq[:seq_length].upper(), -1) if len(cseq) >= seq_length else -1 for cseq in sequences), dtype=np.int64)
+
+    def search(self, sequence, max_mismatches=0, min_identity=None):
+        '''Find the sequences similar to a query sequence
+
+        The query is compared (hamming distance) to the prefix of all the sequences using their 2 bit encoding.
+        Queries shorter than the database sequences (but at least min_search_length long) are compared to
+        the sequence prefixes of the same length.
+
+        Parameters
+        ----------
+        sequence : str
+            the DNA sequence to look for
+        max_mismatches : int (optional)
+            the maximal number of mismatching nucleotides for a sequence to match
+        min_identity : float or None (optional)
+            if not None, use the maximal number of mismatches allowing this fraction of identical nucleotides
+            (instead of max_mismatches)
+
+        Returns
+        -------
+        rows : np.ndarray of int
+            the rows of the matching sequences, sorted by number of mismatches
+        mismatches : np.ndarray of int
+            the number of mismatches of each matching sequence
+        '''
+        sequence = sequence[:self.seq_length].upper()
+        length = len(sequence)
+        if length < self.min_search_length:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        if min_identity is not None:
+            max_mismatches = int(np.floor((1 - min_identity) * length + 1e-9))
+        if self._packed is None:
+            self._packed = pack_sequences(self._sequences, self.seq_length)
+        query = pack_sequences([sequence], length)[0]
+        xor = self._packed[:, :len(query)] ^ query
+        if length % 4:
+            # ignore the padding after the end of the query
+            xor[:, -1] &= (0xff << (2 * (4 - length % 4))) & 0xff
+        mismatches = _BYTE_MISMATCHES[xor].sum(axis=1, dtype=np.int64)
+        # characters other than ACGT in the query (encoded as A) are always mismatches
+        for cpos, cnuc in enumerate(sequence):
+            if cnuc not in 'ACGT':
+                mismatches += ((self._packed[:, cpos // 4] >> (2 * (3 - cpos % 4))) & 3) == 0
+        rows = np.nonzero(mismatches <= max_mismatches)[0]
+        order = np.argsort(mismatches[rows], kind='mergesort')
+        return rows[order], mismatches[rows][order]
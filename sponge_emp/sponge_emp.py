@@ -1,12 +1,32 @@
+import hmac
 import time
+import threading
 
-from flask import Blueprint, request, g
+from flask import Blueprint, request, g, current_app, has_app_context
 import json
+import numpy as np
 from .utils import debug, getdoc, get_data_path
 from .autodoc import auto
+from .cache import LRUCache
+from .requestlog import RequestLog
+from .charts import chart_cache
+from . import metrics
+from .metrics import timed
 
 Sponge_Flask_Obj = Blueprint('Sponge_Flask_Obj', __name__, template_folder='templates')
 
+# cache of get_sequence_info() results (see get_sequence_info_cached())
+sequence_info_cache = LRUCache(max_items=1000, max_bytes=256 * 1024 * 1024)
+# cache of DBData.get_enrichment() results (see get_enriched_sequences())
+enrichment_cache = LRUCache(max_items=10000, max_bytes=256 * 1024 * 1024)
+
+# serializes creating the /sequence/info request log of each app (see get_request_log())
+_request_log_lock = threading.Lock()
+
+# time all the app requests (for /metrics and the X-Timing header)
+Sponge_Flask_Obj.before_app_request(metrics.start_request)
+Sponge_Flask_Obj.after_app_request(metrics.finish_request)
+
 
 @Sponge_Flask_Obj.route('/sequence/info', methods=['GET'])
 @auto.doc()
@@ -27,6 +47,14 @@ def sequence_info():
             threshold : float (optional)
                 If supplied, use > this frequency threshold for presence/absence call.
                 If not supplied use>0 for presence/absence
+            max_mismatches : int (optional)
+                If > 0, also use database sequences with up to max_mismatches mismatching nucleotides to the sequence.
+                If not supplied use only the identical database sequence
+            min_identity : float (optional)
+                If supplied, use database sequences with at least this fraction of identical nucleotides (instead of max_mismatches)
+            dataset : str (optional)
+                the dataset to search (see /datasets). If not supplied, use the dataset of the url (/datasets/<dataset>/sequence/info)
+                or the default dataset
         }
     Success Response:
         Code : 200
@@ -45,15 +73,18 @@ def sequence_info():
                     'observed_samples': int
                         the number of samples with this value which have the sequence present in them
                 }
+            'matched_sequences' : dict of {sequence(str): matches(list of dict)}
+                only when max_mismatches or min_identity are supplied.
+                the database sequences matched by each sequence. each match is a dict:
+                    'sequence' : str
+                        the database sequence
+                    'mismatches' : int
+                        the number of mismatches to the sequence
         }
     Validation:
     '''
     debug(1, 'sequence info')
-
-    # log the request ip so we can count :)
-    with open(get_data_path('sequence_info_logfile.txt'), 'a+') as fl:
-        sourceip = request.access_route[-1][:255]
-        fl.write('%s - %s\n' % (time.strftime('%d/%m/%y %H:%M'), sourceip))
+    start_time = time.monotonic()
 
     db = g.db
     alldat = request.get_json()
@@ -64,14 +95,53 @@ def sequence_info():
         return('sequence parameter missing', 400)
     threshold = alldat.get('threshold', 0)
     fields = alldat.get('fields')
+    try:
+        max_mismatches = int(alldat.get('max_mismatches') or 0)
+    except (TypeError, ValueError, OverflowError):
+        return('max_mismatches must be an integer', 400)
+    min_identity = alldat.get('min_identity')
+    if min_identity is not None:
+        try:
+            min_identity = float(min_identity)
+        except (TypeError, ValueError):
+            return('min_identity must be a number', 400)
+
+    g.sequence_info_cache_hit = None
+    err, res = get_sequence_info_cached(db, sequence, fields, threshold, max_mismatches=max_mismatches, min_identity=min_identity)
+
+    # log the request ip so we can count :), together with the request performance
+    request_log = get_request_log()
+    if request_log is not None:
+        request_log.log(ip=request.access_route[-1][:255], num_sequences=1 if isinstance(sequence, str) else len(sequence),
+                        cache={True: 'hit', False: 'miss', None: 'none'}[g.sequence_info_cache_hit],
+                        latency_ms=round(1000 * (time.monotonic() - start_time), 3), error=err)
 
-    err, res = get_sequence_info(db, sequence, fields, threshold)
     if err:
         return 'error encountered: %s' % err, 400
     return json.dumps(res)
 
 
-def get_sequence_info(db, sequence, fields=None, threshold=0, mincounts=4):
+def get_request_log():
+    '''Get the /sequence/info request log of the current app, creating it on first use
+
+    The log file is set by the app config SEQUENCE_INFO_LOG (default data/sequence_info_logfile.txt),
+    or None to disable logging. SEQUENCE_INFO_LOG_MAX_BYTES sets the log size for rotation (default 10MB).
+
+    Returns
+    -------
+    RequestLog or None
+        None if logging is disabled
+    '''
+    with _request_log_lock:
+        if 'sequence_info_log' not in current_app.extensions:
+            filename = current_app.config.get('SEQUENCE_INFO_LOG', get_data_path('sequence_info_logfile.txt'))
+            if filename is None:
+                return None
+            current_app.extensions['sequence_info_log'] = RequestLog(filename, max_bytes=current_app.config.get('SEQUENCE_INFO_LOG_MAX_BYTES', 10 * 1024 * 1024))
+    return current_app.extensions['sequence_info_log']
+
+
+def get_sequence_info(db, sequence, fields=None, threshold=0, mincounts=4, max_mismatches=0, min_identity=None):
     '''Get all total frequencies of the sequences in the various fields/values
 
     Parameters
@@ -86,6 +156,12 @@ def get_sequence_info(db, sequence, fields=None, threshold=0, mincounts=4):
         If not supplied use>0 for presence/absence
     mincounts : int (optional)
         the minimal total number of counts for a field/value in order to be returned
+    max_mismatches : int (optional)
+        if > 0, replace each sequence by the database sequences with up to max_mismatches mismatches to it.
+        Sequences shorter than the database sequences are compared to the database sequence prefixes.
+    min_identity : float or None (optional)
+        if not None, replace each sequence by the database sequences with at least min_identity fraction of
+        identical nucleotides (instead of max_mismatches)
 
     Returns
     -------
@@ -104,6 +180,9 @@ def get_sequence_info(db, sequence, fields=None, threshold=0, mincounts=4):
                     the total number of samples having this value
                 'observed_samples': int
                     the number of samples with this value which have the sequence present in them
+        'matched_sequences' : dict of {sequence(str): list of dict}
+            only if max_mismatches > 0 or min_identity is not None.
+            the database sequences ('sequence') and number of mismatches ('mismatches') matched by each sequence
     '''
     if fields is None:
         fields = db.get_fields(exclude=['#SampleID'])
@@ -111,38 +190,745 @@ def get_sequence_info(db, sequence, fields=None, threshold=0, mincounts=4):
     if isinstance(sequence, str):
         sequence = [sequence]
 
-    total_observed = 0
-    newseqs = []
-    for csequence in sequence:
-        # trim and upper case the sequence
-        if len(csequence) < db.seq_length:
-            continue
-        csequence = csequence[:db.seq_length].upper()
-        total_observed += db.get_total_observed(csequence, threshold=threshold)
-        newseqs.append(csequence)
+    if max_mismatches < 0:
+        return 'max_mismatches must be >= 0', None
+    if min_identity is not None and not 0 <= min_identity <= 1:
+        return 'min_identity must be between 0 and 1', None
+    approximate = max_mismatches > 0 or min_identity is not None
+    if approximate:
+        min_length = db.min_search_length
+    else:
+        min_length = db.seq_length
+
+    # the database lookup trims and upper cases the sequences, so only need to skip the short ones
+    newseqs = [csequence for csequence in sequence if len(csequence) >= min_length]
 
     if len(newseqs) == 0:
         debug(3, 'No sequences processed')
-        return 'All sequences too short. minimal length is %d' % db.seq_length, None
+        return 'All sequences too short. minimal length is %d' % min_length, None
 
-    total_samples = db.get_total_samples() * len(newseqs)
+    if approximate:
+        # replace each sequence by the matching database sequences
+        matched_sequences = {}
+        matched = []
+        with timed('sequence_search'):
+            for csequence in newseqs:
+                matches = db.search_sequence(csequence, max_mismatches=max_mismatches, min_identity=min_identity)
+                matched_sequences[csequence] = [{'sequence': cmatch, 'mismatches': cmismatches} for cmatch, cmismatches in matches]
+                if len(matches) == 0:
+                    matched.append(csequence)
+                matched.extend(cmatch for cmatch, cmismatches in matches)
+        # remove duplicate database sequences (keeping the order)
+        newseqs = list(dict.fromkeys(matched))
+        debug(1, 'approximate search matched %d sequences' % len(newseqs))
 
-    if total_observed == 0:
-        debug(1, 'Sequence does not appear in database')
-        return '', {'total_samples': total_samples, 'total_observed': 0, 'info': {}}
+    with timed('total_observed'):
+        total_observed = db.get_total_observed(newseqs, threshold=threshold)
+
+    total_samples = db.get_total_samples() * len(newseqs)
 
     res = {}
     res['total_samples'] = total_samples
     res['total_observed'] = total_observed
-    res['info'] = {}
+    if approximate:
+        res['matched_sequences'] = matched_sequences
+
+    if total_observed == 0:
+        debug(1, 'Sequence does not appear in database')
+        res['info'] = {}
+        return '', res
+
+    with timed('get_info'):
+        res['info'] = db.get_info_fields(newseqs, fields=fields, threshold=threshold, mincounts=mincounts)
+
+    return '', res
+
+
+def get_sequence_info_cached(db, sequence, fields=None, threshold=0, mincounts=4, max_mismatches=0, min_identity=None):
+    '''Get the results of get_sequence_info() using the sequence_info_cache
+
+    The cache key is the database data_id and the normalized (trimmed, upper case and sorted) sequences
+    together with the other parameters, so results from a previous database are never returned.
+    Errors are not cached. Each call returns a shallow copy of the cached result, with the matched sequences
+    of the caller sequences. The field information ('info') is shared and should not be modified.
+
+    Parameters
+    ----------
+    see get_sequence_info()
+
+    Returns
+    -------
+    see get_sequence_info()
+    '''
+    # the parameters are part of the cache key, so check them before using them
+    try:
+        threshold = float(threshold)
+    except (TypeError, ValueError):
+        return 'threshold must be a number', None
+    if fields is not None:
+        if not isinstance(fields, (list, tuple)) or not all(isinstance(cfield, str) for cfield in fields):
+            return 'fields must be a list of field names', None
+        fields = tuple(fields)
+    if isinstance(sequence, str):
+        sequence = [sequence]
+    seqs = tuple(sorted(csequence[:db.seq_length].upper() for csequence in sequence))
+    key = (db.data_id, seqs, fields, threshold, mincounts, max_mismatches, min_identity)
+    res = sequence_info_cache.get(key)
+    # let the request know if it was answered from the cache (for the request log)
+    if has_app_context():
+        g.sequence_info_cache_hit = res is not None
+    if res is not None:
+        debug(1, 'sequence info cache hit')
+        return '', _get_caller_sequence_info(res, sequence, db.seq_length)
+
+    err, res = get_sequence_info(db, sequence, fields=fields, threshold=threshold, mincounts=mincounts, max_mismatches=max_mismatches, min_identity=min_identity)
+    if err:
+        return err, res
+    # the cached matched sequences are keyed by the normalized sequences (as the cache key)
+    if 'matched_sequences' in res:
+        res['matched_sequences'] = {csequence[:db.seq_length].upper(): cmatches for csequence, cmatches in res['matched_sequences'].items()}
+    sequence_info_cache.put(key, res, nbytes=_get_sequence_info_size(res))
+    return '', _get_caller_sequence_info(res, sequence, db.seq_length)
+
+
+def _get_caller_sequence_info(res, sequence, seq_length):
+    '''Get a copy of a cached get_sequence_info() result for the sequences of the caller
+
+    Parameters
+    ----------
+    res : dict
+        the cached result (with the matched sequences keyed by the normalized sequences)
+    sequence : list of str
+        the sequences of the caller
+    seq_length : int
+        the database sequence length
+
+    Returns
+    -------
+    dict
+        a shallow copy of res, with the matched sequences keyed by the caller sequences
+    '''
+    res = dict(res)
+    if 'matched_sequences' in res:
+        matched = res['matched_sequences']
+        res['matched_sequences'] = {csequence: matched[csequence[:seq_length].upper()] for csequence in sequence
+                                    if csequence[:seq_length].upper() in matched}
+    return res
+
+
+def _get_sequence_info_size(res):
+    '''Estimate the memory used by a get_sequence_info() result
+
+    Parameters
+    ----------
+    res : dict
+        the get_sequence_info() result
+
+    Returns
+    -------
+    int
+        the estimated size in bytes
+    '''
+    # the dict of each value and its keys
+    num_values = sum(len(cfinfo) for cfinfo in res['info'].values())
+    nbytes = 1000 + 500 * num_values
+    # the shared sequence profile (the frequencies and up to 3 rank arrays)
+    for cfinfo in res['info'].values():
+        for cdist in cfinfo.values():
+            nbytes += 4 * cdist.profile.freq.nbytes
+            return nbytes
+    return nbytes
+
+
+@Sponge_Flask_Obj.route('/cache/stats', methods=['GET'])
+@auto.doc()
+def cache_stats():
+    '''
+    Title: Get the sequence info cache statistics
+    URL: /cache/stats
+    Description : Get the counters of the sequence information results cache
+    Method: GET
+    Success Response:
+        Code : 200
+        Content :
+        {
+            'hits' : int
+                the number of requests answered from the cache
+            'misses' : int
+                the number of requests not found in the cache
+            'evictions' : int
+                the number of results removed from the cache to free space
+            'items' : int
+                the number of results in the cache
+            'bytes' : int
+                the estimated memory used by the results in the cache
+        }
+    '''
+    return json.dumps(sequence_info_cache.get_stats())
+
+
+@Sponge_Flask_Obj.route('/metrics', methods=['GET'])
+@auto.doc()
+def metrics_page():
+    '''
+    Title: Get the server metrics
+    URL: /metrics
+    Description : Get the request stage time histograms, request counters and cache counters (of the serving process)
+    in the prometheus text format. Add profile=1 to any request (or the X-Timing header) to get the request stage times
+    in the X-Timing response header.
+    Method: GET
+    Success Response:
+        Code : 200
+        Content : prometheus text exposition format
+    '''
+    text = metrics.stats.get_prometheus_text()
+    text += metrics.get_cache_metrics_text({'sequence_info': sequence_info_cache.get_stats(), 'pie_chart': chart_cache.get_stats(),
+                                            'enrichment': enrichment_cache.get_stats()})
+    request_log = current_app.extensions.get('sequence_info_log')
+    if request_log is not None:
+        text += '# HELP spongeemp_request_log_dropped_total Number of request log records dropped (queue full)\n'
+        text += '# TYPE spongeemp_request_log_dropped_total counter\n'
+        text += 'spongeemp_request_log_dropped_total %d\n' % request_log.dropped
+    return text, 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+@Sponge_Flask_Obj.route('/sequences/info_batch', methods=['GET', 'POST'])
+@auto.doc()
+def sequences_info_batch():
+    '''
+    Title: Get information for a batch of sequences
+    URL: /sequences/info_batch
+    Description : Get the distribution information separately for each sequence in a list of sequences
+    Method: GET, POST
+    URL Params:
+    Data Params: JSON
+        {
+            sequences : list of str (ACGT sequences)
+                the sequences to get information about
+            fields : list of str or None (optional)
+                if None (default) return distribution information about all fields except #SampleID.
+                Otherwise, return distribution information only in the specified fields
+            threshold : float (optional)
+                If supplied, use > this frequency threshold for presence/absence call.
+                If not supplied use>0 for presence/absence
+        }
+    Success Response:
+        Code : 200
+        Content :
+        {
+            'results' : list of dict
+                the information for each sequence (in the order of sequences). each dict contains:
+                'sequence' : str
+                    the sequence
+                'total_samples' : int
+                    the total amount of samples in the database
+                'total_observed' : int
+                    the total number of samples where the sequence is present
+                'info' : dict of {field(str): information(dict)}
+                    the frequency of the sequence in each field (see /sequence/info)
+                'error' : str
+                    only if the sequence could not be processed (i.e. too short)
+        }
+    Validation:
+    '''
+    debug(1, 'sequences info batch')
+    db = g.db
+    alldat = request.get_json()
+    if alldat is None:
+        return(getdoc(sequences_info_batch))
+    sequences = alldat.get('sequences')
+    if sequences is None:
+        return('sequences parameter missing', 400)
+    threshold = alldat.get('threshold', 0)
+    fields = alldat.get('fields')
+
+    err, res = get_sequence_info_batch(db, sequences, fields, threshold)
+    if err:
+        return 'error encountered: %s' % err, 400
+    return json.dumps({'results': res})
+
+
+def get_sequence_info_batch(db, sequences, fields=None, threshold=0, mincounts=4):
+    '''Get the total frequencies in the various fields/values separately for each sequence
+
+    Parameters
+    ----------
+    sequences : list of str
+        The DNA sequences to get information about.
+    fields : list of str or None (optional)
+        if None (default) return distribution information about all fields except #SampleID.
+        Otherwise, return distribution information only in the specified fields
+    threshold : float (optional)
+        If supplied, use > this frequency threshold for presence/absence call.
+        If not supplied use>0 for presence/absence
+    mincounts : int (optional)
+        the minimal total number of counts for a field/value in order to be returned
+
+    Returns
+    -------
+    err : str
+        the error encountered or '' if ok
+    res : list of dict
+        the information for each sequence (same as get_sequence_info() without the ValueInfo sample frequencies),
+        with an additional 'sequence' key. Sequences too short contain only 'sequence' and 'error' keys.
+    '''
+    if not isinstance(sequences, (list, tuple)) or not all(isinstance(csequence, str) for csequence in sequences):
+        return 'sequences must be a list of sequences', None
+    try:
+        threshold = float(threshold)
+    except (TypeError, ValueError):
+        return 'threshold must be a number', None
+    if fields is None:
+        fields = db.get_fields(exclude=['#SampleID'])
+    elif not isinstance(fields, (list, tuple)) or not all(isinstance(cfield, str) for cfield in fields):
+        return 'fields must be a list of field names', None
+
+    total_samples = db.get_total_samples()
+    total_observed, info = db.get_info_batch(sequences, fields=fields, threshold=threshold, mincounts=mincounts)
+    res = []
+    for csequence, cobserved, cinfo in zip(sequences, total_observed, info):
+        if len(csequence) < db.seq_length:
+            res.append({'sequence': csequence, 'error': 'sequence too short. minimal length is %d' % db.seq_length})
+            continue
+        if cobserved == 0:
+            cinfo = {}
+        res.append({'sequence': csequence, 'total_samples': total_samples, 'total_observed': int(cobserved), 'info': cinfo})
+    return '', res
+
+
+@Sponge_Flask_Obj.route('/value/enriched_sequences', methods=['GET', 'POST'])
+@auto.doc()
+def value_enriched_sequences():
+    '''
+    Title: Get the sequences enriched in a field value
+    URL: /value/enriched_sequences
+    Description : Get the sequences most enriched in the samples with a given metadata field value
+    (using the binomial and rank sum tests of the sequence annotations)
+    Method: GET, POST
+    URL Params:
+    Data Params: JSON
+        {
+            field : str
+                the metadata field (i.e. 'host_scientific_name')
+            value : str
+                the field value (i.e. 'Ircinia strobilina')
+            threshold : float (optional)
+                If supplied, use > this frequency threshold for presence/absence call.
+                If not supplied use>0 for presence/absence
+            top : int (optional)
+                the maximal number of sequences to return (default 50)
+            min_observed : int (optional)
+                the minimal number of samples with the value where the sequence is present (default 1)
+        }
+    Success Response:
+        Code : 200
+        Content :
+        {
+            'group_size' : int
+                the number of samples with the value
+            'total_samples' : int
+                the total number of samples in the database
+            'sequences' : list of dict
+                the most enriched sequences (sorted by the binomial p-value, then by the rank sum p-value). each dict contains:
+                'sequence' : str
+                    the sequence
+                'taxonomy' : str
+                    the sequence taxonomy
+                'observed_samples' : int
+                    the number of samples with the value where the sequence is present
+                'total_observed' : int
+                    the total number of samples where the sequence is present
+                'binomial_pval' : float
+                    the binomial test p-value for presence in samples with the value
+                'ranksum_pval' : float
+                    the rank sum test p-value for higher frequency in samples with the value
+        }
+    Validation:
+    '''
+    debug(1, 'value enriched sequences')
+    db = g.db
+    alldat = request.get_json()
+    if alldat is None:
+        return(getdoc(value_enriched_sequences))
+    field = alldat.get('field')
+    value = alldat.get('value')
+    if field is None or value is None:
+        return('field and value parameters required', 400)
+    # the field and value are part of the cache key
+    if not isinstance(field, str) or isinstance(value, (list, dict)):
+        return('field and value must be a field name and a value', 400)
+    try:
+        threshold = float(alldat.get('threshold', 0))
+    except (TypeError, ValueError):
+        return('threshold must be a number', 400)
+    try:
+        top = int(alldat.get('top', 50))
+        min_observed = int(alldat.get('min_observed', 1))
+    except (TypeError, ValueError, OverflowError):
+        return('top and min_observed must be integers', 400)
+
+    err, res = get_enriched_sequences(db, field, value, threshold=threshold, top=top, min_observed=min_observed)
+    if err:
+        return 'error encountered: %s' % err, 400
+    return json.dumps(res)
+
+
+def get_enrichment_cached(db, field, value, threshold=0):
+    '''Get the DBData.get_enrichment() results using the enrichment_cache
+
+    Parameters
+    ----------
+    see DBData.get_enrichment()
+
+    Returns
+    -------
+    see DBData.get_enrichment(). The returned results are shared and should not be modified.
+    '''
+    key = (db.data_id, field, str(value), threshold)
+    res = enrichment_cache.get(key)
+    if res is not None:
+        return res
+    with timed('enrichment'):
+        res = db.get_enrichment(field, value, threshold=threshold)
+    if res is not None:
+        enrichment_cache.put(key, res, nbytes=1000 + sum(carr.nbytes for carr in res.values() if isinstance(carr, np.ndarray)))
+    return res
+
+
+def precompute_enrichment(db, fields=None, threshold=0):
+    '''Fill the enrichment_cache with the enrichment of all the values of the fields
+
+    Parameters
+    ----------
+    db : DBData
+    fields : list of str or None (optional)
+        the fields to precompute. None (default) for all fields except #SampleID
+    threshold : float (optional)
+        the presence threshold (see DBData.get_enrichment())
+    '''
+    if fields is None:
+        fields = db.get_fields(exclude=['#SampleID'])
     for cfield in fields:
-        debug(1, 'processing field %s' % cfield)
-        cinfo = db.get_info(newseqs, field=cfield, threshold=threshold, mincounts=mincounts)
-        res['info'][cfield] = cinfo
+        for cvalue in db.sample_metadata[cfield].cat.categories:
+            get_enrichment_cached(db, cfield, cvalue, threshold=threshold)
+    debug(2, 'precomputed enrichment of %d fields' % len(fields))
+
+
+def get_enriched_sequences(db, field, value, threshold=0, top=50, min_observed=1):
+    '''Get the sequences most enriched in the samples with a given field value
+
+    Parameters
+    ----------
+    db : DBData
+    field : str
+        the metadata field
+    value : str
+        the field value
+    threshold : float (optional)
+        the minimal frequency (using > threshold) for a sequence to be present in a sample
+    top : int (optional)
+        the maximal number of sequences to return
+    min_observed : int (optional)
+        the minimal number of samples with the value where the sequence is present
+
+    Returns
+    -------
+    err : str
+        the error encountered or '' if ok
+    res : dict
+        see /value/enriched_sequences
+    '''
+    if top < 0:
+        return 'top must be >= 0', None
+    enrichment = get_enrichment_cached(db, field, value, threshold=threshold)
+    if enrichment is None:
+        return 'field %s value %s not found' % (field, value), None
+    select = np.flatnonzero(enrichment['observed'] >= min_observed)[:top]
+    sequences = []
+    for cpos in select:
+        csequence = db.fids[enrichment['rows'][cpos]]
+        sequences.append({'sequence': csequence, 'taxonomy': db.get_taxonomy(csequence),
+                          'observed_samples': int(enrichment['observed'][cpos]), 'total_observed': int(enrichment['total_observed'][cpos]),
+                          'binomial_pval': float(enrichment['binomial_pval'][cpos]), 'ranksum_pval': float(enrichment['ranksum_pval'][cpos])})
+    res = {'group_size': enrichment['group_size'], 'total_samples': enrichment['total_samples'], 'sequences': sequences}
+    return '', res
+
+
+@Sponge_Flask_Obj.route('/samples/similar', methods=['GET', 'POST'])
+@auto.doc()
+def samples_similar():
+    '''
+    Title: Get the samples most similar to a community
+    URL: /samples/similar
+    Description : Get the database samples with the most similar community (Bray-Curtis or Jaccard similarity) to a given community
+    Method: GET, POST
+    URL Params:
+    Data Params: JSON
+        {
+            sequences : list of str (ACGT sequences)
+                the sequences of the community
+            counts : list of float (optional)
+                the number of reads of each sequence. If not supplied, use 1 read per sequence
+            metric : str (optional)
+                'braycurtis' (default) to use the relative frequencies, or 'jaccard' to use presence/absence
+            top : int (optional)
+                the maximal number of samples to return (default 20)
+        }
+    Success Response:
+        Code : 200
+        Content :
+        {
+            'query_features' : int
+                the number of distinct sequences in the community
+            'matched_features' : int
+                the number of community sequences found in the database
+            'samples' : list of dict
+                the samples sharing sequences with the community, sorted by decreasing similarity. each dict contains:
+                'sample_id' : str
+                    the sample id
+                'similarity' : float
+                    the similarity (between 0 and 1) of the sample to the community
+                'shared_features' : int
+                    the number of community sequences present in the sample
+                'metadata' : dict of {field(str): value}
+                    the sample metadata
+        }
+    Validation:
+    '''
+    debug(1, 'similar samples')
+    db = g.db
+    alldat = request.get_json()
+    if alldat is None:
+        return(getdoc(samples_similar))
+    sequences = alldat.get('sequences')
+    if sequences is None:
+        return('sequences parameter missing', 400)
+    counts = alldat.get('counts')
+    metric = alldat.get('metric', 'braycurtis')
+    try:
+        top = int(alldat.get('top', 20))
+    except (TypeError, ValueError, OverflowError):
+        return('top must be an integer', 400)
+
+    err, res = get_similar_samples(db, sequences, counts=counts, metric=metric, top=top)
+    if err:
+        return 'error encountered: %s' % err, 400
+    return json.dumps(res)
+
 
+def get_similar_samples(db, sequences, counts=None, metric='braycurtis', top=20):
+    '''Get the samples most similar to a community, with their metadata
+
+    Parameters
+    ----------
+    db : DBData
+    sequences : list of str
+        the sequences of the community
+    counts : list of float or None (optional)
+        the number of reads of each sequence. None (default) for 1 read per sequence
+    metric : str (optional)
+        'braycurtis' (default) or 'jaccard'
+    top : int (optional)
+        the maximal number of samples to return
+
+    Returns
+    -------
+    err : str
+        the error encountered or '' if ok
+    res : dict
+        see /samples/similar
+    '''
+    if not isinstance(sequences, (list, tuple)) or not all(isinstance(csequence, str) for csequence in sequences):
+        return 'sequences must be a list of sequences', None
+    if top < 0:
+        return 'top must be >= 0', None
+    try:
+        with timed('similar_samples'):
+            similar = db.get_similar_samples(sequences, counts=counts, metric=metric, top=top)
+    except ValueError as err:
+        return str(err), None
+    samples = []
+    for cpos, csimilarity, cshared in zip(similar['samples'], similar['similarity'], similar['shared_features']):
+        metadata = db.sample_metadata.iloc[cpos]
+        samples.append({'sample_id': str(metadata.name), 'similarity': float(csimilarity), 'shared_features': int(cshared),
+                        'metadata': {cfield: _get_json_value(cvalue) for cfield, cvalue in metadata.items()}})
+    res = {'query_features': similar['query_features'], 'matched_features': similar['matched_features'], 'samples': samples}
     return '', res
 
 
+def _get_json_value(value):
+    # numpy scalars (i.e. numeric metadata values) are not json serializable
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+@Sponge_Flask_Obj.route('/datasets', methods=['GET'])
+@auto.doc()
+def datasets_list():
+    '''
+    Title: Get the datasets
+    URL: /datasets
+    Description : Get the datasets served by the server. Requests for a dataset use the /datasets/<dataset>/ url prefix
+    (i.e. /datasets/<dataset>/sequence/info) or the 'dataset' parameter
+    Method: GET
+    Success Response:
+        Code : 200
+        Content :
+        {
+            'datasets' : list of dict
+                for each dataset:
+                'name' : str
+                'description' : str
+                'default' : bool
+                    true for the dataset used when no dataset is selected
+                'loaded' : bool
+                    true if the dataset is in memory (datasets are loaded on first use)
+                'memory_bytes', 'mapped_bytes' : int or null
+                    the memory used by the loaded dataset (memory mapped snapshot arrays are counted separately)
+        }
+    '''
+    datasets = current_app.extensions.get('datasets')
+    if datasets is None:
+        return json.dumps({'datasets': []})
+    res = [{ckey: cinfo[ckey] for ckey in ('name', 'description', 'default', 'loaded', 'memory_bytes', 'mapped_bytes')}
+           for cinfo in datasets.get_info()]
+    return json.dumps({'datasets': res})
+
+
+@Sponge_Flask_Obj.route('/admin/reload', methods=['POST'])
+def admin_reload():
+    '''
+    Title: Reload the database
+    URL: /admin/reload
+    Description : Load a new database version in the background and serve it when ready (after the warm-up queries).
+    Requests already running keep using the previous version. Requires the app config ADMIN_TOKEN in the X-Admin-Token header.
+    When serving multiple datasets, reloads the dataset of the request (i.e. /datasets/<dataset>/admin/reload).
+    Method: POST
+    URL Params:
+    Data Params: JSON (optional)
+        {
+            biom : str (optional)
+                a biom table (on the server) of samples to add to the current version (see DBData.append()),
+                instead of reloading the database
+            map : str (optional)
+                the mapping file of the samples to add (required with biom)
+            wait : bool (optional)
+                true to return after the new version is served (default false)
+        }
+    Success Response:
+        Code : 202 (loading) or 200 (wait is true and the new version is served)
+        Content : the database status (see /admin/status)
+    Validation:
+        Code : 409 if a new version is already being loaded
+    '''
+    err, registry = get_admin_registry()
+    if err:
+        return err, 403
+    alldat = request.get_json(silent=True) or {}
+    wait = bool(alldat.get('wait', False))
+    try:
+        if 'biom' in alldat:
+            if 'map' not in alldat:
+                return 'map parameter missing', 400
+            started = registry.append(alldat['biom'], alldat['map'], wait=wait)
+        else:
+            started = registry.reload(wait=wait)
+    except Exception as err:
+        return 'error encountered: %s' % err, 400
+    if not started:
+        return 'database is already being loaded', 409
+    datasets = current_app.extensions.get('datasets')
+    if wait and datasets is not None:
+        datasets.update_memory(g.dataset)
+    return json.dumps(registry.status), 200 if wait else 202
+
+
+@Sponge_Flask_Obj.route('/admin/status', methods=['GET'])
+def admin_status():
+    '''
+    Title: Get the database status
+    URL: /admin/status
+    Description : Get the served database version and the state of the last reload. Requires the admin token (see /admin/reload)
+    Method: GET
+    Success Response:
+        Code : 200
+        Content :
+        {
+            'state' : str
+                'loading' (a new version is being loaded), 'ready' or 'failed' (no version loaded)
+            'version' : int
+                the number of versions loaded
+            'data_id' : str
+                the id of the served version
+            'loaded' : float
+                the time the served version was loaded (seconds since the epoch)
+            'load_seconds' : float
+                the load and warm-up time of the served version
+            'error' : str or None
+                the error of the last failed load
+            'dataset' : str
+                when serving multiple datasets, the dataset of the request (i.e. /datasets/<dataset>/admin/status)
+            'datasets' : list of dict
+                when serving multiple datasets, the state and memory usage of all the datasets
+        }
+    '''
+    err, registry = get_admin_registry()
+    if err:
+        return err, 403
+    status = dict(registry.status)
+    datasets = current_app.extensions.get('datasets')
+    if datasets is not None:
+        status['dataset'] = g.dataset
+        status['datasets'] = datasets.get_info()
+    return json.dumps(status)
+
+
+def get_admin_registry():
+    '''Check the admin token of the request, and get the database registry of the app
+
+    Returns
+    -------
+    err : str
+        the error encountered or '' if ok
+    registry : DBRegistry or None
+    '''
+    token = current_app.config.get('ADMIN_TOKEN')
+    if not token:
+        return 'admin requests are disabled (ADMIN_TOKEN not set)', None
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token):
+        return 'wrong admin token', None
+    datasets = current_app.extensions.get('datasets')
+    if datasets is not None:
+        registry = datasets.get_registry(g.get('dataset'))
+    else:
+        registry = current_app.extensions.get('db_registry')
+    if registry is None:
+        return 'database reload not supported by this server', None
+    return '', registry
+
+
+def warmup_db(db, num_sequences=100):
+    '''Run queries on a newly loaded database, so the first requests using it are not slow
+
+    Gets the information of sequences spread over the whole database (reading the memory mapped data and
+    filling the sequence information cache), and creates the approximate search index.
+
+    Parameters
+    ----------
+    db : DBData
+    num_sequences : int (optional)
+        the number of sequences to query
+    '''
+    if len(db.fids) == 0:
+        return
+    with timed('warmup'):
+        for cpos in np.unique(np.linspace(0, len(db.fids) - 1, num_sequences).astype(int)):
+            get_sequence_info_cached(db, db.fids[cpos])
+        db.search_sequence(db.fids[0], max_mismatches=1)
+    debug(3, 'database %s warm-up done' % db.data_id)
+
+
 @Sponge_Flask_Obj.route('/docs')
 def documentation():
     return auto.html()
@@ -0,0 +1,52 @@
+// draw the pie charts of the sequence annotations page in the browser
+// each <canvas class="piechart"> contains the chart in the data-chart attribute as json: {labels, x, title}
+(function () {
+    var colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf'];
+
+    function drawPieChart(canvas) {
+        var chart = JSON.parse(canvas.getAttribute('data-chart'));
+        var ctx = canvas.getContext('2d');
+        var cx = canvas.width / 2;
+        var cy = canvas.height / 2 + 20;
+        var radius = Math.min(canvas.width, canvas.height) / 2 - 70;
+
+        ctx.clearRect(0, 0, canvas.width, canvas.height);
+        ctx.fillStyle = 'black';
+        ctx.textAlign = 'center';
+        ctx.font = '20px sans-serif';
+        ctx.fillText(chart.title, cx, 24);
+        if (chart.x.length === 0) {
+            ctx.font = '14px sans-serif';
+            ctx.fillText('Not found in enough samples.', cx, cy - 10);
+            ctx.fillText('Cannot generate statistics', cx, cy + 10);
+            return;
+        }
+
+        // slices go counter clockwise starting from the right (as in matplotlib)
+        var start = 0;
+        ctx.font = '12px sans-serif';
+        for (var i = 0; i < chart.x.length; i++) {
+            var angle = chart.x[i] * 2 * Math.PI;
+            ctx.beginPath();
+            ctx.moveTo(cx, cy);
+            ctx.arc(cx, cy, radius, -start - angle, -start);
+            ctx.closePath();
+            ctx.fillStyle = colors[i % colors.length];
+            ctx.fill();
+            if (chart.labels[i]) {
+                var mid = start + angle / 2;
+                var lx = cx + Math.cos(mid) * (radius + 10);
+                var ly = cy - Math.sin(mid) * (radius + 10);
+                ctx.fillStyle = 'black';
+                ctx.textAlign = Math.cos(mid) >= 0 ? 'left' : 'right';
+                ctx.fillText(chart.labels[i], lx, ly);
+            }
+            start += angle;
+        }
+    }
+
+    var canvases = document.getElementsByClassName('piechart');
+    for (var i = 0; i < canvases.length; i++) {
+        drawPieChart(canvases[i]);
+    }
+})();
@@ -0,0 +1,152 @@
+import numpy as np
+import scipy.stats
+
+
+class RankReference:
+    def __init__(self, freq):
+        '''Ranks of values within a reference frequency vector (all the samples)
+
+        Calculates the ranks (ties get the average rank) once, so the rank sums of many sample groups
+        can be calculated without re-ranking the full vector for each group.
+
+        Parameters
+        ----------
+        freq : np.ndarray of float
+            the frequency of the sequence in each sample
+        '''
+        self.sorted_freq = np.sort(freq)
+        self.num_samples = len(freq)
+        # the tie correction for the kruskal-wallis statistic
+        _, tie_counts = np.unique(self.sorted_freq, return_counts=True)
+        if self.num_samples > 1:
+            self.tie_correction = 1 - np.sum(tie_counts ** 3 - tie_counts) / (self.num_samples ** 3 - self.num_samples)
+        else:
+            self.tie_correction = 0
+
+    def ranks(self, values):
+        '''Get the (average) ranks of values in the reference vector
+
+        Parameters
+        ----------
+        values : np.ndarray of float
+            values from the reference vector
+
+        Returns
+        -------
+        np.ndarray of float
+            the rank of each value (1 based, ties get the average rank)
+        '''
+        left = np.searchsorted(self.sorted_freq, values, side='left')
+        right = np.searchsorted(self.sorted_freq, values, side='right')
+        return (left + right + 1) / 2
+
+
+def binomial_pvals(observed, total, null_pv):
+    '''Get the binomial test p-values for enrichment of the observed samples in each group
+
+    Parameters
+    ----------
+    observed : np.ndarray of int
+        the number of samples in each group where the sequence is observed
+    total : np.ndarray of int
+        the number of samples in each group
+    null_pv : float
+        the probability of the sequence not being observed in a sample
+
+    Returns
+    -------
+    np.ndarray of float
+        the p-value for each group
+    '''
+    observed = np.asarray(observed)
+    total = np.asarray(total)
+    return scipy.stats.binom.cdf(total - observed, total, null_pv)
+
+
+def ranksum_pvals(rank_sums, group_sizes, num_samples, tie_correction):
+    '''Get the kruskal-wallis p-values for higher ranks in each group compared to the rest of the samples
+
+    Groups with mean rank not higher than the rest of the samples get p-value 1.
+
+    Parameters
+    ----------
+    rank_sums : np.ndarray of float
+        the sum of the (average) ranks of the samples in each group
+    group_sizes : np.ndarray of int
+        the number of samples in each group
+    num_samples : int
+        the total number of samples
+    tie_correction : float or np.ndarray of float
+        the tie correction factor of the ranks (see RankReference), or the tie correction of each group
+        (if the groups are ranked in different reference vectors)
+
+    Returns
+    -------
+    np.ndarray of float
+        the p-value for each group
+    '''
+    rank_sums = np.asarray(rank_sums, dtype=float)
+    group_sizes = np.asarray(group_sizes, dtype=float)
+    tie_correction = np.broadcast_to(np.asarray(tie_correction, dtype=float), rank_sums.shape)
+    pvals = np.ones(len(rank_sums))
+    if num_samples < 2:
+        return pvals
+    rest_sums = num_samples * (num_samples + 1) / 2 - rank_sums
+    rest_sizes = num_samples - group_sizes
+    # mean rank in group higher than in the rest of the samples (compared without dividing)
+    higher = (group_sizes > 0) & (rest_sizes > 0) & (tie_correction > 0) & (rank_sums * rest_sizes > rest_sums * group_sizes)
+    if not np.any(higher):
+        return pvals
+    ssbn = rank_sums[higher] ** 2 / group_sizes[higher] + rest_sums[higher] ** 2 / rest_sizes[higher]
+    h = 12.0 / (num_samples * (num_samples + 1)) * ssbn - 3 * (num_samples + 1)
+    h /= tie_correction[higher]
+    pvals[higher] = scipy.stats.chi2.sf(h, 1)
+    return pvals
+
+
+def get_row_ranks(block, num_samples):
+    '''Get the ranks of the frequencies of each row (sequence) of a sparse matrix among all the samples
+
+    The zero (not stored) frequencies of each row are ranked together (as one tie group).
+
+    Parameters
+    ----------
+    block : scipy.sparse.csr_matrix
+        the frequencies (rows are sequences, columns are samples). Stored entries should be non-zero
+    num_samples : int
+        the number of samples (columns)
+
+    Returns
+    -------
+    entry_ranks : np.ndarray of float
+        the (average) rank of each stored entry (aligned with block.data) in its row
+    zero_ranks : np.ndarray of float
+        the rank of the zero frequencies in each row
+    tie_correction : np.ndarray of float
+        the tie correction factor of the ranks of each row (see RankReference)
+    '''
+    row_lengths = np.diff(block.indptr)
+    num_zeros = num_samples - row_lengths
+    nnz = len(block.data)
+    row_ids = np.repeat(np.arange(block.shape[0]), row_lengths)
+    # sort the entries by row and then frequency, and find the runs of tied frequencies
+    order = np.lexsort((block.data, row_ids))
+    sorted_rows = row_ids[order]
+    sorted_data = block.data[order]
+    new_run = np.ones(nnz, dtype=bool)
+    new_run[1:] = (sorted_rows[1:] != sorted_rows[:-1]) | (sorted_data[1:] != sorted_data[:-1])
+    run_starts = np.flatnonzero(new_run)
+    run_lengths = np.diff(np.append(run_starts, nnz))
+    run_ids = np.cumsum(new_run) - 1
+    # the average (0 based) position of each run within the non-zero entries of the row
+    run_pos = run_starts - block.indptr[sorted_rows[run_starts]] + (run_lengths - 1) / 2
+    entry_ranks = np.empty(nnz)
+    entry_ranks[order] = num_zeros[sorted_rows] + run_pos[run_ids] + 1
+    zero_ranks = (num_zeros + 1) / 2
+    ties = np.bincount(sorted_rows[run_starts], weights=run_lengths ** 3 - run_lengths, minlength=block.shape[0])
+    ties += num_zeros.astype(float) ** 3 - num_zeros
+    if num_samples > 1:
+        tie_correction = 1 - ties / (float(num_samples) ** 3 - num_samples)
+    else:
+        tie_correction = np.zeros(block.shape[0])
+    return entry_ranks, zero_ranks, tie_correction
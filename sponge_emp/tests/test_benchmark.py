@@ -0,0 +1,63 @@
+from unittest import main, TestCase
+from tempfile import TemporaryDirectory
+import os.path
+import json
+
+from click.testing import CliRunner
+
+from sponge_emp.benchmark import make_synthetic_data, run_benchmark, time_call
+from sponge_emp.cli import cli
+from sponge_emp.database import DBData
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = TemporaryDirectory()
+        self.biomfile = os.path.join(self.tmpdir.name, 'test.biom')
+        self.mapfile = os.path.join(self.tmpdir.name, 'test.map.txt')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    def test_make_synthetic_data(self):
+        seqs = make_synthetic_data(self.biomfile, self.mapfile, num_samples=30, num_features=200, num_fields=5, features_per_sample=20)
+        db = DBData(biomfile=self.biomfile, mapfile=self.mapfile)
+        db.import_data()
+        self.assertEqual(db.data.shape, (200, 30))
+        self.assertEqual(set(db.fids), set(seqs))
+        self.assertEqual(len(db.get_fields(exclude=['#SampleID'])), 5)
+        self.assertIn('host_scientific_name', db.get_fields())
+
+    def test_run_benchmark(self):
+        make_synthetic_data(self.biomfile, self.mapfile, num_samples=30, num_features=200, num_fields=5, features_per_sample=20)
+        res = run_benchmark(self.biomfile, self.mapfile, repeat=1, batch_size=5)
+        self.assertEqual(res['data']['samples'], 30)
+        self.assertEqual(res['data']['batch_size'], 5)
+        for cname in ['import_data', 'get_info', 'get_sequence_info', 'get_sequence_info_batch', 'get_annotation_string',
+                      'plot_pie_chart', 'endpoint_sequence_info', 'endpoint_sequences_info_batch', 'endpoint_search_results',
+                      'endpoint_search_results_batch']:
+            self.assertGreater(res['timings'][cname]['min'], 0)
+
+    def test_benchmark_command(self):
+        output = os.path.join(self.tmpdir.name, 'benchmark.json')
+        res = CliRunner().invoke(cli, ['benchmark', '--samples', '30', '--features', '1000', '--fields', '5', '--repeat', '1',
+                                       '--batch-size', '5', '--output', output])
+        self.assertEqual(res.exit_code, 0, res.output)
+        with open(output) as fl:
+            res = json.load(fl)
+        self.assertEqual(res['data']['samples'], 30)
+        self.assertEqual(res['data']['features'], 1000)
+        self.assertGreater(res['timings']['endpoint_sequence_info']['min'], 0)
+
+    def test_time_call(self):
+        calls = []
+        res = time_call(lambda: calls.append(1), repeat=3, setup=lambda: calls.append(0))
+        self.assertEqual(calls, [0, 1, 0, 1, 0, 1])
+        self.assertEqual(res['repeat'], 3)
+        self.assertLessEqual(res['min'], res['max'])
+
+
+if __name__ == '__main__':
+    main()
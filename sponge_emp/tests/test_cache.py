@@ -0,0 +1,40 @@
+from unittest import main, TestCase
+
+from sponge_emp.cache import LRUCache
+
+
+class LRUCacheTests(TestCase):
+    def test_get_put(self):
+        cache = LRUCache(max_items=2)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        # b is the least recently used
+        cache.put('c', 3)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.get('b', 'missing'), 'missing')
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get_stats(), {'hits': 2, 'misses': 2, 'evictions': 1, 'items': 2, 'bytes': 0})
+
+    def test_max_bytes(self):
+        cache = LRUCache(max_bytes=100)
+        cache.put('a', 1, nbytes=60)
+        cache.put('b', 2, nbytes=30)
+        cache.put('a', 3, nbytes=50)
+        self.assertEqual(cache.num_bytes, 80)
+        cache.put('c', 4, nbytes=40)
+        # b is evicted
+        self.assertCountEqual(cache._items.keys(), ['a', 'c'])
+        self.assertEqual(cache.num_bytes, 90)
+        # too big to cache
+        cache.put('d', 5, nbytes=200)
+        self.assertNotIn('d', cache)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.num_bytes, 0)
+
+
+if __name__ == '__main__':
+    main()
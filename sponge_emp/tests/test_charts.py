@@ -0,0 +1,47 @@
+from unittest import main, TestCase
+import base64
+
+from sponge_emp.charts import get_pie_chart_data, get_pie_chart, chart_cache
+
+
+class ChartsTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.info = {'total_samples': 100, 'total_observed': 20,
+                     'info': {'group': {'a': {'observed_samples': 15, 'total_samples': 30},
+                                        'b': {'observed_samples': 5, 'total_samples': 20}},
+                              'empty': {}}}
+
+    def test_get_pie_chart_data(self):
+        labels, x, title = get_pie_chart_data(self.info, 'group')
+        # the empty '~Other' slice is not labeled
+        self.assertListEqual(labels, ['', 'b', 'a'])
+        self.assertListEqual(x, [0, 0.25, 0.75])
+        self.assertEqual(title, 'Number of samples present')
+
+        labels, x, title = get_pie_chart_data(self.info, 'group', show_orig=True)
+        self.assertListEqual(labels, ['~Other', 'b', 'a'])
+        self.assertListEqual(x, [0.5, 0.2, 0.3])
+
+        labels, x, title = get_pie_chart_data(self.info, 'group', min_size=10)
+        self.assertListEqual(labels, ['~Other', 'a'])
+        self.assertListEqual(x, [0.25, 0.75])
+
+        labels, x, title = get_pie_chart_data(self.info, 'empty')
+        self.assertListEqual(x, [])
+
+    def test_get_pie_chart(self):
+        chart_cache.clear()
+        labels, x, title = get_pie_chart_data(self.info, 'group')
+        png = get_pie_chart(labels, x, title)
+        self.assertEqual(base64.b64decode(png)[:4], b'\x89PNG')
+        # same chart is drawn only once
+        self.assertIs(get_pie_chart(list(labels), list(x), title), png)
+        self.assertEqual(len(chart_cache), 1)
+        # a chart without observations
+        png = get_pie_chart(*get_pie_chart_data(self.info, 'empty'))
+        self.assertEqual(base64.b64decode(png)[:4], b'\x89PNG')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,13 @@
 from unittest import main, TestCase
+import os.path
+import json
+import shutil
+from tempfile import TemporaryDirectory
 
 import numpy as np
+import scipy.stats
+import scipy.spatial.distance
+import biom
 
 from sponge_emp.database import DBData
 from sponge_emp.utils import get_data_path
@@ -49,6 +56,16 @@ class DatabaseTests(TestCase):
 
         self.assertEqual(self.badseq, db.feature_metadata.index[db.get_seq_pos(self.badseq)])
         self.assertEqual(self.goodseq, db.feature_metadata.index[db.get_seq_pos(self.goodseq)])
+        self.assertIsNone(db.get_seq_pos('AAA'))
+
+    def test_lookup_many(self):
+        db = self.db
+        db.import_data()
+
+        rows = db.lookup_many([self.goodseq.lower() + 'AAA', 'AAA', self.badseq])
+        self.assertEqual(rows[0], db.get_seq_pos(self.goodseq))
+        self.assertEqual(rows[1], -1)
+        self.assertEqual(rows[2], db.get_seq_pos(self.badseq))
 
     def test_get_taxonomy(self):
         db = self.db
@@ -58,6 +75,16 @@ class DatabaseTests(TestCase):
         self.assertTrue('Capnocytophaga' in db.get_taxonomy(self.badseq))
         self.assertEqual(db.get_taxonomy('AAA'), 'na')
 
+    def test_search_sequence(self):
+        db = self.db
+        db.import_data()
+
+        self.assertEqual(db.search_sequence(self.goodseq), [(self.goodseq, 0)])
+        seq = self.goodseq[:10] + 'N' + self.goodseq[11:]
+        self.assertEqual(db.search_sequence(seq), [])
+        self.assertEqual(db.search_sequence(seq, max_mismatches=1), [(self.goodseq, 1)])
+        self.assertEqual(db.search_sequence(seq[:100].lower(), max_mismatches=1), [(self.goodseq, 1)])
+
     def test_get_total_observed(self):
         db = self.db
         db.import_data()
@@ -65,6 +92,18 @@ class DatabaseTests(TestCase):
         self.assertEqual(db.get_total_observed(self.goodseq), 9)
         self.assertEqual(db.get_total_observed(self.badseq), 10)
         self.assertEqual(db.get_total_observed(self.badseq, threshold=10 / 2500), 5)
+        self.assertEqual(db.get_total_observed([self.goodseq, self.badseq, 'AAA']), 19)
+
+    def test_get_total_observed_prevalence(self):
+        db = DBData(biomfile=get_data_path('test1.biom'), mapfile=get_data_path('test1.map.txt'), prevalence_thresholds=[0, 10 / 2500])
+        db.import_data()
+        # the precomputed counts are the same as the counts from the data
+        for cthreshold in [0, 10 / 2500]:
+            self.assertEqual(list(db._prevalence[cthreshold]), list(np.asarray((db.data > cthreshold).sum(axis=1)).ravel()))
+        self.assertEqual(db.get_total_observed(self.badseq, threshold=10 / 2500), 5)
+        # not precomputed threshold
+        self.assertNotIn(5 / 2500, db._prevalence)
+        self.assertEqual(db.get_total_observed(self.badseq, threshold=5 / 2500), (db.data[db.get_seq_pos(self.badseq), :] > 5 / 2500).sum())
 
     def test_get_value_samples(self):
         db = self.db
@@ -74,6 +113,9 @@ class DatabaseTests(TestCase):
         self.assertEqual(db.get_value_samples('group', '2'), 9)
         # a value that doesn't exists
         self.assertEqual(db.get_value_samples('group', '3'), 0)
+        # the counts of all values sum to the number of samples
+        self.assertEqual(sum(db.get_value_samples('group', cvalue) for cvalue in db.sample_metadata['group'].unique()), 20)
+        self.assertEqual(db.sample_metadata['group'].dtype.name, 'category')
 
     def test_get_info(self):
         db = self.db
@@ -89,11 +131,217 @@ class DatabaseTests(TestCase):
         self.assertEqual(info['1']['observed_samples'], 6)
         self.assertEqual(info['2']['total_samples'], 9)
         self.assertEqual(info['2']['observed_samples'], 4)
+        # the frequencies are split between the value samples and the rest
+        self.assertEqual(len(info['2'].val_samples), 9)
+        self.assertEqual(len(info['2'].not_val_samples), 11)
+        self.assertAlmostEqual(np.sum(info['2'].val_samples) + np.sum(info['2'].not_val_samples), np.sum(db.data[db.get_seq_pos(self.badseq), :]))
+        # the sample frequencies are created once (when first accessed), and are not part of the dict (or serialized)
+        self.assertIs(info['2'].val_samples, info['2'].val_samples)
+        self.assertIs(info['2'].not_val_samples, info['2'].not_val_samples)
+        self.assertNotIn('val_samples', info['2'])
+        self.assertCountEqual(info['2'].keys(), ['total_samples', 'observed_samples'])
+        self.assertEqual(json.loads(json.dumps(info))['2'], {'total_samples': 9, 'observed_samples': 4})
+        # the group statistics
+        self.assertEqual(info['2'].num_val_samples, 9)
+        allfreq = np.hstack([info['2'].val_samples, info['2'].not_val_samples])
+        self.assertEqual(info['2'].rank_sum, np.sum(scipy.stats.rankdata(allfreq)[:9]))
 
         # test threshold
         info = db.get_info(self.badseq, 'group', threshold=10 / 2500, mincounts=0)
         self.assertEqual(info['2']['total_samples'], 9)
         self.assertEqual(info['2']['observed_samples'], 3)
 
+    def test_get_info_fields(self):
+        db = self.db
+        db.import_data()
+
+        info = db.get_info_fields([self.goodseq, self.badseq], ['group', 'id'], mincounts=0)
+        self.assertCountEqual(info.keys(), ['group', 'id'])
+        self.assertEqual(info['group']['1']['total_samples'], 22)
+        self.assertEqual(info['group']['1']['observed_samples'], 6)
+        self.assertEqual(info['group']['2']['total_samples'], 18)
+        self.assertEqual(info['group']['2']['observed_samples'], 13)
+        # same as the per field results
+        for cfield in ['group', 'id']:
+            finfo = db.get_info([self.goodseq, self.badseq], cfield, mincounts=0)
+            self.assertEqual(list(finfo.keys()), list(info[cfield].keys()))
+
+    def test_get_enrichment(self):
+        db = self.db
+        db.import_data()
+        res = db.get_enrichment('group', '2')
+        self.assertEqual(res['group_size'], 9)
+        self.assertEqual(res['total_samples'], 20)
+        # goodseq is present in all 9 group samples and nowhere else (see test_get_info)
+        self.assertEqual(db.fids[res['rows'][0]], self.goodseq)
+        self.assertEqual(res['observed'][0], 9)
+        self.assertAlmostEqual(res['binomial_pval'][0], 0.000757, places=6)
+        self.assertAlmostEqual(res['ranksum_pval'][0], 0.000038, places=6)
+        self.assertTrue(np.all(res['observed'] > 0))
+        self.assertTrue(np.all(np.diff(res['binomial_pval']) >= 0))
+        # same as the statistics of each sequence
+        ranksum = scipy.stats.kruskal
+        for crow, cpval in zip(res['rows'], res['ranksum_pval']):
+            freq = db.data[crow].toarray().ravel()
+            group = db.sample_metadata['group'] == '2'
+            if np.mean(scipy.stats.rankdata(freq)[group]) > np.mean(scipy.stats.rankdata(freq)[~group]):
+                self.assertAlmostEqual(cpval, ranksum(freq[group], freq[~group])[1])
+            else:
+                self.assertEqual(cpval, 1)
+        self.assertIsNone(db.get_enrichment('group', 'nonexistent'))
+        self.assertIsNone(db.get_enrichment('nonexistent', '2'))
+
+    def test_get_similar_samples(self):
+        db = self.db
+        db.import_data()
+        # the community of a sample is most similar to itself
+        col = db.data[:, 3].tocoo()
+        sequences = [db.fids[crow] for crow in col.row]
+        res = db.get_similar_samples(sequences, counts=col.data * 100, top=5)
+        self.assertEqual(res['samples'][0], 3)
+        self.assertAlmostEqual(res['similarity'][0], 1)
+        self.assertEqual(res['shared_features'][0], len(sequences))
+        self.assertEqual(res['query_features'], len(sequences))
+        self.assertEqual(res['matched_features'], len(sequences))
+        self.assertTrue(np.all(np.diff(res['similarity']) <= 0))
+        # same as the bray-curtis dissimilarity of the frequencies
+        freqs = db.data.toarray()
+        query = freqs[:, 3]
+        for cpos, csim in zip(res['samples'], res['similarity']):
+            self.assertAlmostEqual(csim, 1 - scipy.spatial.distance.braycurtis(query, freqs[:, cpos]))
+
+        # unknown (and lower case) sequences
+        res = db.get_similar_samples([cseq.lower() for cseq in sequences] + ['A' * 150], metric='jaccard')
+        self.assertEqual(res['query_features'], len(sequences) + 1)
+        self.assertEqual(res['matched_features'], len(sequences))
+        # several test samples have the same features, so they are tied
+        self.assertIn(3, res['samples'][res['similarity'] == res['similarity'][0]])
+        self.assertAlmostEqual(res['similarity'][0], len(sequences) / (len(sequences) + 1))
+        with self.assertRaises(ValueError):
+            db.get_similar_samples(sequences, metric='euclidean')
+        with self.assertRaises(ValueError):
+            db.get_similar_samples(sequences, counts=[1])
+
+    def test_append(self):
+        full = self.db
+        full.import_data()
+        table = biom.load_table(get_data_path('test1.biom'))
+        with open(get_data_path('test1.map.txt')) as fl:
+            map_lines = fl.readlines()
+        with TemporaryDirectory() as tmpdir:
+            # split the samples to two tables (the second one with an additional field)
+            samples = [['S%d' % idx for idx in range(1, 11)], ['S%d' % idx for idx in range(11, 21)]]
+            for cpart, csamples in enumerate(samples):
+                ctable = table.filter(csamples, inplace=False)
+                ctable.remove_empty(axis='observation')
+                with open(os.path.join(tmpdir, 'part%d.biom' % cpart), 'w') as fl:
+                    ctable.to_json('test', fl)
+                with open(os.path.join(tmpdir, 'part%d.map.txt' % cpart), 'w') as fl:
+                    fl.write(map_lines[0].rstrip('\n') + '\tbatch\n' if cpart else map_lines[0])
+                    for cline in map_lines[1:]:
+                        if cline.split('\t')[0] in csamples:
+                            fl.write(cline.rstrip('\n') + '\tnew\n' if cpart else cline)
+            db = DBData(biomfile=os.path.join(tmpdir, 'part0.biom'), mapfile=os.path.join(tmpdir, 'part0.map.txt'))
+            db.import_data()
+            newdb = db.append(os.path.join(tmpdir, 'part1.biom'), os.path.join(tmpdir, 'part1.map.txt'))
+            with self.assertRaises(ValueError):
+                newdb.append(os.path.join(tmpdir, 'part1.biom'), os.path.join(tmpdir, 'part1.map.txt'))
+
+        # the current version is not changed
+        self.assertEqual(db.get_total_samples(), 10)
+        self.assertNotIn('batch', db.get_fields())
+        self.assertNotEqual(newdb.data_id, db.data_id)
+        self.assertEqual(newdb.get_total_samples(), 20)
+        self.assertEqual(list(newdb.sample_metadata.index), samples[0] + samples[1])
+        self.assertEqual(newdb.get_value_samples('batch', 'new'), 10)
+        self.assertEqual(newdb.get_value_samples('batch', 'na'), 10)
+        # same as loading all the samples
+        rows = newdb.lookup_many(full.fids)
+        found = rows >= 0
+        self.assertEqual(abs(newdb.data[rows[found], :] - full.data[np.flatnonzero(found), :]).max(), 0)
+        self.assertEqual(list(newdb._prevalence[0][rows[found]]), list(full._prevalence[0][found]))
+        for cfield in full.get_fields():
+            # the values can be read as numbers or as text (depending on the other samples in the mapping file)
+            self.assertEqual({str(cvalue): ccount for cvalue, ccount in newdb._field_value_counts[cfield].items()},
+                             {str(cvalue): ccount for cvalue, ccount in full._field_value_counts[cfield].items()})
+        for cseq in [self.goodseq, self.badseq]:
+            self.assertEqual(newdb.get_total_observed(cseq), full.get_total_observed(cseq))
+            self.assertEqual(newdb.get_taxonomy(cseq), full.get_taxonomy(cseq))
+            self.assertEqual(dict(newdb.get_info(cseq, 'group')), dict(full.get_info(cseq, 'group')))
+
+    def test_snapshot(self):
+        db = self.db
+        db.import_data()
+
+        with TemporaryDirectory() as tmpdir:
+            db.save_snapshot(tmpdir)
+            db2 = DBData()
+            db2.load_snapshot(tmpdir)
+
+            self.assertEqual(db2.seq_length, 150)
+            self.assertEqual(db2.data.shape, db.data.shape)
+            self.assertEqual((db2.data != db.data).nnz, 0)
+            self.assertCountEqual(db2.get_fields(), db.get_fields())
+            self.assertEqual(db2.get_taxonomy(self.goodseq), db.get_taxonomy(self.goodseq))
+            self.assertEqual(db2.get_value_samples('group', '2'), 9)
+            self.assertEqual(list(db2._prevalence[0]), list(db._prevalence[0]))
+            self.assertEqual(db2.get_total_observed(self.goodseq), 9)
+            info = db2.get_info(self.badseq, 'group')
+            self.assertEqual(info['1']['total_samples'], 11)
+            self.assertEqual(info['1']['observed_samples'], 6)
+            # the snapshot can be mapped again by other processes
+            self.assertIsNone(db.get_source())
+            self.assertEqual(db2.get_source(), {'snapshot': tmpdir})
+            del db2
+
+    def test_check_snapshot(self):
+        with TemporaryDirectory() as tmpdir:
+            biomfile = os.path.join(tmpdir, 'test1.biom')
+            mapfile = os.path.join(tmpdir, 'test1.map.txt')
+            shutil.copyfile(get_data_path('test1.biom'), biomfile)
+            shutil.copyfile(get_data_path('test1.map.txt'), mapfile)
+            snapshot_dir = os.path.join(tmpdir, 'snapshot')
+            db = DBData(biomfile=biomfile, mapfile=mapfile)
+            db.import_data()
+            db.save_snapshot(snapshot_dir)
+
+            db2 = DBData(biomfile=biomfile, mapfile=mapfile)
+            self.assertEqual(db2.check_snapshot(snapshot_dir), '')
+            # a snapshot of the snapshot (i.e. an appended snapshot) keeps the source files
+            db2.load_snapshot(snapshot_dir)
+            db2.save_snapshot(os.path.join(tmpdir, 'snapshot2'))
+            self.assertEqual(db2.check_snapshot(os.path.join(tmpdir, 'snapshot2')), '')
+            del db2
+            # not the files the snapshot was created from
+            db3 = DBData(biomfile=get_data_path('test1.biom'), mapfile=mapfile)
+            self.assertIn('changed', db3.check_snapshot(snapshot_dir))
+            # the mapping file changed
+            with open(mapfile, 'a') as fl:
+                fl.write('\n')
+            self.assertIn('test1.map.txt', DBData(biomfile=biomfile, mapfile=mapfile).check_snapshot(snapshot_dir))
+            # the biom table is missing
+            os.remove(biomfile)
+            self.assertNotEqual(DBData(biomfile=biomfile, mapfile=mapfile).check_snapshot(snapshot_dir), '')
+            # not a snapshot
+            self.assertNotEqual(DBData(biomfile=biomfile, mapfile=mapfile).check_snapshot(tmpdir), '')
+
+    def test_share(self):
+        db = self.db
+        db.import_data()
+        data = db.data.copy()
+
+        db.share()
+        # the arrays are now read only memory mapped views
+        self.assertFalse(db.data.data.flags.writeable)
+        self.assertFalse(db._field_codes['group'].flags.writeable)
+        self.assertEqual((db.data != data).nnz, 0)
+        self.assertEqual(db.get_total_observed(self.goodseq), 9)
+        info = db.get_info(self.badseq, 'group')
+        self.assertEqual(info['2']['total_samples'], 9)
+        self.assertEqual(info['2']['observed_samples'], 4)
+        # the shared snapshot files are removed
+        self.assertIsNone(db.get_source())
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,157 @@
+from unittest import main, TestCase
+from tempfile import TemporaryDirectory
+import os.path
+import json
+import io
+
+from sponge_emp.app import create_app
+from sponge_emp.benchmark import make_synthetic_data
+from sponge_emp.database import DBData
+from sponge_emp.datasets import DatasetManager
+from sponge_emp.Site_Main_Flask import _job_queues, _shutdown_job_queue
+from sponge_emp.utils import get_data_path
+
+
+class DatasetManagerTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.loaded = []
+        self.tmpdir = TemporaryDirectory()
+        self.goodseq = 'TACGTAGGGTGCAAGCGTTAATCGGAATTACTGGGCGTAAAGCGTGCGCAGGCGGTTATGTAAGACAGTTGTGAAATCCCCGGGCTCAACCTGGGAACTGCATCTGTGACTGCATAGCTAGAGTACGGTAGAGGGGGATGGAATTCCGCG'
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    def get_loader(self, name):
+        def load_test_db():
+            self.loaded.append(name)
+            db = DBData(biomfile=get_data_path('test1.biom'), mapfile=get_data_path('test1.map.txt'))
+            db.import_data()
+            return db
+        return load_test_db
+
+    def test_lazy_load(self):
+        datasets = DatasetManager()
+        datasets.add('a', self.get_loader('a'))
+        datasets.add('b', self.get_loader('b'))
+        self.assertEqual(datasets.names(), ['a', 'b'])
+        self.assertEqual(datasets.default, 'a')
+        self.assertEqual(self.loaded, [])
+        db = datasets.get()
+        self.assertEqual(self.loaded, ['a'])
+        self.assertIs(datasets.get('a'), db)
+        self.assertEqual(self.loaded, ['a'])
+        self.assertIsNot(datasets.get('b'), db)
+        self.assertEqual(self.loaded, ['a', 'b'])
+        info = {cinfo['name']: cinfo for cinfo in datasets.get_info()}
+        self.assertTrue(info['a']['default'])
+        self.assertTrue(info['b']['loaded'])
+        self.assertGreater(info['b']['memory_bytes'], 0)
+        with self.assertRaises(KeyError):
+            datasets.get('c')
+
+    def test_evict(self):
+        # only one dataset fits
+        datasets = DatasetManager(max_bytes=1)
+        datasets.add('a', self.get_loader('a'), pinned=True)
+        datasets.add('b', self.get_loader('b'))
+        datasets.add('c', self.get_loader('c'))
+        datasets.get('b')
+        datasets.get('c')
+        # the least recently used dataset is evicted, but not the pinned one
+        datasets.get('a')
+        loaded = {cinfo['name'] for cinfo in datasets.get_info() if cinfo['loaded']}
+        self.assertEqual(loaded, {'a'})
+        datasets.get('b')
+        self.assertEqual(self.loaded, ['b', 'c', 'a', 'b'])
+        loaded = {cinfo['name'] for cinfo in datasets.get_info() if cinfo['loaded']}
+        self.assertEqual(loaded, {'a', 'b'})
+
+    def test_dataset_requests(self):
+        datasets = DatasetManager()
+        datasets.add('a', self.get_loader('a'))
+        datasets.add('b', self.get_loader('b'))
+        logfile = os.path.join(self.tmpdir.name, 'sequence_info.log')
+        app = create_app(config={'SEQUENCE_INFO_LOG': logfile}, datasets=datasets)
+        client = app.test_client()
+
+        res = client.get('/sequence/info', data=json.dumps({'sequence': self.goodseq}), content_type='application/json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data.decode())['total_observed'], 9)
+        self.assertEqual(self.loaded, ['a'])
+        # the url prefix
+        res = client.get('/datasets/b/sequence/info', data=json.dumps({'sequence': self.goodseq}), content_type='application/json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.loaded, ['a', 'b'])
+        # the json parameter
+        datasets.evict('b')
+        res = client.get('/sequence/info', data=json.dumps({'sequence': self.goodseq, 'dataset': 'b'}), content_type='application/json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(self.loaded, ['a', 'b', 'b'])
+        # web pages and static files
+        self.assertEqual(client.get('/datasets/b/main').status_code, 200)
+        self.assertEqual(client.get('/datasets/b/static/SpongeEMP.png').status_code, 200)
+        # unknown dataset
+        res = client.get('/datasets/c/sequence/info', data=json.dumps({'sequence': self.goodseq}), content_type='application/json')
+        self.assertEqual(res.status_code, 404)
+
+        res = json.loads(client.get('/datasets').data.decode())
+        self.assertEqual([cinfo['name'] for cinfo in res['datasets']], ['a', 'b'])
+
+        # the requests are logged to the app log file
+        app.extensions['sequence_info_log'].close()
+        with open(logfile) as fl:
+            self.assertEqual(len(fl.readlines()), 3)
+
+    def test_dataset_job_redirect(self):
+        # the annotations page needs the SpongeEMP fields
+        biomfile = os.path.join(self.tmpdir.name, 'b.biom')
+        mapfile = os.path.join(self.tmpdir.name, 'b.map.txt')
+        seqs = make_synthetic_data(biomfile, mapfile, num_samples=30, num_features=200, num_fields=5, features_per_sample=20)
+
+        def load_b():
+            self.loaded.append('b')
+            db = DBData(biomfile=biomfile, mapfile=mapfile)
+            db.import_data()
+            return db
+
+        datasets = DatasetManager()
+        datasets.add('a', self.get_loader('a'))
+        datasets.add('b', load_b)
+        app = create_app(config={'SEQUENCE_INFO_LOG': None, 'JOB_STORE': os.path.join(self.tmpdir.name, 'jobs.sqlite'), 'JOB_WORKERS': 1},
+                         datasets=datasets)
+        client = app.test_client()
+
+        fasta = io.BytesIO(''.join('>s%d\n%s\n' % (cpos, cseq) for cpos, cseq in enumerate(seqs[:5])).encode())
+        res = client.post('/datasets/b/search_results', data={'sequence': '', 'job': 'on', 'fasta file': (fasta, 'seqs.fa')})
+        self.assertEqual(res.status_code, 302)
+        # the job page stays in the dataset
+        job_url = res.headers['Location']
+        self.assertRegex(job_url, r'/datasets/b/job_results\?job_id=[0-9a-f]+$')
+        res = client.get(job_url)
+        self.assertEqual(res.status_code, 200)
+        page = res.data.decode()
+        self.assertIn('/datasets/b/static/SpongeEMP.png', page)
+        self.assertIn('/datasets/b/main', page)
+        self.assertEqual(client.get('/datasets/b/static/SpongeEMP.png').status_code, 200)
+        self.assertEqual(self.loaded, ['b'])
+        # the job used the dataset database (through a temporary snapshot, since it is only in memory)
+        queue, data_id, tmpdir = _job_queues.pop('b')
+        self.assertEqual(data_id, datasets.get('b').data_id)
+        self.assertTrue(os.path.exists(os.path.join(tmpdir, 'snapshot.json')))
+        _shutdown_job_queue(queue, tmpdir)
+        self.assertFalse(os.path.exists(tmpdir))
+        res = client.get(job_url)
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('<h1>Job', res.data.decode())
+
+        # the urls of the default dataset are not changed
+        res = client.get('/main')
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('/datasets/', res.data.decode())
+        self.assertEqual(self.loaded, ['b', 'a'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+from unittest import main, TestCase
+from tempfile import TemporaryDirectory
+import os.path
+
+from sponge_emp.jobs import JobStore, JobQueue
+
+
+_prefix = None
+
+
+def _init_worker(prefix):
+    global _prefix
+
+    _prefix = prefix
+
+
+def _job(value):
+    if value == 'bad':
+        return 'bad value', None
+    if value == 'raise':
+        raise ValueError('raised')
+    return '', _prefix + value
+
+
+class JobsTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = TemporaryDirectory()
+        self.store_file = os.path.join(self.tmpdir.name, 'jobs.sqlite')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    def test_job_store(self):
+        store = JobStore(self.store_file)
+        job_id = store.create()
+        self.assertEqual(store.get(job_id)['status'], 'queued')
+        store.set_status(job_id, 'done', result='res')
+        # persistent between store objects
+        job = JobStore(self.store_file).get(job_id)
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['result'], 'res')
+        self.assertIsNotNone(job['finished'])
+        self.assertIsNone(store.get('nonexistent'))
+        store.remove_old(-1)
+        self.assertIsNone(store.get(job_id))
+
+    def test_job_queue(self):
+        queue = JobQueue(self.store_file, max_workers=1, initializer=_init_worker, initargs=('pita',))
+        ids = [queue.submit(_job, cvalue) for cvalue in ['ok', 'bad', 'raise']]
+        queue.shutdown(wait=True)
+        jobs = [queue.get(cid) for cid in ids]
+        self.assertEqual(jobs[0]['status'], 'done')
+        self.assertEqual(jobs[0]['result'], 'pitaok')
+        self.assertEqual(jobs[1]['status'], 'failed')
+        self.assertEqual(jobs[1]['error'], 'bad value')
+        self.assertEqual(jobs[2]['status'], 'failed')
+        self.assertIn('raised', jobs[2]['error'])
+
+
+if __name__ == '__main__':
+    main()
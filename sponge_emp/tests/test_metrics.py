@@ -0,0 +1,63 @@
+from unittest import main, TestCase
+
+from flask import Flask
+
+from sponge_emp import metrics
+from sponge_emp.metrics import timed
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.stats.clear()
+
+    def tearDown(self):
+        metrics.set_enabled(True)
+        super().tearDown()
+
+    def test_timed_outside_request(self):
+        with timed('stage1'):
+            pass
+        with timed('stage1'):
+            pass
+        hist = metrics.stats.histograms[('none', 'stage1')]
+        self.assertEqual(hist.count, 2)
+        self.assertEqual(sum(hist.counts), 2)
+
+    def test_timed_disabled(self):
+        metrics.set_enabled(False)
+        with timed('stage1'):
+            pass
+        self.assertEqual(metrics.stats.histograms, {})
+
+    def test_request_timing(self):
+        app = Flask('sponge_emp')
+        app.before_request(metrics.start_request)
+        app.after_request(metrics.finish_request)
+
+        @app.route('/test')
+        def test_page():
+            with timed('stage1'):
+                pass
+            return 'ok'
+
+        client = app.test_client()
+        res = client.get('/test')
+        self.assertNotIn('X-Timing', res.headers)
+        res = client.get('/test?profile=1')
+        self.assertRegex(res.headers['X-Timing'], r'^stage1=[0-9.]+ms, total=[0-9.]+ms$')
+        self.assertEqual(metrics.stats.requests[('test_page', 200)], 2)
+        text = metrics.stats.get_prometheus_text()
+        self.assertIn('spongeemp_stage_seconds_bucket{endpoint="test_page",stage="stage1",le="+Inf"} 2\n', text)
+        self.assertIn('spongeemp_stage_seconds_count{endpoint="test_page",stage="total"} 2\n', text)
+        self.assertIn('spongeemp_requests_total{endpoint="test_page",status="200"} 2\n', text)
+
+    def test_get_cache_metrics_text(self):
+        text = metrics.get_cache_metrics_text({'c1': {'hits': 1, 'misses': 2, 'evictions': 3, 'items': 4, 'bytes': 5}})
+        self.assertIn('spongeemp_cache_hits_total{cache="c1"} 1\n', text)
+        self.assertIn('spongeemp_cache_bytes{cache="c1"} 5\n', text)
+        self.assertIn('# TYPE spongeemp_cache_items gauge\n', text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+from unittest import main, TestCase
+import json
+import threading
+
+from sponge_emp.app import create_app
+from sponge_emp.database import DBData
+from sponge_emp.registry import DBRegistry
+from sponge_emp.utils import get_data_path
+
+
+def load_test_db():
+    db = DBData(biomfile=get_data_path('test1.biom'), mapfile=get_data_path('test1.map.txt'))
+    db.import_data()
+    return db
+
+
+class DBRegistryTests(TestCase):
+    def test_reload(self):
+        warmed = []
+        registry = DBRegistry(load_test_db, warmup=warmed.append)
+        self.assertIsNone(registry.get())
+        self.assertTrue(registry.reload(wait=True))
+        db = registry.get()
+        self.assertEqual(warmed, [db])
+        self.assertEqual(registry.status['state'], 'ready')
+        self.assertEqual(registry.status['version'], 1)
+        self.assertEqual(registry.status['data_id'], db.data_id)
+
+        # the current version is served until the new version is loaded
+        loading = threading.Event()
+        release = threading.Event()
+
+        def slow_loader():
+            loading.set()
+            release.wait(10)
+            return load_test_db()
+
+        self.assertTrue(registry.reload(loader=slow_loader))
+        loading.wait(10)
+        self.assertTrue(registry.is_loading())
+        self.assertEqual(registry.status['state'], 'loading')
+        self.assertIs(registry.get(), db)
+        # only one load at a time
+        self.assertFalse(registry.reload())
+        release.set()
+        registry._thread.join()
+        self.assertIsNot(registry.get(), db)
+        self.assertEqual(registry.get().get_total_samples(), 20)
+        self.assertEqual(registry.status['version'], 2)
+
+    def test_reload_failed(self):
+        registry = DBRegistry(load_test_db)
+        registry.reload(wait=True)
+        db = registry.get()
+
+        def bad_loader():
+            raise ValueError('bad table')
+
+        with self.assertRaises(ValueError):
+            registry.reload(loader=bad_loader, wait=True)
+        # the current version is kept
+        self.assertIs(registry.get(), db)
+        self.assertEqual(registry.status['state'], 'ready')
+        self.assertEqual(registry.status['error'], 'bad table')
+        self.assertEqual(registry.status['version'], 1)
+
+    def test_admin_requests(self):
+        registry = DBRegistry(load_test_db)
+        registry.reload(wait=True)
+        db = registry.get()
+        app = create_app(config={'ADMIN_TOKEN': 'secret', 'SEQUENCE_INFO_LOG': None}, registry=registry)
+        client = app.test_client()
+
+        res = client.post('/admin/reload', data=json.dumps({'wait': True}), content_type='application/json')
+        self.assertEqual(res.status_code, 403)
+        res = client.post('/admin/reload', data=json.dumps({'wait': True}), content_type='application/json',
+                          headers={'X-Admin-Token': 'wrong'})
+        self.assertEqual(res.status_code, 403)
+        res = client.post('/admin/reload', data=json.dumps({'wait': True}), content_type='application/json',
+                          headers={'X-Admin-Token': 'secret'})
+        self.assertEqual(res.status_code, 200)
+        self.assertIsNot(registry.get(), db)
+        self.assertEqual(json.loads(res.data.decode())['data_id'], registry.get().data_id)
+        res = client.get('/admin/status', headers={'X-Admin-Token': 'secret'})
+        self.assertEqual(json.loads(res.data.decode())['version'], 2)
+
+        # disabled without an admin token
+        app = create_app(config={'SEQUENCE_INFO_LOG': None}, registry=registry)
+        res = app.test_client().get('/admin/status', headers={'X-Admin-Token': ''})
+        self.assertEqual(res.status_code, 403)
+
+
+if __name__ == '__main__':
+    main()
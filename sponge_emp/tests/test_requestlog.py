@@ -0,0 +1,69 @@
+from unittest import main, TestCase
+from tempfile import TemporaryDirectory
+import os
+import os.path
+import json
+import time
+
+from sponge_emp.requestlog import RequestLog
+
+
+class RequestLogTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, 'requests.log')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    def test_log(self):
+        log = RequestLog(self.filename, flush_interval=0.01)
+        for idx in range(10):
+            log.log(ip='1.2.3.4', num_sequences=idx)
+        log.close()
+        with open(self.filename) as fl:
+            records = [json.loads(cline) for cline in fl]
+        self.assertEqual([crec['num_sequences'] for crec in records], list(range(10)))
+        self.assertEqual(records[0]['ip'], '1.2.3.4')
+        self.assertEqual(records[0]['pid'], os.getpid())
+        self.assertIn('time', records[0])
+        # log is restarted after close
+        log.log(ip='1.2.3.5')
+        log.close()
+        with open(self.filename) as fl:
+            self.assertEqual(len(fl.readlines()), 11)
+
+    def test_log_full_queue(self):
+        log = RequestLog(self.filename, max_queue=1, flush_interval=0.01)
+        for idx in range(1000):
+            log.log(num_sequences=idx)
+        log.close()
+        with open(self.filename) as fl:
+            num_records = len(fl.readlines())
+        self.assertEqual(num_records + log.dropped, 1000)
+
+    def test_rotate(self):
+        log = RequestLog(self.filename, flush_interval=0.01, max_bytes=10)
+        log.log(num_sequences=1)
+        log.close()
+        log.log(num_sequences=2)
+        log.close()
+        day = time.strftime('%Y-%m-%d')
+        with open(self.filename + '.' + day) as fl:
+            self.assertEqual(json.loads(fl.read())['num_sequences'], 1)
+        with open(self.filename) as fl:
+            self.assertEqual(json.loads(fl.read())['num_sequences'], 2)
+        # rotate by day
+        log = RequestLog(self.filename + '.daily', flush_interval=0.01)
+        log.log(num_sequences=3)
+        log.close()
+        os.utime(self.filename + '.daily', (0, 0))
+        log.log(num_sequences=4)
+        log.close()
+        self.assertEqual(len(os.listdir(self.tmpdir.name)), 4)
+
+
+if __name__ == '__main__':
+    main()
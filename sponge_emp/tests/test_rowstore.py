@@ -0,0 +1,78 @@
+from unittest import main, TestCase
+from tempfile import TemporaryDirectory
+import os.path
+
+import numpy as np
+import biom
+import h5py
+
+from sponge_emp.rowstore import HDF5RowStore
+from sponge_emp.database import DBData
+from sponge_emp.utils import get_data_path
+
+
+class HDF5RowStoreTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = TemporaryDirectory()
+        # the test table is in json format, so save it as hdf5
+        self.biomfile = os.path.join(self.tmpdir.name, 'test1.hdf5.biom')
+        table = biom.load_table(get_data_path('test1.biom'))
+        with h5py.File(self.biomfile, 'w') as fl:
+            table.to_hdf5(fl, 'test')
+        self.table = table.norm(axis='sample', inplace=False)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+        super().tearDown()
+
+    def test_get_rows(self):
+        rows = HDF5RowStore(self.biomfile)
+        self.assertEqual(list(rows.fids), list(self.table.ids(axis='observation')))
+        self.assertEqual(rows.shape, self.table.shape)
+        expected = self.table.matrix_data.tocsr()
+        for crows in [[0], [3, 1, 3], list(range(rows.shape[0])), []]:
+            self.assertEqual(abs(rows[crows, :] - expected[crows, :]).max() if crows else rows[crows, :].shape[0], 0)
+        with self.assertRaises(IndexError):
+            rows[[0], 1:3]
+
+    def test_select_samples(self):
+        rows = HDF5RowStore(self.biomfile)
+        rows.select_samples([1, 4, 5])
+        expected = self.table.matrix_data.tocsr()[:, [1, 4, 5]]
+        self.assertEqual(abs(rows[np.arange(rows.shape[0]), :] - expected).max(), 0)
+
+    def test_iter_row_blocks(self):
+        rows = HDF5RowStore(self.biomfile, chunk_size=5)
+        rows.select_samples([0, 2, 3, 7])
+        expected = self.table.matrix_data.tocsr()[:, [0, 2, 3, 7]]
+        blocks = list(rows.iter_row_blocks())
+        self.assertGreater(len(blocks), 1)
+        self.assertEqual(sum(cblock.shape[0] for cblock in blocks), rows.shape[0])
+        self.assertEqual(list(rows.count_present()), list(np.asarray((expected > 0).sum(axis=1)).ravel()))
+        rows.save_csr(self.tmpdir.name)
+        indptr = np.load(os.path.join(self.tmpdir.name, 'indptr.npy'))
+        self.assertEqual(list(indptr), list(expected.indptr))
+        self.assertEqual(list(np.load(os.path.join(self.tmpdir.name, 'data.npy'))), list(expected.data))
+
+    def test_out_of_core_database(self):
+        db = DBData(biomfile=get_data_path('test1.biom'), mapfile=get_data_path('test1.map.txt'))
+        db.import_data()
+        db2 = DBData(biomfile=self.biomfile, mapfile=get_data_path('test1.map.txt'), out_of_core=True)
+        db2.import_data()
+        self.assertEqual(db2.data.shape, db.data.shape)
+        for cseq in db.fids:
+            self.assertEqual(db2.get_total_observed(cseq), db.get_total_observed(cseq))
+            self.assertEqual(db2.get_total_observed(cseq, threshold=0.001), db.get_total_observed(cseq, threshold=0.001))
+            self.assertEqual(db2.get_info(cseq, 'group'), db.get_info(cseq, 'group'))
+        # the hdf5 biom format stores the taxonomy as a list
+        self.assertEqual('; '.join(db2.get_taxonomy(db.fids[0])), db.get_taxonomy(db.fids[0]))
+        # another process opens the same table
+        db3 = DBData(**db2.get_source())
+        db3.import_data()
+        self.assertTrue(db3.out_of_core)
+        self.assertEqual(db3.get_total_observed(db.fids[0]), db2.get_total_observed(db.fids[0]))
+
+
+if __name__ == '__main__':
+    main()
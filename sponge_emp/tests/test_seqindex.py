@@ -0,0 +1,82 @@
+from unittest import main, TestCase
+
+import numpy as np
+
+from sponge_emp.seqindex import SequenceIndex, pack_sequences
+
+
+class SequenceIndexTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.index = SequenceIndex(['AAAA', 'CCCC', 'GGGT'])
+
+    def test_lookup(self):
+        self.assertEqual(self.index.lookup('CCCC'), 1)
+        # trimmed and upper cased
+        self.assertEqual(self.index.lookup('gggtaa'), 2)
+        # too short
+        self.assertEqual(self.index.lookup('AAA'), -1)
+        # not found
+        self.assertEqual(self.index.lookup('TTTT'), -1)
+        self.assertTrue('aaaat' in self.index)
+        self.assertFalse('AAAC' in self.index)
+
+    def test_lookup_many(self):
+        rows = self.index.lookup_many(['AAAAC', 'TTTT', 'cccc', 'G'])
+        self.assertEqual(rows.dtype, np.int64)
+        self.assertListEqual(list(rows), [0, -1, 1, -1])
+        self.assertEqual(len(self.index.lookup_many([])), 0)
+
+    def test_normalize(self):
+        self.assertEqual(self.index.normalize('acgtac'), 'ACGT')
+        self.assertIsNone(self.index.normalize('ACG'))
+
+    def test_pack_sequences(self):
+        packed = pack_sequences(['ACGTT', 'tgca'], 5)
+        self.assertEqual(packed.shape, (2, 2))
+        self.assertListEqual(list(packed[0]), [0b00011011, 0b11000000])
+        self.assertListEqual(list(packed[1]), [0b11100100, 0])
+
+    def test_search(self):
+        seqs = ['ACGT' * 30, 'ACGA' * 30, 'TTTT' * 30]
+        index = SequenceIndex(seqs)
+        index.min_search_length = 10
+        # exact
+        rows, mismatches = index.search(seqs[0])
+        self.assertListEqual(list(rows), [0])
+        self.assertListEqual(list(mismatches), [0])
+        # one mismatch
+        query = 'C' + seqs[0][1:]
+        self.assertListEqual(list(index.search(query)[0]), [])
+        rows, mismatches = index.search(query, max_mismatches=1)
+        self.assertListEqual(list(rows), [0])
+        self.assertListEqual(list(mismatches), [1])
+        # shorter query (not a multiple of 4) compared to the prefix
+        rows, mismatches = index.search('ACGTACGAACG', max_mismatches=1)
+        self.assertListEqual(list(rows), [0, 1])
+        self.assertListEqual(list(mismatches), [1, 1])
+        # non ACGT characters are mismatches
+        rows, mismatches = index.search('N' + seqs[2][1:], min_identity=0.99)
+        self.assertListEqual(list(rows), [2])
+        self.assertListEqual(list(mismatches), [1])
+        # too short
+        self.assertEqual(len(index.search('ACGT', max_mismatches=3)[0]), 0)
+
+    def test_extend(self):
+        seqs = ['ACGT' * 30, 'ACGA' * 30]
+        index = SequenceIndex(seqs)
+        index.min_search_length = 10
+        index.search(seqs[0])
+        newindex = index.extend(['TTTT' * 30])
+        # the original index is not changed
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.lookup('TTTT' * 30), -1)
+        self.assertEqual(len(newindex), 3)
+        self.assertEqual(newindex.lookup('TTTT' * 30), 2)
+        self.assertEqual(newindex.lookup('ACGT' * 30), 0)
+        rows, mismatches = newindex.search('TTTA' + 'TTTT' * 29, max_mismatches=1)
+        self.assertListEqual(list(rows), [2])
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,10 @@
 from unittest import main, TestCase
+import json
 
+from sponge_emp.app import create_app
 from sponge_emp.database import DBData
-from sponge_emp.sponge_emp import get_sequence_info
+from sponge_emp.sponge_emp import get_sequence_info, get_sequence_info_batch, get_sequence_info_cached, sequence_info_cache
+from sponge_emp.sponge_emp import get_enriched_sequences, precompute_enrichment, enrichment_cache, get_similar_samples
 from sponge_emp.utils import get_data_path
 
 
@@ -61,6 +64,200 @@ class SpongeEMPTests(TestCase):
         self.assertEqual(info['group']['2']['total_samples'], 18)
         self.assertEqual(info['group']['2']['observed_samples'], 13)
 
+    def test_get_sequence_info_approximate(self):
+        db = self.db
+        # a sequencing error in the first nucleotide
+        seq = 'A' + self.goodseq[1:]
+        err, res = get_sequence_info(db, seq)
+        self.assertEqual(res['total_observed'], 0)
+        self.assertNotIn('matched_sequences', res)
+
+        err, res = get_sequence_info(db, seq, max_mismatches=1)
+        self.assertEqual(err, '')
+        self.assertEqual(res['total_observed'], 9)
+        self.assertEqual(res['info']['group']['2']['observed_samples'], 9)
+        self.assertEqual(res['matched_sequences'], {seq: [{'sequence': self.goodseq, 'mismatches': 1}]})
+
+        # shorter sequence
+        err, res = get_sequence_info(db, seq[:120], min_identity=0.99)
+        self.assertEqual(res['total_observed'], 9)
+        self.assertEqual(res['total_samples'], 20)
+
+        # not found
+        err, res = get_sequence_info(db, 'A' * 150, max_mismatches=2)
+        self.assertEqual(res['total_observed'], 0)
+        self.assertEqual(res['matched_sequences'], {'A' * 150: []})
+
+        # too short
+        err, res = get_sequence_info(db, seq[:50], max_mismatches=2)
+        self.assertTrue(err)
+
+        # bad parameters
+        err, res = get_sequence_info(db, seq, max_mismatches=-1)
+        self.assertEqual(err, 'max_mismatches must be >= 0')
+        err, res = get_sequence_info(db, seq, min_identity=1.5)
+        self.assertEqual(err, 'min_identity must be between 0 and 1')
+
+    def test_sequence_info_parameters(self):
+        app = create_app(lambda: self.db, config={'SEQUENCE_INFO_LOG': None})
+        client = app.test_client()
+        seq = 'A' + self.goodseq[1:]
+        res = client.get('/sequence/info', data=json.dumps({'sequence': seq, 'max_mismatches': '1'}), content_type='application/json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data.decode())['total_observed'], 9)
+        for cparams in [{'max_mismatches': 'two'}, {'max_mismatches': [1]}, {'max_mismatches': -1},
+                        {'min_identity': 'high'}, {'min_identity': 2}]:
+            res = client.get('/sequence/info', data=json.dumps(dict(cparams, sequence=seq)), content_type='application/json')
+            self.assertEqual(res.status_code, 400, cparams)
+        res = client.get('/sequence/info', data=json.dumps({'sequence': seq, 'threshold': [1]}), content_type='application/json')
+        self.assertEqual(res.status_code, 400)
+        self.assertIn(b'threshold must be a number', res.data)
+
+    def test_get_sequence_info_batch(self):
+        db = self.db
+        err, res = get_sequence_info_batch(db, [self.goodseq, 'AAA', self.badseq, 'A' * 150])
+        self.assertEqual(err, '')
+        self.assertEqual(len(res), 4)
+        self.assertEqual([cres['sequence'] for cres in res], [self.goodseq, 'AAA', self.badseq, 'A' * 150])
+        self.assertIn('error', res[1])
+        self.assertEqual(res[3]['total_observed'], 0)
+        self.assertEqual(res[3]['info'], {})
+        # each sequence gives the same results as a single sequence query
+        for cres, cseq in zip([res[0], res[2]], [self.goodseq, self.badseq]):
+            err, single = get_sequence_info(db, cseq)
+            self.assertEqual(cres['total_samples'], single['total_samples'])
+            self.assertEqual(cres['total_observed'], single['total_observed'])
+            self.assertCountEqual(cres['info'].keys(), single['info'].keys())
+            for cfield, cfinfo in single['info'].items():
+                self.assertCountEqual(cres['info'][cfield].keys(), cfinfo.keys())
+                for cval, cdist in cfinfo.items():
+                    self.assertEqual(cres['info'][cfield][cval]['total_samples'], cdist['total_samples'])
+                    self.assertEqual(cres['info'][cfield][cval]['observed_samples'], cdist['observed_samples'])
+
+        err, res = get_sequence_info_batch(db, [self.badseq], fields=['group'], threshold=10 / 2500, mincounts=0)
+        self.assertEqual(list(res[0]['info'].keys()), ['group'])
+        self.assertEqual(res[0]['info']['group']['2']['observed_samples'], 3)
+
+        # bad parameters
+        err, res = get_sequence_info_batch(db, [self.goodseq], threshold='x')
+        self.assertEqual(err, 'threshold must be a number')
+        err, res = get_sequence_info_batch(db, [self.goodseq], fields='group')
+        self.assertEqual(err, 'fields must be a list of field names')
+        err, res = get_sequence_info_batch(db, [self.goodseq, 1])
+        self.assertEqual(err, 'sequences must be a list of sequences')
+        app = create_app(lambda: db, config={'SEQUENCE_INFO_LOG': None})
+        res = app.test_client().get('/sequences/info_batch', data=json.dumps({'sequences': [self.goodseq], 'threshold': 'x'}),
+                                    content_type='application/json')
+        self.assertEqual(res.status_code, 400)
+
+    def test_get_sequence_info_cached(self):
+        db = self.db
+        sequence_info_cache.clear()
+        stats = sequence_info_cache.get_stats()
+
+        err, res = get_sequence_info_cached(db, [self.goodseq, self.badseq])
+        self.assertEqual(err, '')
+        self.assertEqual(res['total_observed'], 19)
+        # same sequences (normalized) are taken from the cache
+        err, res2 = get_sequence_info_cached(db, [self.badseq.lower(), self.goodseq + 'AAA'])
+        self.assertIs(res['info'], res2['info'])
+        # the callers get a copy of the cached result
+        self.assertIsNot(res, res2)
+        res2['total_observed'] = 0
+        err, res2 = get_sequence_info_cached(db, [self.goodseq, self.badseq])
+        self.assertEqual(res2['total_observed'], 19)
+        # different parameters are not
+        err, res3 = get_sequence_info_cached(db, [self.goodseq, self.badseq], threshold=10 / 2500)
+        self.assertIsNot(res, res3)
+        # errors are not cached
+        err, res4 = get_sequence_info_cached(db, 'AAA')
+        self.assertTrue(err)
+        self.assertEqual(len(sequence_info_cache), 2)
+        # a new database version is not taken from the cache
+        db.data_id = 'new'
+        err, res5 = get_sequence_info_cached(db, [self.goodseq, self.badseq])
+        self.assertIsNot(res, res5)
+        newstats = sequence_info_cache.get_stats()
+        self.assertEqual(newstats['hits'] - stats['hits'], 2)
+        self.assertEqual(newstats['misses'] - stats['misses'], 4)
+        # the matched sequences are keyed by the sequences of each caller
+        seq = 'A' + self.goodseq[1:]
+        err, res7 = get_sequence_info_cached(db, seq, max_mismatches=1)
+        err, res8 = get_sequence_info_cached(db, seq.lower() + 'AAA', max_mismatches=1)
+        self.assertIs(res7['info'], res8['info'])
+        self.assertEqual(res7['matched_sequences'], {seq: [{'sequence': self.goodseq, 'mismatches': 1}]})
+        self.assertEqual(res8['matched_sequences'], {seq.lower() + 'AAA': [{'sequence': self.goodseq, 'mismatches': 1}]})
+        # the parameters are normalized before building the cache key
+        err, res6 = get_sequence_info_cached(db, [self.goodseq, self.badseq], threshold='0', fields=list(res5['info']))
+        self.assertEqual(err, '')
+        self.assertEqual(res6['total_observed'], 19)
+        err, res = get_sequence_info_cached(db, self.goodseq, threshold=[1])
+        self.assertEqual(err, 'threshold must be a number')
+        err, res = get_sequence_info_cached(db, self.goodseq, fields='group')
+        self.assertEqual(err, 'fields must be a list of field names')
+        err, res = get_sequence_info_cached(db, self.goodseq, fields=[['group']])
+        self.assertTrue(err)
+
+    def test_get_enriched_sequences(self):
+        db = self.db
+        enrichment_cache.clear()
+        err, res = get_enriched_sequences(db, 'group', '2', top=2)
+        self.assertEqual(err, '')
+        self.assertEqual(res['group_size'], 9)
+        self.assertEqual(len(res['sequences']), 2)
+        self.assertEqual(res['sequences'][0]['sequence'], self.goodseq)
+        self.assertEqual(res['sequences'][0]['observed_samples'], 9)
+        self.assertEqual(res['sequences'][0]['total_observed'], 9)
+        self.assertEqual(res['sequences'][0]['taxonomy'], db.get_taxonomy(self.goodseq))
+        # min_observed filters the sequences
+        err, res = get_enriched_sequences(db, 'group', '2', top=100, min_observed=9)
+        self.assertEqual(res['sequences'][0]['sequence'], self.goodseq)
+        self.assertEqual({cseq['observed_samples'] for cseq in res['sequences']}, {9})
+        self.assertEqual(enrichment_cache.get_stats()['misses'], 1)
+        err, res = get_enriched_sequences(db, 'group', 'nonexistent')
+        self.assertTrue(err)
+        precompute_enrichment(db, fields=['group'])
+        self.assertEqual(len(enrichment_cache), len(db.sample_metadata['group'].unique()))
+
+        app = create_app(lambda: db, config={'SEQUENCE_INFO_LOG': None})
+        client = app.test_client()
+        res = client.get('/value/enriched_sequences', data=json.dumps({'field': 'group', 'value': '2', 'top': '2', 'min_observed': '1'}),
+                         content_type='application/json')
+        self.assertEqual(res.status_code, 200)
+        for cparams in [{'top': 'x'}, {'threshold': 'x'}, {'min_observed': 'x'}, {'threshold': [1]}, {'value': ['2']}]:
+            cparams = dict({'field': 'group', 'value': '2'}, **cparams)
+            res = client.get('/value/enriched_sequences', data=json.dumps(cparams), content_type='application/json')
+            self.assertEqual(res.status_code, 400, cparams)
+
+    def test_get_similar_samples(self):
+        db = self.db
+        err, res = get_similar_samples(db, [self.goodseq, self.badseq], top=3)
+        self.assertEqual(err, '')
+        self.assertEqual(res['query_features'], 2)
+        self.assertEqual(res['matched_features'], 2)
+        self.assertEqual(len(res['samples']), 3)
+        csample = res['samples'][0]
+        self.assertEqual(csample['shared_features'], 2)
+        self.assertEqual(csample['metadata']['group'], db.sample_metadata.loc[csample['sample_id'], 'group'])
+        err, res = get_similar_samples(db, [self.goodseq], metric='nonexistent')
+        self.assertTrue(err)
+        err, res = get_similar_samples(db, self.goodseq)
+        self.assertTrue(err)
+        err, res = get_similar_samples(db, [1, 2])
+        self.assertEqual(err, 'sequences must be a list of sequences')
+        err, res = get_similar_samples(db, [self.goodseq], counts={'a': 1})
+        self.assertEqual(err, 'counts must be a list of numbers')
+
+        app = create_app(lambda: db, config={'SEQUENCE_INFO_LOG': None})
+        client = app.test_client()
+        res = client.get('/samples/similar', data=json.dumps({'sequences': [self.goodseq], 'top': '2'}), content_type='application/json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(json.loads(res.data.decode())['samples']), 2)
+        for cparams in [{'top': 'x'}, {'top': [1]}, {'top': -1}, {'sequences': [1, 2]}, {'counts': 'x'}]:
+            cparams = dict({'sequences': [self.goodseq]}, **cparams)
+            res = client.get('/samples/similar', data=json.dumps(cparams), content_type='application/json')
+            self.assertEqual(res.status_code, 400, cparams)
+
 
 if __name__ == '__main__':
     main()
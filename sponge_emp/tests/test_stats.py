@@ -0,0 +1,54 @@
+from unittest import main, TestCase
+
+import numpy as np
+import scipy.sparse
+import scipy.stats
+
+from sponge_emp.stats import RankReference, binomial_pvals, ranksum_pvals, get_row_ranks
+
+
+class StatsTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.freq = np.array([0, 0, 0.1, 0.5, 0.1, 0, 0.3, 0.7, 0.7, 0])
+        self.group = np.array([False, False, True, True, False, False, True, True, True, False])
+
+    def test_rank_reference(self):
+        ranks = RankReference(self.freq)
+        np.testing.assert_array_equal(ranks.ranks(self.freq), scipy.stats.rankdata(self.freq))
+        self.assertEqual(ranks.num_samples, 10)
+        self.assertAlmostEqual(ranks.tie_correction, scipy.stats.tiecorrect(scipy.stats.rankdata(self.freq)))
+
+    def test_ranksum_pvals(self):
+        ranks = RankReference(self.freq)
+        rank_sums = [np.sum(ranks.ranks(self.freq[self.group])), np.sum(ranks.ranks(self.freq[~self.group]))]
+        pvals = ranksum_pvals(rank_sums, [np.sum(self.group), np.sum(~self.group)], 10, ranks.tie_correction)
+        stat, pval = scipy.stats.kruskal(self.freq[self.group], self.freq[~self.group])
+        self.assertAlmostEqual(pvals[0], pval)
+        # lower mean rank is not significant
+        self.assertEqual(pvals[1], 1)
+        # groups containing all / no samples
+        self.assertListEqual(list(ranksum_pvals([55, 0], [10, 0], 10, ranks.tie_correction)), [1, 1])
+
+    def test_get_row_ranks(self):
+        data = scipy.sparse.csr_matrix(np.array([self.freq, self.freq[::-1], np.zeros(10), np.ones(10)]))
+        entry_ranks, zero_ranks, tie_correction = get_row_ranks(data, 10)
+        for crow in range(4):
+            expected = scipy.stats.rankdata(data[crow].toarray().ravel())
+            ranks = np.full(10, zero_ranks[crow])
+            ranks[data[crow].indices] = entry_ranks[data.indptr[crow]:data.indptr[crow + 1]]
+            np.testing.assert_array_equal(ranks, expected)
+            self.assertAlmostEqual(tie_correction[crow], scipy.stats.tiecorrect(expected))
+        # per group tie correction
+        pvals = ranksum_pvals([35, 35], [5, 5], 10, tie_correction[[0, 2]])
+        self.assertLess(pvals[0], 1)
+        self.assertEqual(pvals[1], 1)
+
+    def test_binomial_pvals(self):
+        pvals = binomial_pvals([9, 2], [9, 11], 0.55)
+        self.assertAlmostEqual(pvals[0], scipy.stats.binom.cdf(0, 9, 0.55))
+        self.assertAlmostEqual(pvals[1], scipy.stats.binom.cdf(9, 11, 0.55))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,8 @@
 from unittest import main, TestCase
+from io import BytesIO, StringIO
 import os.path
-from sponge_emp.utils import get_data_path, getdoc, get_fasta_seqs
+import gzip
+from sponge_emp.utils import get_data_path, getdoc, get_fasta_seqs, iter_fasta_seqs, get_fasta_counts
 
 
 class SpongeEMPTests(TestCase):
@@ -30,5 +32,38 @@ class SpongeEMPTests(TestCase):
         self.assertEqual(len(seqs), 3)
         self.assertEqual(seqs[2], 'AAACCCGGGTTT')
 
+        # not a fasta file
+        self.assertIsNone(get_fasta_seqs(StringIO('AAAA\nCCCC\n')))
+
+    def test_iter_fasta_seqs(self):
+        fastafile = get_data_path('seqs1.fasta')
+        with open(fastafile, 'rb') as fl:
+            data = fl.read()
+        # binary and gzip compressed
+        self.assertEqual(list(iter_fasta_seqs(BytesIO(data))), ['AAGGAATTCC', 'ACGTACGTACGT', 'AAACCCGGGTTT'])
+        self.assertEqual(list(iter_fasta_seqs(BytesIO(gzip.compress(data)))), ['AAGGAATTCC', 'ACGTACGTACGT', 'AAACCCGGGTTT'])
+        # blank and comment lines
+        seqs = list(iter_fasta_seqs(StringIO('\n>s1\nAC\n\n;comment\nGT\n>s2\n\nTT')))
+        self.assertEqual(seqs, ['ACGT', 'TT'])
+        # fastq
+        seqs = list(iter_fasta_seqs(StringIO('@r1\nACGT\n+\n@@@@\n@r2\nTTGG\n+r2\nIIII\n')))
+        self.assertEqual(seqs, ['ACGT', 'TTGG'])
+        with self.assertRaises(ValueError):
+            list(iter_fasta_seqs(StringIO('@r1\nACGT\n-\n@@@@\n')))
+        # limits
+        self.assertEqual(len(list(iter_fasta_seqs(fastafile, max_records=3))), 3)
+        with self.assertRaises(ValueError):
+            list(iter_fasta_seqs(fastafile, max_records=2))
+        with self.assertRaises(ValueError):
+            list(iter_fasta_seqs(fastafile, max_bytes=20))
+        self.assertIsNone(get_fasta_seqs(fastafile, max_records=2))
+
+    def test_get_fasta_counts(self):
+        # size annotations are used and identical sequences are added
+        counts = get_fasta_counts(StringIO('>s1;size=10;\nACGT\n>s2 size=3\nTTGG\n>s3\nacgt\n>s4;size=x\nTTGG\n'))
+        self.assertEqual(counts, {'ACGT': 11, 'TTGG': 4})
+        self.assertEqual(get_fasta_counts(get_data_path('seqs1.fasta')), {'AAGGAATTCC': 1, 'ACGTACGTACGT': 1, 'AAACCCGGGTTT': 1})
+
+
 if __name__ == '__main__':
     main()
@@ -1,10 +1,16 @@
 import sys
 import inspect
 import os.path
+import io
+import gzip
+import re
 
 
 debuglevel = 2
 
+# the read count annotation in fasta headers (i.e. ">seq1;size=12")
+_SIZE_RE = re.compile(r'(?:^|[;\s])size=(\d+)')
+
 
 def debug(level, msg):
     """
@@ -74,51 +80,192 @@ def get_data_path(fn, subfolder='data'):
     return data_path
 
 
-def get_fasta_seqs(file):
-    '''Get sequences from a fasta file
+def _open_seqs_file(file):
+    '''Get an iterator over the text lines of a (possibly gzip compressed) file
+
+    Parameters
+    ----------
+    file : file
+        the text or binary io stream
+
+    Returns
+    -------
+    iterator of str
+        the lines of the file
+    '''
+    if isinstance(file, io.TextIOBase):
+        return file
+    # binary stream - check for the gzip magic number
+    if hasattr(file, 'peek'):
+        head = file.peek(2)[:2]
+    else:
+        head = file.read(2)
+        file.seek(0)
+    if head == b'\x1f\x8b':
+        debug(1, 'reading gzip compressed file')
+        file = gzip.GzipFile(fileobj=file, mode='rb')
+    return io.TextIOWrapper(file, encoding='ascii', errors='replace')
+
+
+def iter_fasta_records(file, max_records=None, max_bytes=None):
+    '''Iterate over the records (header and sequence) of a fasta or fastq file
+
+    The file can be gzip compressed. Blank lines and fasta ";" comment lines are ignored.
+    The lines of each sequence are joined once (when the sequence ends).
 
     Parameters
     ----------
     file : file or str
-        the text fasta file to process.
+        the fasta/fastq file to process (text or binary, optionally gzip compressed).
         If str, it is the name of the file. If file, it is the io stream
+    max_records : int or None (optional)
+        the maximal number of sequences to read. None (default) for no limit
+    max_bytes : int or None (optional)
+        the maximal number of (uncompressed) characters to read. None (default) for no limit
+
+    Yields
+    ------
+    (str, str)
+        the header (without the ">"/"@") and sequence (ACGT) of each record in the file
+
+    Raises
+    ------
+    ValueError
+        if the file is not a fasta/fastq file or is over the limits
+    '''
+    if isinstance(file, str):
+        debug(1, 'opening file %s' % file)
+        with open(file, 'rb') as fl:
+            yield from iter_fasta_records(fl, max_records=max_records, max_bytes=max_bytes)
+        return
+
+    lines = _open_seqs_file(file)
+    file_type = None
+    num_records = 0
+    num_bytes = 0
+    header = None
+    chunks = []
+    # the fastq line within the record (0=header, 1=sequence, 2=separator, 3=quality)
+    fastq_line = 0
+    for cline in lines:
+        num_bytes += len(cline)
+        if max_bytes is not None and num_bytes > max_bytes:
+            raise ValueError('file too big. maximal size is %d' % max_bytes)
+        cline = cline.strip()
+        if not cline:
+            continue
+        if file_type is None:
+            if cline[0] == '>':
+                file_type = 'fasta'
+            elif cline[0] == '@':
+                file_type = 'fastq'
+            else:
+                raise ValueError('not a fasta/fastq file')
+        if file_type == 'fasta':
+            if cline[0] == '>':
+                if chunks:
+                    yield header, ''.join(chunks)
+                    chunks = []
+                header = cline[1:]
+                num_records += 1
+            elif cline[0] == ';':
+                continue
+            else:
+                chunks.append(cline)
+        else:
+            if fastq_line == 0:
+                if cline[0] != '@':
+                    raise ValueError('fastq record does not start with "@"')
+                header = cline[1:]
+                num_records += 1
+            elif fastq_line == 1:
+                yield header, cline
+            elif fastq_line == 2 and cline[0] != '+':
+                raise ValueError('fastq separator line does not start with "+"')
+            fastq_line = (fastq_line + 1) % 4
+        if max_records is not None and num_records > max_records:
+            raise ValueError('too many sequences. maximal number is %d' % max_records)
+    # process the last sequence
+    if chunks:
+        yield header, ''.join(chunks)
+    debug(1, 'read %d sequences' % num_records)
+
+
+def iter_fasta_seqs(file, max_records=None, max_bytes=None):
+    '''Iterate over the sequences of a fasta or fastq file
+
+    Parameters
+    ----------
+    see iter_fasta_records()
+
+    Yields
+    ------
+    str
+        the sequences (ACGT) in the file
+
+    Raises
+    ------
+    ValueError
+        if the file is not a fasta/fastq file or is over the limits
+    '''
+    for cheader, csequence in iter_fasta_records(file, max_records=max_records, max_bytes=max_bytes):
+        yield csequence
+
+
+def get_fasta_counts(file, max_records=None, max_bytes=None):
+    '''Get the number of reads of each sequence in a fasta or fastq file
+
+    The number of reads of a record is taken from a "size=N" header annotation (i.e. dereplicated usearch/vsearch output),
+    otherwise each record is one read. Reads of identical sequences (case insensitive) are added.
+
+    Parameters
+    ----------
+    see iter_fasta_records()
+
+    Returns
+    -------
+    dict of {sequence(str): count(int)}
+        the upper case sequences and their read counts
+
+    Raises
+    ------
+    ValueError
+        if the file is not a fasta/fastq file or is over the limits
+    '''
+    counts = {}
+    for cheader, csequence in iter_fasta_records(file, max_records=max_records, max_bytes=max_bytes):
+        size = _SIZE_RE.search(cheader)
+        csequence = csequence.upper()
+        counts[csequence] = counts.get(csequence, 0) + (int(size.group(1)) if size else 1)
+    return counts
+
+
+def get_fasta_seqs(file, max_records=None, max_bytes=None):
+    '''Get sequences from a fasta (or fastq) file
+
+    Parameters
+    ----------
+    file : file or str
+        the text fasta file to process.
+        If str, it is the name of the file. If file, the (text or binary, optionally gzip compressed) io stream
         NOTE: file is closed after the read
+    max_records : int or None (optional)
+        the maximal number of sequences to read. None (default) for no limit
+    max_bytes : int or None (optional)
+        the maximal number of (uncompressed) characters to read. None (default) for no limit
+
     Returns
     -------
     seqs : list of str sequences (ACGT)
-        the sequences in the fasta file
+        the sequences in the fasta file, or None if the file is not a fasta file (or is over the limits)
     '''
     debug(1, 'reading fasta file')
     try:
-        if isinstance(file, str):
-            debug(1, 'opening file %s' % file)
-            file = open(file)
-
-        seqs = []
-        cseq = ''
-        isfasta = False
-        for cline in file:
-            cline = cline.strip()
-            if cline[0] == '>':
-                isfasta = True
-                if cseq:
-                    seqs.append(cseq)
-                cseq = ''
-            else:
-                cseq += cline
-        # process the last sequence
-        if cseq:
-            seqs.append(cseq)
-
-        file.close()
-
-        # test if we encountered '>'
-        if not isfasta:
-            debug(2, 'not a fasta file')
-            return None
-
-        debug(1, 'read %d sequences' % len(seqs))
-        return seqs
-    except:
-        debug(3, 'fasta file read failed. error encountered')
+        seqs = list(iter_fasta_seqs(file, max_records=max_records, max_bytes=max_bytes))
+    except (ValueError, OSError) as err:
+        debug(3, 'fasta file read failed. error encountered: %s' % err)
         return None
+    finally:
+        if not isinstance(file, str):
+            file.close()
+    return seqs